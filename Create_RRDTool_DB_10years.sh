@@ -1,3 +1,9 @@
+# Generated from the schema in rrdschema.py: python rrdschema.py script CHZZ_mppt.rrd
+# (Insert8.3.py creates missing station RRDs itself with the same layout.)
+# Tiered layout:
+#   1 minute rows for 14 days, 5 minute / hourly / daily AVERAGE, MIN and MAX
+#   rows for 90 days / 2 years / 10 years. ~59 MB per station.
+# Existing files are converted with: python rrdschema.py migrate *_mppt.rrd
 rrdtool create CHZZ_mppt.rrd --step 60 \
 DS:Adc_vb_f:GAUGE:600:0:65535 \
 DS:Adc_va_f:GAUGE:600:0:65535 \
@@ -45,8 +51,15 @@ DS:Alarm_LO_daily:GAUGE:600:0:127 \
 DS:Vb_min:GAUGE:600:0:65535 \
 DS:Vb_max:GAUGE:600:0:65535 \
 DS:Comm_Duration:GAUGE:600:0:600 \
-RRA:AVERAGE:0.5:1:1051200 \
-RRA:MIN:0.5:1:1051200 \
-RRA:MAX:0.5:1:1051200
+RRA:AVERAGE:0.5:1:20160 \
+RRA:AVERAGE:0.5:5:25920 \
+RRA:MIN:0.5:5:25920 \
+RRA:MAX:0.5:5:25920 \
+RRA:AVERAGE:0.5:60:17520 \
+RRA:MIN:0.5:60:17520 \
+RRA:MAX:0.5:60:17520 \
+RRA:AVERAGE:0.5:1440:3660 \
+RRA:MIN:0.5:1440:3660 \
+RRA:MAX:0.5:1440:3660
 
 
@@ -42,7 +42,9 @@
 # Round Robin Database Tool is the database of choice for this program. Strict layout of RRD Tool Creation formats must be followed.
 # The convension for this program is to name the RRD Database as: StationName_mppt.rrd i.e. LCCR_mppt.rrd
 # future versions that track other SOH data will use a similar convention. This will help with graphing from multiple RRD databases...
-# A ten year database is approximatly 1M bytes in size. And since it is a ring, it will overwrite in 10 years.
+# A ten year database (rrdschema.py layout: 1 minute rows for 14 days, then 5 minute, hourly
+# and daily rollups out to 10 years) is approximatly 59M bytes in size. And since it is a ring, it will overwrite in 10 years.
+# The original single tier layout (1,051,200 one minute rows x3) was ~1.16G bytes and held 2 years.
 #
 #
 #
@@ -99,634 +101,317 @@
 # Exception Handeling added for checksum / string 
 # -----------------------------------------------------------------------
 #-----------------------------------------------------------------------
-vfactor = 100.0/32768   # Volts
-vrfactor = 99.667/32768 # Volts
-ifactor = 79.16/32768   # Amps
-ahfactor = 0.1          # Amp Hours (basically div by 10)
-pofactor = 989.5/65536  # Watts
-ohmfactor = 1.263/32768 # Ohms
-perfactor = 100/256     # percent
-
-nameOffset   = 0  # Offset in List for variable's name string
-scalerOffset = 1  # Offset in List for scaler factor value
-unitsOffset  = 2  # Offset in List for units of scale factor
-
-StnName = 0       # Offset in Station info List for name string
-StnIP = 1         # Offset in Station info List for IP address
-StnPort = 2       # Offset in Station info List for Port Number
-
-# Charge State Values... see RRD charts for example/explanations...
-PChrgState = ["START",
-              "NIGHT_CHECK",
-  	      "DISCONNECT",
- 	      "NIGHT",
-	      "FAULT",
-	      "BULK_CHARGE",
-	      "ABSORPTION",
-	      "FLOAT",
-	      "EQUALIZE"]
-
-# Charge State with load
-PLoadState = ["START",
-              "LOAD_ON",
- 	      "LVD_WARNING",
-	      "LVD",
-              "FAULT",
-  	      "DISCONNECT"]
-
-# LED State Values
-PLedState = ["LED_START",
-             "LED_START2",
-             "LED_BRANCH",
-             "EQUALIZE (FAST GREEN BLINK)",
-             "FLOAT (SLOW GREEN BLINK)",
-             "ABSORPTION (GREEN BLINK, 1HZ)",
-             "GREEN_LED",
-             "UNDEFINED",
-             "YELLOW_LED",
-             "UNDEFINED",
-             "BLINK_RED_LED",
-             "RED_LED",
-             "R-Y-G ERROR",
-             "R/Y-G ERROR",
-             "R/G-Y ERROR",
-             "R-Y ERROR (HTD)",
-             "R-G ERROR (HVD)",
-             "R/Y-G/Y ERROR",
-             "G/Y/R ERROR",
-             "G/Y/R x 2"]
-
-# Array Fault identified by Self-Diagnostics (bit field)
-#                      Name       bit=0      bit=1
-PArryFault = [["Overcurrent ", "No Fault", "Fault"],
-              ["FETs shorted", "No Fault", "Fault"],
-              ["Software bug", "No Fault", "Fault"],
-              ["Battery HVD ", "No Fault", "Fault"],
-              ["Array HVD   ", "No Fault", "Fault"],
-              ["EEPROM setting reset required ", "No Fault", "Fault"],
-              ["RTS shorted ", "No Fault", "Fault"],
-              ["RTS was valid now disconnected", "No Fault", "Fault"],
-              ["Local temp. sensor failed     ", "No Fault", "Fault"],
-              ["Fault 10    ", "No Fault", "Fault"],
-              ["Fault 11    ", "No Fault", "Fault"],
-              ["Fault 12    ", "No Fault", "Fault"],
-              ["Fault 13    ", "No Fault", "Fault"],
-              ["Fault 14    ", "No Fault", "Fault"],
-              ["Fault 15    ", "No Fault", "Fault"],
-              ["Fault 16    ", "No Fault", "Fault"]]
-
-# Load Fault identified by self diagnostics (bit field)
-#                      Name                 bit=0      bit=1
-PLoadFault = [["External Short Circuit   ", "No Fault", "Fault"],
-              ["Overcurrent              ", "No Fault", "Fault"],
-              ["FETs shorted             ", "No Fault", "Fault"],
-              ["Software bug             ", "No Fault", "Fault"],
-              ["HVD                      ", "No Fault", "Fault"],
-              ["Heatsink over-temperature", "No Fault", "Fault"],
-              ["EEPROM setting reset required ", "No Fault", "Fault"],
-              ["Fault 8                  ", "No Fault", "Fault"]]
-
-# Dip Switch settings (bit field)
-# ... 4 position dip switch. 
-# ... PDipSwitch[0][0] - Switch 1 Name string
-# ... PDipSwitch[0][1] - Switch 1, '0' (off) value string
-# ... PDipSwitch[0][0] - Switch 1, '1' (on) value string
-# ... PDipSwitch[1][0] - Switch 2 Name string
-# ... PDipSwitch[1][1] - Switch 2, '0' (off) value string
-# ... PDipSwitch[1][0] - Switch 2, '1' (on) value string
-dSwON = 2  # offset for switch ON state message
-dSwOFF = 1 # offset for switch OFF state message
-dSwNAM = 0 # offset for switch name
-#                dSwNAM               dSWOFF                 dSwON
-PDipSwitch = [["Battery Type", "User Select Jumper", "Custom Battery Settings"],
-              ["LVD / LVR   ", "11.5V / 12.6V", "Custom Load Settings"],
-              ["Equalize    ", "Disabled", "Enabled"],
-              ["Comm Select ", "Meterbus", "MODBUS"]]
-
-
-
-# Create name / scale factor lists / units
-# These items are order dependent. The message list index is used
-# as an index to this list. This list is ordered and needs to 
-# be contigious!
-#
-# In order to scale and/or decode items the Scale Factor field is used
-# to indicate what kind of items it is. Right now the following values
-# are used to 'steer' the decoding / scaling process.
-#
-# Key to Scaler Field -
-#  ' 1': The item is already in the proper format, no scaling necessary
-#
-#  '-1': Use the list named in the Units field to process State values
-#      and the actual value of the param as the index to that list.
-#           [Name String,  -1, "Name of List to use State Decode"]
-#
-#  '-2': Use the list named in the Units field to process bit encoded
-#      information. Pass the param value to 'bitdecode' function for
-#      processing.
-#           [Name String,  -2, "Name of List to use Bit Decode"]
-#
-#  '-3': Indicates the param is the upper word of a 32/24 value (_HI).
-#      Use this value plus the next param to form the Long integer.
-#      Scale factor is stored in _HI 'unitsOffset' (Units) position
-#      Units string is stored in _LO 'unitsOffset' (Units) position 
-#           [Name String,  -3, Scale Factor]
-#           [Name String,  -4, Units String]
-#
-#  '-4': Indicates the param is part of a Long integer (see -3 above)
-#      and ignore processing
-#
-#  All other value are considered valid scale factors
-#
-#           [Name String,  Scale Factor, Units String]
-# --------------------------------------------------------
-PStatLst = [["Adc_vb_f", vfactor, "V"],
-            ["Adc_va_f", vfactor, "V"],
-            ["Adc_vl_f", vfactor, "V"],
-	    ["Adc_ic_f", ifactor, "A"],
-	    ["Adc_il_f", ifactor, "A"],
-            ["T_hs", 1, "deg C"],
-            ["T_batt", 1, "deg C"],
-            ["T_amb", 1, "deg C"],
-            ["T_rts", 1, "deg C"],
-            ["Charge_State", -1, PChrgState],
-            ["Array_Fault", -2, PArryFault],
-            ["Vb_f", vfactor, "V"],
-            ["Vb_ref", vrfactor, "V"],
-            ["Ahc_r_HI", -3, ahfactor],
-            ["Ahc_r_LO", -4, "Ah"],
-            ["Ahc_t_HI", -3, ahfactor],
-            ["Ahc_t_LO", -4, "Ah"],
-            ["KWhc", ahfactor, "Ah"],
-            ["Load_State", -1, PLoadState],
-            ["Load_Fault", -2, PLoadFault],
-            ["V_lvd", vfactor, "V"],
-            ["Ahl_r_HI", -3, ahfactor],
-            ["Ahl_r_LO", -4, "Ah"],
-            ["Ahl_t_HI", -3, ahfactor],
-            ["Ahl_t_LO", -4, "Ah"],
-            ["Hourmeter_HI", -3, 1],
-            ["Hourmeter_LO", -4, "Hours"],
-            ["Alarm_HI", 1, "(bit field hi)"],
-            ["Alarm_LO", 1, "(bit field lo)"],
-            ["Dip_Switch", -2, PDipSwitch],
-            ["LED_State", -1, PLedState],
-            ["Power_out", pofactor, "W"],
-            ["Sweep_Vmp", vfactor, "V"],
-            ["Sweep_Pmax", pofactor, "W"],
-            ["Sweep_Voc", vfactor, "V"],
-            ["Vb_min_daily", vfactor, "V"],
-            ["Vb_max_daily", vfactor, "V"],
-            ["Ahc_daily", ahfactor, "Ah"],
-            ["Ahl_daily", ahfactor, "Ah"],
-            ["Array_Fault_daily", 1, "(bit field)"],
-            ["Load_Fault_daily", 1, "(bit field)"],
-            ["Alarm_HI_daily", 1, "(bit field hi)"],
-            ["Alarm_LO_daily", 1, "(bit field lo)"],
-            ["Vb_min", vfactor, "V"],
-            ["Vb_max", vfactor, "V"]]
-
-# Logged Data Record Message variable names and scale factors
-PLogLst = [["hourmeter", 1, "Hours"],
-           ["alarm_daily", 1, "(bit field)"],
-           ["Vb_min_daily", vfactor, "V"],
-           ["Vb_max_daily", vfactor, "V"],
-           ["Ahc_daily", ahfactor, "Ah"],
-           ["Ahl_daily", ahfactor, "Ah"],
-           ["array_Fault_daily", 1, "(bit field)"],
-           ["load_Fault_daily",1, "(bit field)"],
-           ["Va_max_daily", vfactor, "V"],
-           ["Time_ab_daily", 1, "Min"],
-           ["Time_eq_daily", 1, "Min"],
-           ["Time_fl_daily", 1, "Min"],
-           ["reserved1", 1, " "],
-           ["reserved2", 1, " "],
-           ["reserved3", 1, " "]]
+# 10/18/26
+#-----------------------------------------------------------------------
+# Register tables, checksum and the do* decode/print functions moved to
+# mppt.py so they can be shared with the new concurrent poller (poller.py).
+# Stations are no longer polled one after the other. Up to MaxInFlight
+# stations are on the wire at a time, so one dead cell modem no longer
+# holds up every station behind it.
+#
+# PollMode picks how stations are talked to:
+#   'oneshot'    - new socket per station per poll (R, frame, T, close).
+#   'persistent' - one long lived socket per station (connpool.py), R/T
+#                  sent down it each poll. Saves the connect on cell links.
+#   'passive'    - long lived sockets, no requests at all. The newest frame
+#                  the translator sent in Timed mode (every 5 sec) is used.
+# Dropped persistent sockets are reconnected with exponential backoff.
+#
+# RRD writes are buffered (rrdstore.py). Each sample keeps its capture time
+# and up to RRDBatch timestamps go to a station's RRD in one update call.
+# Nothing waits longer than RRDMaxAge seconds. Set RRDDaemon to have the
+# updates go through rrdcached. 'kill -USR1' this script to write out all
+# buffered samples (all.sh does this before graphing).
+#
+# No more fixed 3 minute sleep. Each station is polled every PollInterval
+# seconds on its own schedule (scheduler.py), jittered so they don't all
+# connect at once. An optional 4th StationList field overrides the
+# interval for that station:  LCCR_mppt,166.140.171.251,5000,300
+# StationList.txt is re-read every StationReload seconds.
+#
+# Timeouts adapt per station (linkhealth.py). SockTimeout is now only the
+# ceiling: once a link has a few good polls its connect and receive
+# timeouts come from its own recent connect times and Comm_Durations
+# (seeded from the Comm_Duration in its RRD at start up), so a dead LAN
+# radio is given up on in seconds instead of 30. A station that fails
+# BreakerTrip polls in a row is only probed every ProbeInterval seconds
+# until it answers again.
+#
+# The RRD layout is tiered (rrdschema.py, about 59M instead of 1.16G a
+# station) and defined once, from PStatLst plus Comm_Duration. A missing
+# StationName.rrd is created when the station list is read, and the
+# update values are filled from the frame's register text through a
+# template compiled at start up.
+#
+# Samples go to the storage backends in StorageBackends (storage.py):
+#   'rrd' - the StationName.rrd files as before
+#   'raw' - every sample unconsolidated, one column file per register
+#           under RawPath (rawstore.py), for analytics with NumPy
+#
+# After an outage run backfill.py: it finds the days missing from each
+# station's RRD and reads those days' MPPT daily log records (PLogLst)
+# into StationName_daily.csv.
+#
+# The log is written by logsink.py instead of print statements on a
+# redirected sys.stdout: one whole line per sample (LogFormat 'csv', the
+# lines shown above, or 'jsonl'), buffered and written by a background
+# thread, and rotated (gzip'ed) at LogMaxBytes or LogRotate seconds,
+# keeping LogKeep old logs. Error messages still go to the same file.
+#
+# Each poll is timed in phases (metrics.py): resolve, connect, request,
+# receive, release ('T\r'), checksum, decode, store (rrdtool.update) and
+# log, as per-station histograms, with counters for checksum mismatches,
+# timeouts and connection errors. They are served in the Prometheus text
+# format on http://127.0.0.1:MetricsPort/metrics (None to turn it off).
+#
+# CaptureFrames = True keeps every frame received, as received, in
+# gzip'ed hourly segments under CapturePath (capture.py). 'python
+# capture.py replay' runs them back through the checksum, decoder and
+# storage, to reproduce a bug or to re-ingest after a schema change.
+#
+# For big fleets supervisor.py runs several of these, each started with
+#   --shard i/n --metrics-port p
+# to poll only the stations that hash to shard i (supervisor.shardOf),
+# with its own log (Insert8.3-shard<i>.log) and capture directory.
+# Started with no arguments it polls every station as before.
+#
+# StationList.txt is read by stations.py. It is no longer re-read every
+# minute: its mtime is looked at every StationReload seconds and it is
+# only read when it changed. Every line is checked. A bad one is
+# reported with its line number and skipped, where it used to end the
+# read and drop every station after it. Optional key=value fields after
+# the port (or interval) give a station its own settings:
+#   LCCR_mppt,166.140.171.251,5000,300,link=cell,timeout=20,rrd=/data/LCCR_mppt.rrd
+# interval, timeout (longest connect / receive timeout), link (lan,
+# radio or cell, a default timeout) and rrd (its RRD file). graphs.py,
+# dashboard.py and backfill.py read the list the same way. --stations
+# names another list file.
+#
+# Each decoded sample goes through the alert rules (alerts.py) as it
+# comes in: Vdiff near the LVD, Load_State LVD_WARNING / LVD / FAULT /
+# DISCONNECT, Charge_State FAULT, Array_Fault / Load_Fault bits and the
+# Alarm bits. A condition is sent once when it comes on and once when it
+# clears (reminded every hour while on, rate limited per station) to the
+# AlertSinks: the log, AlertFile (JSON lines), the AlertSocket Unix
+# datagram socket and / or a POST to AlertWebhook.
+#
+# analytics.py works out each station's battery health per day (Ah in /
+# out, closest approach to the LVD, overnight sag, hours in ABSORPTION /
+# FLOAT) into StationName_health.csv, only adding the new days on each
+# run, and prints a fleet summary with the stations to watch.
+#
+# fleet.py reduces every station's RRD (xported in parallel) to one
+# fleet.rrd: stations reporting, worst / 10th percentile / median Vbatt
+# - LVD, stations in LVD, and Comm_Duration percentiles. graphs.py draws
+# the Fleet_*_graph.png summaries from it, and past a dozen stations
+# they replace the one line per station CommDura_graph.png.
+#
+# export.py streams any stations, registers and time range out of the
+# raw store or the RRDs to CSV, JSON lines or NPZ, scaled with the
+# PStatLst factors (or as raw counts), a chunk at a time in parallel so
+# a 10 year export needs no more memory than a day's.
+#
+# LogDelta = True keeps the last sample of each station (delta.py) and
+# logs a whole line only once an hour. The lines between give the state
+# / fault / alarm transitions (Charge_State,FLOAT>BULK_CHARGE) and the
+# VBatt / Vlvd steps. 'delta' in StorageBackends archives every sample
+# the same way under DeltaPath: register changes in raw counts, a whole
+# sample per station each hourly segment, and every transition in
+# changes.log ('python delta.py changes' for what changed, and when).
+#
+# The last LiveSamples samples of each station are kept in memory (live.py)
+# and served on the LiveSocket Unix socket: 'python live.py latest' or
+# 'python live.py last 30 MARC_mppt' shows them without anything going
+# out to the stations. dashboard.py --live serves them as /latest.
+#-----------------------------------------------------------------------
+#-----------------------------------------------------------------------
 
-#these globals need to be defined.
-params = None
-data = None
+PollMode = 'oneshot'  # 'oneshot', 'persistent' or 'passive', see above
+MaxInFlight = 32  # most stations polled at the same time (oneshot mode)
+SockTimeout = 30  # max seconds per connect/send/receive. 30 seconds worked well in testing for cell....
+ProbeInterval = 900  # seconds between polls of a station that keeps failing
+BreakerTrip = 5   # failed polls in a row before a station goes to ProbeInterval
+PollInterval = 60 # default seconds between polls of a station (the RRD step)
+PollJitter = 0.1  # +/- fraction of the interval to spread polls out
+StationReload = 5  # seconds between checks for a changed StationList.txt
+RRDPath = '/home/mbiundo/Desktop/MCSOH/RRDTool/Insert8/'  # where the StationName.rrd files live
+RRDHeartbeat = 600  # the heartbeat the RRDs were created with
+RRDBatch = 5      # samples per RRD per update call
+RRDMaxAge = 600   # seconds a sample may sit in the buffer (the RRD heartbeat)
+RRDDaemon = None  # rrdcached address e.g. 'unix:/var/run/rrdcached.sock', None to write directly
+StorageBackends = ['rrd']  # add 'raw' to also keep every raw sample (rawstore.py), 'delta' for the change-only archive (delta.py)
+RawBatch = 60     # samples per station per raw store write
+LogFile = 'Insert8.3.log'  # in the directory the script is started from
+LogFormat = 'csv'  # 'csv' or 'jsonl' (one JSON object per sample)
+LogDelta = False  # True for change-only log lines, a whole line per station an hour (delta.py)
+LogMaxBytes = 10 * 1024 * 1024  # rotate the log at this size...
+LogRotate = 86400  # ...or after this many seconds
+LogKeep = 14      # rotated logs kept, gzip'ed
+LogFlush = 5      # seconds between writes of the log buffer
+MetricsPort = 9108  # local port for /metrics, None for no endpoint
+LiveSamples = 180  # recent samples kept in memory per station for LiveSocket (live.py)
+CaptureFrames = False  # True to archive every raw frame (capture.py)
+AlertSinks = ['log', 'file']  # any of 'log', 'file', 'socket', 'webhook' (alerts.py)
+AlertWebhook = None  # URL alerts are POSTed to with 'webhook'
+
+# declare the path to the input file
+#sfpath = ("C:\\Users\\Dan\\Desktop\\Radio Modbus Stuff")
+sfpath = ("/home/mbiundo/Desktop/MCSOH/RRDTool/Insert8/")
+RawPath = sfpath + 'raw/'  # raw store, one directory per station
+DeltaPath = sfpath + 'delta/'  # change-only archive segments and changes.log
+StationFile = sfpath + 'StationList.txt'  # the station list (stations.py)
+CapturePath = sfpath + 'capture/'  # raw frame archive segments
+AlertFile = sfpath + 'alerts.jsonl'  # 'file' alert sink
+AlertSocket = sfpath + 'alerts.sock'  # 'socket' alert sink, a Unix datagram socket
+LiveSocket = sfpath + 'live.sock'  # latest samples served here (live.py), None for no socket
 
 import time
-import socket
 import os
-import rrdtool
+import signal
+import socket
 import sys
 
-#added to handle a bad checksum beteen remote string and recieved string.
-#make note and move to the next station, then try again.
-#if you get to many,comment out the station in the station file... #stationlist....
-class BadChecksum(Exception):
-  pass
-
-# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-# -------------------------------------------------------------------
-# -------------------------------------------------------------------
-# ------------ Start of Various Functions Definitions ---------------
-# -------------------------------------------------------------------
-# -------------------------------------------------------------------
-# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+from mppt import BadChecksum, doStatus
+from poller import pollStations
+from connpool import ConnectionPool
+from rrdstore import RRDWriter
+from scheduler import Scheduler
+from linkhealth import LinkHealth, rrdDurations
+import rrdschema
+from storage import RRDStorage, Storages
+from rawstore import RawStore
+from delta import DeltaEncoder, DeltaStore
+import live
+from logsink import LogSink
+from capture import FrameArchive
+import metrics
+from supervisor import shardOf
+from stations import StationRegistry
+from alerts import AlertEngine, FileSink, PrintSink, SocketSink, WebhookSink, alertRules
+
+# Command line, when run by supervisor.py: --shard i/n --metrics-port p
+Shard, Shards = 0, 1
+args = sys.argv[1:]
+while args:
+    arg = args.pop(0)
+    if arg == '--shard' and args:
+        Shard, Shards = [int(v) for v in args.pop(0).split('/')]
+    elif arg == '--metrics-port' and args:
+        MetricsPort = int(args.pop(0))
+    elif arg == '--stations' and args:
+        StationFile = args.pop(0)
+    else:
+        print 'usage: %s [--shard i/n] [--metrics-port port] [--stations StationList.txt]' % sys.argv[0]
+        sys.exit(1)
+if Shards > 1:
+    LogFile = LogFile.replace('.log', '') + '-shard%d.log' % Shard
+    CapturePath = CapturePath + 'shard%d/' % Shard
+    DeltaPath = DeltaPath + 'shard%d/' % Shard
+    AlertFile = AlertFile.replace('.jsonl', '') + '-shard%d.jsonl' % Shard
+    if LiveSocket:
+        LiveSocket = LiveSocket.replace('.sock', '') + '-shard%d.sock' % Shard
+
+# rrdtool.update template, 45 MPPT registers then Comm_Duration (rrdschema.DSList)
+Update = rrdschema.UpdateTemplate()
 
 # ===================================================================
-# calculate and returns the XOR checksum for pass string
-# ------------------------------------------------------
-# ...Assumes string starts with a '$' and it is not included
-# ...in the checksum calculation.
+# A poll finished. Update the link health and reschedule the station,
+# on the slow probe schedule while its breaker is open.
 # ===================================================================
-def checksum(d):
-  csum = 0
-  dend = d.find('*')
-  for x in d[1:dend]:
-    csum ^= ord(x)
-  return csum
-# ... End checksum Function
+def pollDone(StationName, ok, Comm_Duration=None):
+    stats.count('polls' if ok else 'poll_failures', StationName)
+    health.record(StationName, ok, Comm_Duration)
+    sched.done(StationName, ok, interval=health.interval(StationName))
+# ... End pollDone Function ...
 
 # ===================================================================
-# message send function
-# ---------------------
-#  returns the number chars sent
+# Handle one finished poll: check, decode and log the frame, hand it
+# to the storage backends and tell the scheduler how it went.
+# 'data' is None when the poll failed (already reported).
 # ===================================================================
-def mysend(sock, msg,  StationName):
-    totalsent = 0
-    #Exception handeling for send sockets.
+def doResult(StationName, data, Comm_Duration, stamp):
+    if data is None:
+        pollDone(StationName, False)
+        return
+    if capture is not None:
+        capture.add(StationName, stamp, Comm_Duration, data)
     try:
-        while totalsent < len(msg):
-            sent = sock.send(msg[totalsent:])
-            totalsent = totalsent + sent
-    except (socket.timeout, socket.error) as e:
-        print 'Station %s send error: %s' % (StationName, e)
-        raise
-    return totalsent
-# ... End mysend Function ...
-
-# ===================================================================
-# data string recieve function
-# ----------------------------
-# Loops to get data from addressed socket either until the buffer
-# is filled or the end of message. All these chunks are then joined
-# and the new string is returned
-# ===================================================================
-def myreceive(sock, buflen,  StationName):
-    chunks = []
-    bytes_recd = 0
-    #Exception handling for recieve sockets.
-    try:
-        while bytes_recd < buflen:
-            chunk = sock.recv(min(buflen - bytes_recd, 2048))
-            chunks.append(chunk)
-            if chunk.find("\r\n") > 0:
-              break
-            bytes_recd = bytes_recd + len(chunk)
-    except (socket.timeout, socket.error) as e:
-        print 'Station %s receive error: %s' % (StationName, e)
-        raise
-    return ''.join(chunks)
-
-#New CSV format for output/cronlog
-formatCSV = '%s,%.2f,%s,'
-
-#the doFunctions print the output to stdio... redirect as needed.
-
-# ===================================================================
-# Function to parse out and display battery voltage from battery voltage
-# status message 
-# ===================================================================
-def doVbattery(params):
-    sf = int(params[0])*PStatLst[0][scalerOffset]
-    ns = PStatLst[0][nameOffset]
-    units = PStatLst[0][unitsOffset]
-# Origninal print statement
-#    print format % (20, 'Battery Voltage', 4, ' 9', 12, ns, 8, sf, 10, ' '+units)
-# New CSV formatted print statement for output/cronlog.
-    print formatCSV % ('VBatt',sf,''+units), 
-# ... End doVbattery Function ...
-
-# ===================================================================
-# Function to parse out and display array voltage from array voltage
-# status message 
-# ===================================================================    
-def doVarray(params):
-    sf = int(params[1])*PStatLst[1][scalerOffset]
-    ns = PStatLst[1][nameOffset]
-    units = PStatLst[1][unitsOffset]
-#    print format % (20, 'Array Voltage', 4, '10', 12, ns, 8, sf, 10, ' '+units)    
-# ... End doVarray Function ...
-
-# ===================================================================
-# Function to parse out and display load voltate from voltage
-# status message 
-# ===========================doShortScan========================================    
-def doVload(params):
-    sf = int(params[2])*PStatLst[2][scalerOffset]
-    ns = PStatLst[2][nameOffset]
-    units = PStatLst[2][unitsOffset]
-#    print format % (20, 'Load Voltage', 4, '11', 12, ns, 8, sf, 10, ' '+units) 
-# ... End doVload Function ...
-
-# ===================================================================
-# Function to parse out and display load current from current
-# status message 
-# ===================================================================
-def doLoadCurrent(params):
-  sf = int(params[4])*PStatLst[4][scalerOffset]
-  ns = PStatLst[4][nameOffset]
-  units = PStatLst[4][unitsOffset]
-#  print format % (20, 'Load Current', 4, '13', 12, ns, 8, sf, 10, ' '+units)
-# ... End doLoadCurrent Function ...
-
-# ===================================================================
-# Function to parse out and display load current from current
-# status message 
-# ===================================================================
-def doChargingCurrent(params):
-  sf = int(params[3])*PStatLst[3][scalerOffset]
-  ns = PStatLst[3][nameOffset]
-  units = PStatLst[3][unitsOffset]
-#  print format % (20, 'Charging Current', 4, '12', 12, ns, 8, sf, 10, ' '+units)
-# ... End doChargingCurrent Function ...
-
-
-t_format  = '%-*s%-*s%-*s%*.2f%-*s%s%.1f%s'
-# ===================================================================
-# Function to parse out and display heatsink temperature from heatsink temperature
-# status message 
-# ===================================================================
-def doTempheatsink(params):
-  sf = int(params[5])*PStatLst[5][scalerOffset]
-  sf1 = int(params[5])*1.8 + 32
-  ns = PStatLst[5][nameOffset]
-  units = PStatLst[5][unitsOffset]
-#  print t_format % (20, 'Heatsink Temp', 4, '14', 12, ns, 8, sf, 6, ' '+units, ' (', sf1, 'F)')
-# ... End doTempheatsink Function ...
-    
-# ===================================================================
-# Function to parse out and display battery temperature IF probe connected! from battery temperature
-# status message ambient if rts not connected.
-# ===================================================================    
-def doTempBattery(params):
-  sf = int(params[6])*PStatLst[6][scalerOffset]
-  sf1 = int(params[6])*1.8 + 32
-  ns = PStatLst[6][nameOffset]
-  units = PStatLst[6][unitsOffset]
-#  print t_format % (20, 'Battery Temp', 4, '15', 12, ns, 8, sf, 6, ' '+units, ' (', sf1, 'F)')
-# ... End doTempBattery Function ...
-
-# ===================================================================
-# Function to parse out and display ambient temperature from ambient
-# temp from current status message 
-# ===================================================================
-def doTempAmbient(params):
-  sf = int(params[7])*PStatLst[7][scalerOffset]
-  sf1 = int(params[7])*1.8 + 32
-  ns = PStatLst[7][nameOffset]
-  units = PStatLst[7][unitsOffset]
-#  print t_format % (20, 'Ambient Temp', 4, '16', 12, ns, 8, sf, 6, ' '+units, ' (', sf1, 'F)')
-# ... End doTempAmbient Function ...
-
-# ===================================================================
-# Function to parse out and display rts temperature sensor
-# status message. 0x80 if not connected.
-# ===================================================================
-def doTemprts(params):
-  sf = int(params[8])*PStatLst[8][scalerOffset]
-  sf1 = int(params[8])*1.8 + 32
-  ns = PStatLst[8][nameOffset]
-  units = PStatLst[8][unitsOffset]
-#  print t_format % (20, 'RTS Temp', 4, '17', 12, ns, 8, sf, 6, ' '+units, ' (', sf1, 'F)')
-# ... End doTemprts Function ...
-
-# ===================================================================
-# Function to parse out and display load current from current
-# status message 
-# Charge State Values
-# PChrgState = ["START",
-#              "NIGHT_CHECK",
-#              "DISCONNECT",
-#              "NIGHT",
-#              "FAULT",
-#              "BULK_CHARGE",
-#              "ABSORPTION",
-#              "FLOAT",
-#              "EQUALIZE"]
-# ===================================================================
-def doChargeState(params):
-  sf = int(params[9])                # grab raw value
-  ns = PStatLst[9][nameOffset]
-  # test if 'sf' gives a valid index for the PChrgState list
-  # 0 - 8
-  if (sf < 0) or (sf > 8):
-    print 'invalid index into ChargeState list!!!'
-    return
-  units = (PStatLst[9][unitsOffset])[sf] # index list with value
-#  print format % (20, 'Charge State', 4, '18', 12, ns, 8, sf, 10, ' '+units)
-  if sf==0:
-    print '%s,' % ('ChargeState,START'),#don't forget comma's to prevent newlines.
-  elif sf==1: 
-    print '%s,' % ('ChargeState,NIGHT_CHECK'), 
-  elif sf==2:
-    print '%s,' % ('ChargeState,DISCONNECT'),     
-  elif sf==3: 
-    print '%s,' % ('ChargeState,NIGHT'),     
-  elif sf==4:
-    print '%s,' % ('ChargeState,FAULT'), 
-  elif sf==5: 
-    print '%s,' % ('ChargeState,BULK_CHARGE'), 
-  elif sf==6: 
-    print '%s,' % ('ChargeState,ABSORPTION'),     
-  elif sf==7:
-    print '%s,' % ('ChargeState,FLOAT'),    
-  elif sf==8: 
-    print '%s,' % ('ChargeState,EQUALIZE'),  
-# ... End doChargeState Function ...
-
-# ===================================================================
-# Function to parse out and display load state
-# status message 
-# Load State with load
-# PLoadState = ["START",
-#                "LOAD_ON",
-#                "LVD_WARNING",
-#                "LVD",
-#                "FAULT",
-#                "DISCONNECT"]
-# ===================================================================
-def doLoadState(params):
-  sf = int(params[18])                # grab raw value
-  ns = PStatLst[18][nameOffset]
-  # test if 'sf' gives a valid index for the PLoadState list
-  # 0 - 5
-  if (sf < 0) or (sf > 5):
-    print 'invalid index into LoadState list!!!'
-    return
-  units = (PStatLst[18][unitsOffset])[sf] # index list with value
-#Original print
-#  print format % (20, 'Load State', 4, '27', 12, ns, 8, sf, 10, ' '+units)
-#===========================New CSV print===================================================== 
-# This block is for putting the LoadState int he print / cron file. Should the RRD insert miss
-# the LVD_WARNING, we can look to the log to get an idea of what happend before station quit.
-  if sf==0:
-    print '%s,' % ('LoadState,START'),#don't for get comma's to prevent newlines.
-  elif sf==1: 
-    print '%s,' % ('LoadState,LOAD_ON'),
-  elif sf==2:
-    print '%s,' % ('LoadState,LVD_WARNING'),    
-  elif sf==3: 
-    print '%s,' % ('LoadState,LVD'),    
-  elif sf==4:
-    print '%s,' % ('LoadState,FAULT'),    
-  elif sf==5: 
-    print '%s,' % ('LoadState,DISCONNECT'),   
- # else:
-  #  continue
-# ... End doLoadState Function ...
-
-# ===================================================================
-# Function to parse out and display load current compensated LVD voltage
-# status message 
-# ===================================================================
-#Load current comensated LVD voltage   
-def doLVDVoltage(params):
-  sf = int(params[20])*PStatLst[20][scalerOffset]
-  ns = PStatLst[20][nameOffset]
-  units = PStatLst[20][unitsOffset]
-#  print format % (20, 'LVD Voltage', 4, '29', 12, ns, 8, sf, 10, ' '+units)
-  print formatCSV % ('Vlvd',sf,''+units), 
-# ... End doLVDVoltage Function ...
-
-# ===================================================================
-# Function to parse out and display Vbatt - load current compensated LVD voltage
-# status message aka Vdiff
-# ===================================================================
-#Load current comensated LVD voltage   
-def doVdiff(params):
-  sf1 = int(params[0])*PStatLst[0][scalerOffset]
-  ns1 = PStatLst[0][nameOffset]
-  units1 = PStatLst[0][unitsOffset]
-  sf2 = int(params[20])*PStatLst[20][scalerOffset]
-  ns2 = PStatLst[20][nameOffset]
-  units2 = PStatLst[20][unitsOffset]
-  Vdiff=sf1-sf2
-  print formatCSV % ('Vdiff',Vdiff,''+units2), 
-# ... End doVdiff Function ...
-# ===================================================================
-# Function to do the whole tamale. Get a status record from the 
-# selected station. An integer is used to indicate the station to 
-# query and the station table/file is used to get the actural name, 
-# IP address and port.
-# ===================================================================
-def doShortScan(s,  StationName):
-  global params, data
-  # ===================================================================
-  # Retrieve a status record from MPPT/Radio 
-  # ----------------------------------------
-  #  Send a request. This complete status record is place in "data" string.
-  #  ****NOTE! Cell modems do not process any request over the serial port, T, R, E.....
-  #  Freewave radio's do... All translators are defaulted to T mode
-  #  and will reset to T mode. If you connect directly with a PC,
-  #  try to remember to put the translator back into T mode please. 
-  # ===================================================================
-  x = mysend(s, 'R\r',  StationName) # send request for status data
-  data = myreceive(s, 1024,  StationName)
-
-  # ===================================================================
-  # Prepare "data" string for splitting into components
-  # ---------------------------------------------------
-  # 1) Find end of message (start of checksum string) - 'eod'
-  # 2) Retrieve the strings checksum - 'dchksum'
-  # 3) The "data" string is then split and assigned to "parama" list
-  #    (splitting using ',' delimiters and not including checksum)
-  # 4) Remove the header string from the params list
-  #    by POPPING it - 'dathdr'
-  # 5) Remove the firmware revision string from the params list
-  #    by POPPING it too - 'fwrev'
-  # 6) The cleaned up "params" list is then used for the rest of the
-  #    script
-  # ===================================================================
-  eod = data.find('*')
-  dchksum = data[eod+1:-2]        # get the checksum value, no *, no CRLF
-
-  # Exception for corrupted string.
-  # If the checksum's do not match, return from the call to doShortScan and try again.
-  # If they do match print it for debugging....remove later?
-  #print 'string chksum: ', dchksum , ' - ',
-  #print 'calc chksum: %0X' % (checksum(data)),   
-  if (int(dchksum, 16)!=checksum(data)):
-    print 'CHECKSUM MISMATCH %s,%0X' %(dchksum, checksum(data))
-    raise BadChecksum
-  #else:  
-   # print 'string chksum: ', dchksum , ' - ',
-   # print 'calc chksum: %0X' % (checksum(data)), 
-  
-  params = data[:eod].split(',')  # make a list out of the CSV string from translator
-  dathdr = params.pop(0)          # get and remove the data header string
-  fwrev = params.pop(0)           # get and remove the fw revision string
-
-  #-----------------------------------------------------------------------------------------------------------------
-  #CSV format for output header to log. Created to make cronlog easy to read with many stations. 
-  #Can be imported into spread sheet for quick viewing....
-  #Format of string is StationName,mm/dd/yyyy,hh:mm:ss,THE COMMA AT THE END OF THIS STATEMENT REMOVES THE NEWLINE!
-  #So when you call the values you want to print, they are concatinated to the string to keep things pretty.
-  #Pay special care to the comma's in the new CSV format print statements. Especially if you revert back to the original!
-  #-----------------------------------------------------------------------------------------------------------------
-  
-#format StationName,mm/dd/yyyy,hh:mm:ss,  
-  lt = time.localtime()
-  print '%s,%d/%d/%d,%02d:%02d:%02d,' % (StationName, lt.tm_mon, lt.tm_mday, lt.tm_year, lt.tm_hour, lt.tm_min, lt.tm_sec ), 
- 
-
-#----------------------------------------------------------------------
-  # ---------------
-  #Load State 
-  #Moved here so CSV would show states, especially LVD_WARNING first in string after date-time stamp.
-  #------------------
-  doLoadState(params)
-  # Battery Voltage
-  # ---------------
-  doVbattery(params)
-  # ---------------
-  # Array Voltage
-  # ---------------
-  doVarray(params)
-  # ---------------
-  # Load Voltage
-  # ---------------
-  doVload(params)
-  # -----------------
-  # Charging Current
-  # -----------------
-  doChargingCurrent(params)
-  # ---------------
-  # Load Current
-  # ---------------
-  doLoadCurrent(params)
-  # ---------------------
-  # Various Temperatures
-  # ---------------------
-  doTempheatsink(params)
-  doTempBattery(params)
-  doTempAmbient(params)
-  doTemprts(params)  # RTS = Remote Temp Sensor
-  # -----------------------------------------------------
-  # Low Voltage Disconnect Setpoint, current compensated
-  # -----------------------------------------------------
-  doLVDVoltage(params)
-  #--------------------------
-  # Print Vdiff=VBatt-Vlvd
-  #--------------------------
-  doVdiff(params)
-  # -------------------------
-  # Various State Conditions
-  # -------------------------
-  doChargeState(params)
-  
-  # ------------------------------------------------------------------
-  # Return translator to Timed 
-  # Message Mode before Exiting
-  # ------------------------------------------------------------------
-  x = mysend(s, 'T\r', StationName)
-  #print "Returning back to timed mode"
-
-# ... End doShortScan Function ...
+        rec = doStatus(data, StationName, stamp, Comm_Duration, echo=False, metrics=stats)
+    except BadChecksum:
+        pollDone(StationName, False)
+        return
+    except ValueError as e:    # short frame or a register that is not a number
+        print 'Station %s bad status frame: %s' % (StationName, e)
+        stats.count('bad_frames', StationName)
+        pollDone(StationName, False)
+        return
+    #Comm_Duration is logged and added to the RRD as well. It may be good to track and compare
+    #between cell,LAN and Radio connectivity differences.
+    #One whole line: the CSV status fields then 'Comm_Duration, x.xxx, seconds,'
+    t = time.time()
+    log.record(rec)
+    stats.observe('log', StationName, time.time() - t)
+
+    # LVD_WARNING, low Vdiff, faults and alarms are sent now, not found in the log later
+    t = time.time()
+    alerts.check(rec)
+    stats.observe('alert', StationName, time.time() - t)
+
+    #====================================================================================================
+    #    45 Internal register entries from MPPT into RRD Database.
+    #    You can reference Morningstar's SunSaver MPPT MODBUS Specifcation V10, 14 July 2010 for details.
+    #    The RRD layout (rrdschema.DSList) is PStatLst followed by rrdschema.Timing, and the update
+    #    names the DS it fills (--template), so there is no hand kept list to match up here.
+    #    To add a value, add it to rrdschema.Timing and pass it to Update.values() in storage.py.
+    #    Buffered with the capture time, rrd writes the batch in one update call.
+    #====================================================================================================
+    store.add(rec)
+    pollDone(StationName, True, Comm_Duration)
+# ... End doResult Function ...
+
+health = LinkHealth(SockTimeout, ProbeInterval, BreakerTrip)
+stats = metrics.Metrics()
+
+pool = None
+if PollMode != 'oneshot':
+    pool = ConnectionPool(SockTimeout, passive=(PollMode == 'passive'), health=health, metrics=stats)
+
+stations = StationRegistry(StationFile, StationReload)
+
+rrd = RRDWriter(RRDPath, RRDBatch, RRDMaxAge, RRDDaemon, Update.template, stats)
+backends = []
+if 'rrd' in StorageBackends:
+    backends.append(RRDStorage(rrd, Update))
+if 'raw' in StorageBackends:
+    backends.append(RawStore(RawPath, RawBatch, RRDMaxAge))
+if 'delta' in StorageBackends:
+    backends.append(DeltaStore(DeltaPath))
+cache = None
+if LiveSocket:
+    cache = live.LiveCache(LiveSamples)
+    backends.append(cache)
+store = Storages(backends)
+sched = Scheduler(PollInterval, PollJitter, RRDHeartbeat)
+capture = None
+if CaptureFrames:
+    capture = FrameArchive(CapturePath)
+sinks = []
+if 'log' in AlertSinks:
+    sinks.append(PrintSink())
+if 'file' in AlertSinks:
+    sinks.append(FileSink(AlertFile))
+if 'socket' in AlertSinks:
+    sinks.append(SocketSink(AlertSocket))
+if 'webhook' in AlertSinks and AlertWebhook:
+    sinks.append(WebhookSink(AlertWebhook))
+alerts = AlertEngine(alertRules(), sinks, metrics=stats)
+
+# SIGUSR1: write out everything buffered (before graphs are drawn)
+FlushRequested = False
+def requestFlush(signum, frame):
+    global FlushRequested
+    FlushRequested = True
+signal.signal(signal.SIGUSR1, requestFlush)
 
 
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -736,134 +421,84 @@ def doShortScan(s,  StationName):
 # -------------------------------------------------------------------
 # -------------------------------------------------------------------
 # +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+#Put the output in a txt file. Other prints (errors) go through the sink too.
+log = LogSink(LogFile, LogFormat, LogMaxBytes, LogRotate, LogKeep, True, LogFlush,
+              DeltaEncoder() if LogDelta else None)
+sys.stdout = log
+if MetricsPort:
+    try:
+        metrics.serve(stats, MetricsPort)
+    except socket.error as e:
+        print 'metrics port %d: %s, no /metrics endpoint' % (MetricsPort, e)
+if cache is not None:
+    try:
+        live.serve(cache, LiveSocket)
+    except socket.error as e:
+        print 'live socket %s: %s, no live queries' % (LiveSocket, e)
 while True:#Always on Loop to cycle.
-    cycle_start = time.time()
-
-    #for x in range(1000):
-    #Put the output in a txt file.
-    sys.stdout=open("Insert8.3.log", "a+")
-    # declare the path to the input file
-    #sfpath = ("C:\\Users\\Dan\\Desktop\\Radio Modbus Stuff")
-    sfpath = ("/home/mbiundo/Desktop/MCSOH/RRDTool/Insert8/")
-    # open input file for reading using tfpath above
-    #stationfile = open(sfpath + "//" + "//StationList.txt", "r")
-    stationfile = open(sfpath  + "/StationList.txt", "r")
-    #=============================================================================
-    # read the file line by line until EOF
-    # File line entry  example:
-    #  Station Name, IP Address, Port Number<CR><LF> (newline)
-    # Comma Separated Values (CSV) followed by a newline (CRLF)
-    #=============================================================================
-    
-    while True:#Loop to cycle through the StationList.txt file.
-        sfline = stationfile.readline()
-        # strip off newline and create list of fields
-        sfline = sfline.rstrip()
-        if not sfline:
-            break # exit loop if end of file (EOF)
-        # convert CSV into a list
-        sftext = sfline.split(",")
-        # check for a commented out line
-        if sfline[0] == '#':
-            # OPTIONAL - print name of station that is being skipped (minus the #)
-           print 'Skipping: ', (sftext[0][1:])
-           continue # skip this iteration and go on to the next
-        # make sure the list is three elements before continuing
-        if len(sftext) < 3:
-            break # exit loop at first sign of trouble
-    
-    
-        StationName = sftext[0]
-        StationIP = sftext[1]
-        StationPort = int(sftext[2])
-    
-        # create a socket
-        # 30 seconds worked well in testing for cell....
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(30)
-    
-        # connect it to the IP address and Port number
-        # Use StationList for IP and Port
-        host = StationIP
-        port = StationPort
-        #Comm's Exceptions added to make errors more informative
-        try:
-            try:
-                s.connect((host, port))
-            except (socket.timeout, socket.error, socket.gaierror) as e:
-                print 'Station %s (%s:%s) connection error: %s' % (StationName, host, port, e)
-                raise
-            for x in range(1):  # stress test by setting > 1
-                #print '%s,%s' % (host, port)
-                # ===================================================================
-                # Function to do the whole tamale. Get a status record from the 
-                # selected station. All the info is placed in the Global list
-                # called "params".
-                # ===================================================================
-                start = time.time()
-                doShortScan(s, StationName)
-                #Comm_Duration may be added to the RRD as well. It may be good to track and compare
-                #between cell,LAN and Radio connectivity differences.
-                Comm_Duration = time.time() - start
-                #print 'Station: %s communication time: %.3f seconds' % (StationName,  comm_duration)
-                print 'Comm_Duration, %.3f, seconds,' % (Comm_Duration) 
-        except (socket.timeout, socket.error, socket.gaierror, BadChecksum):
-            continue
-    
-    
-        #--------------------- Partial example for RRDTOOL LAYOUT AND INSERT function--------------------
-        #---------------------The RRDTool Insert function must match the RRD database layout.
-        #RRDTool database layout for mcsoh2.rrd
-        # DS:Adc_vb_f:GAUGE:600:0:65535 \   params[0]
-        # DS:Adc_va_f:GAUGE:600:0:65535 \   params[1]
-        # DS:Adc_vl_f:GAUGE:600:0:65535 \   params[2]
-        # DS:Adc_ic_f:GAUGE:600:0:65535 \   params[3]
-        # DS:Adc_il_f:GAUGE:600:0:65535 \   params[4]
-        # DS:T_hs:GAUGE:600:-128:127 \      params[5]
-        # DS:T_batt:GAUGE:600:-127:127 \    params[6]
-        # DS:T_amb:GAUGE:600:-127:127 \     params[7]
-        # DS:T_rts:GAUGE:600:-127:127 \     params[8]
-        # DS:Charge_State:GAUGE:600:0:8 \   params[9]
-        # DS:load_state:GAUGE:600:0:6 \     params[18]
-        # DS:V_lvd:GAUGE:600:0:65535 \      params[20]
-    
-        #====================================================================================================
-        #    45 Internal register entries from MPPT into RRD Database.
-        #    You can reference Morningstar's SunSaver MPPT MODBUS Specifcation V10, 14 July 2010 for details.
-        #    Append additional values to the end of the %(int params[]) list below... Just make sure the
-        #    additions identical in the RRD db and script that creates it.
-        #====================================================================================================
-        ret = rrdtool.update('/home/mbiundo/Desktop/MCSOH/RRDTool/Insert8/'+StationName+'.rrd','N:\
-        %d:%d:%d:%d:%d:%d:%d:%d:%d:%d:\
-        %d:%d:%d:%d:%d:%d:%d:%d:%d:%d:\
-        %d:%d:%d:%d:%d:%d:%d:%d:%d:%d:\
-        %d:%d:%d:%d:%d:%d:%d:%d:%d:%d:\
-        %d:%d:%d:%d:%d:%f'\
-        % (int(params[0]),int(params[1]) ,int(params[2]) ,int(params[3]) ,int(params[4]) ,int(params[5]) ,\
-        int(params[6]) ,int(params[7]) ,int(params[8]) , int (params[9]), int (params[10]) , \
-        int(params[11]) ,int(params[12]) ,int(params[13]) , int (params[14]), int (params[15]) , \
-        int(params[16]) ,int(params[17]) ,int(params[18]) , int (params[19]), int (params[20]) , \
-        int(params[21]) ,int(params[22]) ,int(params[23]) , int (params[24]), int (params[25]) , \
-        int(params[26]) ,int(params[27]) ,int(params[28]) , int (params[29]), int (params[30]) , \
-        int(params[31]) ,int(params[32]) ,int(params[33]) , int (params[34]), int (params[35]) , \
-        int(params[36]) ,int(params[37]) ,int(params[38]) , int (params[39]), int (params[40]) , \
-        int(params[41]) ,int(params[42]) ,int(params[43]) , int (params[44]), Comm_Duration )); 
-    
-        if ret:
-            print rrdtool.error()
-        #======================================================================================================
-        
-        # -------------------
-        # close out socket(s)
-        # -------------------
-        s.close()
-    #== End Of File read loop =============================
-    # close the station information input file
-    stationfile.close()
-       
-    #clean up output...
-    sys.stdout.flush()
-    #Sleep time set typically the first max argument if it is 3 minutes or longer.    
-    time.sleep(max(180, 60 - (time.time() - cycle_start)))    # sleep until time to start next cycle
+    now = time.time()
+    # only a stat() of StationList.txt every StationReload seconds, the
+    # file is read again when it changed
+    if stations.refresh(now):
+        Stations = stations.addrs()
+        if Shards > 1:
+            Stations = [stn for stn in Stations if shardOf(stn[0], Shards) == Shard]
+        rrd.setPaths(stations.rrds())
+        store.setStations([stn[0] for stn in Stations])
+        sched.setStations(Stations, stations.intervals(), now)
+        names = set([stn[0] for stn in Stations])
+        for name in health.stns.keys():
+            if name not in names:    # removed, a reused name starts afresh
+                health.forget(name)
+        for stn in Stations:
+            if stn[0] not in health.stns:    # new station, start from its RRD history
+                health.seed(stn[0], rrdDurations(rrd.path(stn[0])))
+            health.setCeiling(stn[0], stations.get(stn[0]).ceiling())
+        if pool is not None:
+            pool.setStations(Stations)
+
+    # ===================================================================
+    # Poll the stations that are due. Each station is sent 'R', its status
+    # frame collected and put back in 'T' mode (or, passive, the last
+    # Timed mode frame is picked up). Finished stations come back here as
+    # they complete, the slow ones don't hold up the rest, stations that
+    # come due meanwhile are added. Comm errors are printed by the
+    # poller / pool.
+    # ===================================================================
+    due = sched.due(now)
+    if pool is None:
+        if due:
+            for result in pollStations(due, MaxInFlight, SockTimeout, more=sched.due, health=health, metrics=stats):
+                doResult(*result)
+    elif pool.passive:
+        for result in pool.take([stn[0] for stn in due]):
+            doResult(*result)
+    else:
+        pool.ask([stn[0] for stn in due])
+
+    store.flushDue()
+    if capture is not None:
+        capture.flushDue()
+    if FlushRequested:
+        FlushRequested = False
+        store.flush()
+        if capture is not None:
+            capture.flush()
+
+    #clean up output... (the sink flushes on its own thread, this doesn't wait)
+    log.flush()
+
+    # wait for the next station to come due, at most a second so the
+    # station list and flush requests get looked at
+    nxt = sched.nextDue()
+    wake = time.time() + 1.0
+    if nxt is not None and nxt < wake:
+        wake = nxt
+    if pool is None:
+        time.sleep(max(0, wake - time.time()))
+    else:
+        pool.service(max(0, wake - time.time()))    # keep the persistent sockets drained while we wait
+        if not pool.passive:
+            for result in pool.answers():
+                doResult(*result)
 # ... End of Script ...
-
@@ -0,0 +1,321 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Alert rules run on every decoded sample.
+#
+# An LVD_WARNING used to be found by grepping the log or looking at the
+# graphs, often after the load was already disconnected. AlertEngine
+# checks each Record as doResult gets it, so an alert goes out in the
+# same poll the frame came in.
+#
+# Rules (alertRules) look at one sample and name the conditions that
+# are on for it:
+#
+#   vdiff        - VBatt - Vlvd below VdiffWarn (warning) or VdiffCrit
+#                  (critical). Clears VdiffHyst above the threshold so a
+#                  battery sitting on it doesn't flap.
+#   Load_State   - in LVD_WARNING, LVD, FAULT or DISCONNECT
+#   Charge_State - in FAULT or DISCONNECT
+#   Array_Fault, Load_Fault - each bit set
+#   Alarm        - each bit set of the 24 bit Alarm_HI/Alarm_LO (PAlarm)
+#
+# Each condition has a key, e.g. 'Load_State:LVD_WARNING'. The engine
+# keeps which keys are on per station and only sends a change:
+#
+#   firing   - the key came on
+#   resolved - it went off again
+#
+# A key still on after Repeat seconds is sent again as a reminder. No
+# station sends more than RateBurst alerts per RateSecs, critical ones
+# first. A firing alert held back is tried again with the next sample,
+# and the count held back goes out with the next alert that is sent. A
+# condition that clears before it was ever sent is not sent at all.
+#
+# Alerts go to sinks, anything with a send(alert) method:
+#   PrintSink   - a line in the log (sys.stdout)
+#   FileSink    - one JSON object per line appended to a file
+#   SocketSink  - one JSON datagram per alert to a Unix socket, for a
+#                 local pager / agent. Never blocks, dropped if nobody
+#                 is listening
+#   WebhookSink - JSON POST to a URL from a background thread
+#
+#   python capture.py replay --alerts ...  runs the rules over old frames
+#---------------------------------------------------------------
+import errno
+import json
+import Queue
+import socket
+import threading
+import urllib2
+
+from mppt import PAlarm
+
+VdiffWarn = 0.5     # volts above LVD for a warning
+VdiffCrit = 0.2     # ...and a critical
+VdiffHyst = 0.1     # volts back above a threshold before it clears
+Repeat = 3600       # seconds between reminders of a condition still on
+RateBurst = 10      # alerts a station may send at once...
+RateSecs = 60       # ...then one more every this many seconds
+WebhookTimeout = 5
+WebhookQueue = 1000
+
+LoadAlerts = {'LVD_WARNING': 'warning', 'LVD': 'critical', 'FAULT': 'critical', 'DISCONNECT': 'warning'}
+ChargeAlerts = {'FAULT': 'critical', 'DISCONNECT': 'warning'}
+
+FIRING = 'firing'
+RESOLVED = 'resolved'
+
+class Alert(object):
+    __slots__ = ('station', 'stamp', 'key', 'level', 'state', 'message', 'suppressed')
+
+    def __init__(self, station, stamp, key, level, state, message, suppressed=0):
+        self.station = station
+        self.stamp = stamp
+        self.key = key
+        self.level = level        # 'warning' or 'critical'
+        self.state = state        # FIRING or RESOLVED
+        self.message = message
+        self.suppressed = suppressed    # alerts held back before this one
+
+    def line(self):
+        text = 'Station %s ALERT %s %s %s: %s' % (self.station, self.state, self.level, self.key, self.message)
+        if self.suppressed:
+            text += ' (%d alerts suppressed)' % self.suppressed
+        return text
+
+    def json(self):
+        return json.dumps({'station': self.station, 'time': round(self.stamp, 3),
+                           'key': self.key, 'level': self.level, 'state': self.state,
+                           'message': self.message, 'suppressed': self.suppressed})
+# ... End Alert Class ...
+
+# ===================================================================
+# The rules. Each is function(rec, on) returning a list of
+# (key, level, message) for the conditions on in the sample. 'on' is
+# the set of the station's keys on before it, for hysteresis.
+# ===================================================================
+def vdiffRule(warn=VdiffWarn, crit=VdiffCrit, hyst=VdiffHyst):
+    def rule(rec, on):
+        vb = rec.get('Adc_vb_f')
+        lvd = rec.get('V_lvd')
+        vdiff = vb - lvd
+        for level, limit in (('critical', crit), ('warning', warn)):
+            key = 'vdiff:' + level
+            if vdiff < limit or (key in on and vdiff < limit + hyst):
+                return [(key, level, 'Vdiff %.2f V (VBatt %.2f V, Vlvd %.2f V) below %.2f V' % (vdiff, vb, lvd, limit))]
+        return []
+    return rule
+# ... End vdiffRule Function ...
+
+def stateRule(name, levels):
+    def rule(rec, on):
+        text = rec.text(name)
+        if text in levels:
+            return [('%s:%s' % (name, text), levels[text], '%s %s' % (name, text))]
+        return []
+    return rule
+# ... End stateRule Function ...
+
+def faultRule(name):
+    def rule(rec, on):
+        return [('%s:%s' % (name, bit), 'critical', '%s %s' % (name, bit)) for bit in rec.setbits(name)]
+    return rule
+# ... End faultRule Function ...
+
+def alarmRule():
+    names = [entry[0].strip() for entry in PAlarm]
+    def rule(rec, on):
+        v = (rec.rawOf('Alarm_HI') << 16) | rec.rawOf('Alarm_LO')
+        return [('Alarm:%s' % names[b], 'warning', 'Alarm %s' % names[b])
+                for b in range(len(names)) if (v >> b) & 1]
+    return rule
+# ... End alarmRule Function ...
+
+# the standard rule set
+def alertRules(warn=VdiffWarn, crit=VdiffCrit, hyst=VdiffHyst):
+    return [vdiffRule(warn, crit, hyst),
+            stateRule('Load_State', LoadAlerts),
+            stateRule('Charge_State', ChargeAlerts),
+            faultRule('Array_Fault'),
+            faultRule('Load_Fault'),
+            alarmRule()]
+
+class StationAlerts(object):
+    __slots__ = ('on', 'tokens', 'filled', 'suppressed')
+
+    def __init__(self, now, burst):
+        self.on = {}          # key -> [level, message, time last sent or None]
+        self.tokens = burst
+        self.filled = now
+        self.suppressed = 0
+# ... End StationAlerts Class ...
+
+class AlertEngine(object):
+
+    # ===================================================================
+    #  rules   - list of rule functions (alertRules())
+    #  sinks   - where alerts go, each with a send(alert) method
+    #  metrics - optional metrics.Metrics, counts alerts per station
+    # ===================================================================
+    def __init__(self, rules, sinks, repeat=Repeat, burst=RateBurst, ratesecs=RateSecs, metrics=None):
+        self.rules = rules
+        self.sinks = sinks
+        self.repeat = repeat
+        self.burst = burst
+        self.ratesecs = ratesecs
+        self.metrics = metrics
+        self.stns = {}        # StationName -> StationAlerts
+        self.sent = 0
+        self.suppressed = 0
+
+    # ===================================================================
+    # Run the rules over one decoded sample and send what changed.
+    # ...Time (repeats, rate limit) goes by the sample's stamp, so a
+    # ...replay of old frames behaves as they did live.
+    # ...Returns the alerts sent.
+    # ===================================================================
+    def check(self, rec, now=None):
+        if now is None:
+            now = rec.stamp
+        sa = self.stns.get(rec.station)
+        if sa is None:
+            sa = self.stns[rec.station] = StationAlerts(now, self.burst)
+        found = {}
+        for rule in self.rules:
+            try:
+                for key, level, message in rule(rec, sa.on):
+                    found[key] = (level, message)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print 'Station %s alert rule error: %s' % (rec.station, e)
+        out = []     # (order, Alert, on entry or None)
+        for key in sa.on.keys():
+            if key not in found:
+                level, message, last = sa.on.pop(key)
+                if last is not None:    # only clear what was sent
+                    out.append((2, Alert(rec.station, rec.stamp, key, level, RESOLVED, 'cleared, was ' + message), None))
+        for key, (level, message) in found.items():
+            entry = sa.on.get(key)
+            if entry is None or entry[0] != level:
+                entry = sa.on[key] = [level, message, None]
+            entry[1] = message
+            if entry[2] is not None and now - entry[2] < self.repeat:
+                continue
+            out.append((0 if level == 'critical' else 1, Alert(rec.station, rec.stamp, key, level, FIRING, message), entry))
+        out.sort(key=lambda item: (item[0], item[1].key))
+        sent = []
+        for order, alert, entry in out:
+            if self._allow(sa, now):
+                alert.suppressed, sa.suppressed = sa.suppressed, 0
+                self._send(alert)
+                sent.append(alert)
+                if entry is not None:
+                    entry[2] = now
+            else:    # a firing one held back is tried again next sample
+                sa.suppressed += 1
+                self.suppressed += 1
+        return sent
+
+    # token bucket per station
+    def _allow(self, sa, now):
+        sa.tokens = min(self.burst, sa.tokens + (now - sa.filled) / self.ratesecs)
+        sa.filled = now
+        if sa.tokens < 1:
+            return False
+        sa.tokens -= 1
+        return True
+
+    def _send(self, alert):
+        self.sent += 1
+        if self.metrics is not None:
+            self.metrics.count('alerts', alert.station)
+        for sink in self.sinks:
+            try:
+                sink.send(alert)
+            except (IOError, OSError, socket.error) as e:
+                print 'alert sink %s error: %s' % (sink.__class__.__name__, e)
+
+    # conditions on now, {StationName: [key, ...]}
+    def active(self):
+        return dict((name, sorted(sa.on)) for name, sa in self.stns.items() if sa.on)
+
+    def forget(self, StationName):
+        self.stns.pop(StationName, None)
+# ... End AlertEngine Class ...
+
+class PrintSink(object):
+    def send(self, alert):
+        print alert.line()
+# ... End PrintSink Class ...
+
+class FileSink(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    # alerts are few, the file is opened for each so it can be moved away
+    def send(self, alert):
+        f = open(self.path, 'a')
+        try:
+            f.write(alert.json() + '\n')
+        finally:
+            f.close()
+# ... End FileSink Class ...
+
+class SocketSink(object):
+
+    # ===================================================================
+    #  path - Unix datagram socket the listener is bound to
+    # ===================================================================
+    def __init__(self, path):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+        self.dropped = 0
+        self.error = None
+
+    def send(self, alert):
+        try:
+            self.sock.sendto(alert.json(), self.path)
+        except socket.error as e:
+            self.dropped += 1
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED, errno.EAGAIN, errno.ENOBUFS):
+                raise
+            if self.error != e.errno:    # nobody listening, say so once
+                print 'alert socket %s: %s, alerts dropped' % (self.path, e)
+            self.error = e.errno
+            return
+        self.error = None
+# ... End SocketSink Class ...
+
+class WebhookSink(object):
+
+    # ===================================================================
+    #  url - POSTed each alert as JSON. A thread does the posting so a
+    #        slow server can't hold up polling; if it falls WebhookQueue
+    #        alerts behind, new ones are dropped.
+    # ===================================================================
+    def __init__(self, url, timeout=WebhookTimeout, queue=WebhookQueue):
+        self.url = url
+        self.timeout = timeout
+        self.q = Queue.Queue(queue)
+        self.dropped = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, name='webhook')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def send(self, alert):
+        try:
+            self.q.put_nowait(alert.json())
+        except Queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            body = self.q.get()
+            req = urllib2.Request(self.url, body, {'Content-Type': 'application/json'})
+            try:
+                urllib2.urlopen(req, timeout=self.timeout).close()
+            except (urllib2.URLError, socket.error) as e:
+                self.failed += 1
+                print 'alert webhook %s error: %s' % (self.url, e)
+# ... End WebhookSink Class ...
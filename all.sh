@@ -1,16 +1,11 @@
 #!/bin/bash
-./CommDurationgraph.sh
-./MARC_vgraph.sh
-./MARC_igraph.sh
-./MARC_tgraph.sh
-./MARC_cgraph.sh
-./MARC_vbatt-lvd_graph.sh
-
-./LCCR_vgraph.sh
-./LCCR_igraph.sh
-./LCCR_tgraph.sh
-./LCCR_cgraph.sh
-./LCCR_vbatt-lvd_graph.sh
+# Have Insert8.3.py write its buffered RRD samples (and flush rrdcached) first.
+pkill -USR1 -f Insert8.3.py && sleep 2
+# Fleet summary (fleet.rrd) for the fleet graphs, from the station RRDs.
+python fleet.py
+# Draws every station in StationList.txt, only the graphs whose RRD changed.
+# Add --daemon <rrdcached address> if Insert8.3.py uses RRDDaemon.
+python graphs.py
 
 
 #eog MARC_voltage_graph.png
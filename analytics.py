@@ -0,0 +1,427 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Battery health analytics, per station per day, for the whole fleet.
+#
+# The graphs only give min / max / avg of what is on screen. This pulls
+# each station's history into NumPy arrays, from the raw store
+# (rawstore.py) when the station has one, otherwise from its RRD, and
+# works out for every day (local time):
+#
+#   samples, hours       what the day's figures are based on
+#   ah_charge, ah_load   Ah in and out: the Ahc_daily / Ahl_daily
+#                        totals, taken just before the controller
+#                        resets them, credited to the day they started
+#   ah_balance           ah_charge - ah_load. Days in a row below 0 is
+#                        a bank that isn't being recharged
+#   vb_min, vb_max       battery volts
+#   vdiff_min            least VBatt - Vlvd, how close the day came to
+#                        the load disconnect (depth of discharge against
+#                        V_lvd)
+#   night_sag            Vbatt at dusk less the night's lowest, for the
+#                        night ending that day (nights of MinNight hours
+#                        or more). A growing sag on the same load is a
+#                        bank losing capacity
+#   absorption_h, float_h  hours in ABSORPTION / FLOAT. A bank that
+#                        never reaches FLOAT is never full
+#
+# Each station's days are kept in StationName_health.csv in the output
+# directory. A later run reads that, fetches only from the day before
+# the last one it holds and recomputes from there, so a daily run is a
+# day of data per station. Days are computed while the RRD still has
+# its 1 minute rows; history older than that comes from the 5 minute
+# and hourly archives (the daily archive can't show a day's shape and
+# isn't used).
+#
+# Stations are done in parallel (-j, one process per CPU by default)
+# and a line per station is printed over the last Window days, flagged
+# WATCH when the Ah balance is negative, Vdiff came within
+# alerts.VdiffWarn of the LVD, or the night sag is over SagWarn.
+#
+# Day boundaries use the UTC offset in effect now, a DST change moves
+# them an hour for part of the year.
+#
+#   python analytics.py [-d rrddir] [--raw rawdir] [-o outdir] [-j jobs]
+#       [--days N] [--daemon addr] [StationName ...]
+#---------------------------------------------------------------
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import rrdschema
+from alerts import VdiffWarn
+from mppt import PChrgState, StatusPlan
+from stations import StationFile, StationRegistry
+
+Day = 86400
+History = 2 * 365    # days fetched for a station with no cache yet
+MaxGap = 600         # longest a sample is taken to last (the RRD heartbeat)
+MinNight = 4 * 3600  # shortest night counted for night_sag
+Window = 7           # days the fleet summary is over
+SagWarn = 0.5        # volts of night sag flagged
+HealthSuffix = '_health.csv'
+
+Needed = ['Adc_vb_f', 'V_lvd', 'Charge_State', 'Ahc_daily', 'Ahl_daily']
+
+Fields = ['day', 'date', 'samples', 'hours', 'ah_charge', 'ah_load', 'ah_balance',
+          'vb_min', 'vb_max', 'vdiff_min', 'night_sag', 'absorption_h', 'float_h']
+
+NIGHT = PChrgState.index('NIGHT')
+ABSORPTION = PChrgState.index('ABSORPTION')
+FLOAT = PChrgState.index('FLOAT')
+
+# seconds to add to a time.time() for local time
+def utcOffset(now=None):
+    lt = time.localtime(now)
+    return -(time.altzone if lt.tm_isdst > 0 else time.timezone)
+
+# register values to units (V, Ah), states left as they are
+def _scaled(h):
+    for name in Needed:
+        scale = StatusPlan.scales[StatusPlan.index[name]]
+        h[name] = numpy.asarray(h[name], dtype=numpy.float64)
+        if scale != 1:
+            h[name] = h[name] * scale
+    return h
+
+# ===================================================================
+# A station's samples from t0 on, out of its raw store.
+# ...Returns {'stamp': array, register: array, ...}, values scaled.
+# ===================================================================
+def rawHistory(rawdir, StationName, t0):
+    from rawstore import RawReader
+    cols = RawReader(rawdir, StationName).range(t0, None, Needed)
+    h = dict((name, cols[name]) for name in Needed)
+    h['stamp'] = numpy.asarray(cols['stamp'], dtype=numpy.float64)
+    return _scaled(h), MaxGap
+# ... End rawHistory Function ...
+
+# ===================================================================
+# A station's samples from t0 on, out of its RRD: the 1 minute archive
+# for its 14 days, the 5 minute and hourly ones before that. Unknown
+# rows are dropped. Same return as rawHistory, plus the longest time a
+# row stands for.
+# ===================================================================
+def rrdHistory(rrdfile, t0, now=None, daemon=None):
+    import rrdtool
+    if now is None:
+        now = time.time()
+    extra = ['--daemon', daemon] if daemon else []
+    chunks = []
+    maxgap = MaxGap
+    end = int(now)
+    for steps, rows, cfs in rrdschema.Tiers[:-1]:
+        res = steps * rrdschema.Step
+        start = max(int(t0), int(now) - rows * res)
+        if start < end:
+            (first, last, step), names, data = rrdtool.fetch(rrdfile, 'AVERAGE', '-r', str(res),
+                                                             '-s', str(start), '-e', str(end), *extra)
+            if data:
+                a = numpy.array(data, dtype=numpy.float64)    # None (unknown) -> nan
+                stamp = first + step * numpy.arange(1, len(data) + 1, dtype=numpy.float64)
+                chunks.insert(0, (stamp, a, list(names)))
+                maxgap = max(maxgap, step)
+            end = start
+        if end <= t0:
+            break
+    h = dict((name, []) for name in Needed)
+    h['stamp'] = []
+    last = None
+    for stamp, a, names in chunks:    # oldest first
+        keep = ~numpy.isnan(a[:, names.index('Adc_vb_f')])
+        if last is not None:
+            keep &= stamp > last      # archives overlap at their edges
+        if not keep.any():
+            continue
+        h['stamp'].append(stamp[keep])
+        for name in Needed:
+            h[name].append(a[keep, names.index(name)])
+        last = stamp[keep][-1]
+    for name in h:
+        h[name] = numpy.concatenate(h[name]) if h[name] else numpy.zeros(0)
+    return _scaled(h), maxgap
+# ... End rrdHistory Function ...
+
+# ===================================================================
+# Totals of a daily accumulator (Ahc_daily, Ahl_daily) per day. The
+# controller resets it once a day, each run between resets is one
+# total (its largest value), credited to the day the run started in.
+#  values - the register, nan where unknown
+#  idx    - index into the day list of each sample
+# ===================================================================
+def dailyTotals(values, idx, ndays):
+    good = ~numpy.isnan(values)
+    v = values[good]
+    if not len(v):
+        return numpy.full(ndays, numpy.nan)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(v) < 0) + 1))
+    totals = numpy.maximum.reduceat(v, starts)
+    out = numpy.bincount(idx[good][starts], weights=totals, minlength=ndays)
+    seen = numpy.bincount(idx[good][starts], minlength=ndays)
+    out[seen == 0] = numpy.nan
+    return out
+# ... End dailyTotals Function ...
+
+# ===================================================================
+# Per-day figures for one station's samples (rawHistory / rrdHistory).
+# ...Returns {field: array per day} with 'day' the local day numbers
+# ...(days since the epoch), None if there are no samples.
+# ===================================================================
+def dailyAggregates(h, offset, maxgap=MaxGap):
+    stamp = h['stamp']
+    if not len(stamp):
+        return None
+    local = stamp + offset
+    day = numpy.floor(local / Day).astype(numpy.int64)
+    days, first, idx = numpy.unique(day, return_index=True, return_inverse=True)
+    n = len(days)
+    vb = h['Adc_vb_f']
+    lvd = h['V_lvd']
+    cs = numpy.rint(h['Charge_State'])
+
+    # the time each sample stands for, up to the next one
+    dt = numpy.zeros(len(stamp))
+    dt[:-1] = numpy.minimum(numpy.diff(stamp), maxgap)
+
+    out = {'day': days}
+    out['samples'] = numpy.bincount(idx, minlength=n)
+    out['hours'] = numpy.bincount(idx, weights=dt, minlength=n) / 3600.0
+    out['ah_charge'] = dailyTotals(h['Ahc_daily'], idx, n)
+    out['ah_load'] = dailyTotals(h['Ahl_daily'], idx, n)
+    out['ah_balance'] = out['ah_charge'] - out['ah_load']
+    out['vb_min'] = numpy.fmin.reduceat(vb, first)
+    out['vb_max'] = numpy.fmax.reduceat(vb, first)
+    out['vdiff_min'] = numpy.fmin.reduceat(vb - lvd, first)
+    out['absorption_h'] = numpy.bincount(idx, weights=dt * (cs == ABSORPTION), minlength=n) / 3600.0
+    out['float_h'] = numpy.bincount(idx, weights=dt * (cs == FLOAT), minlength=n) / 3600.0
+
+    # nights, shifted half a day so one that spans midnight stays whole
+    # and goes to the day it ends on
+    sag = numpy.full(n, numpy.nan)
+    night = numpy.flatnonzero(cs == NIGHT)
+    if len(night):
+        nday = numpy.floor((local[night] + Day / 2) / Day).astype(numpy.int64)
+        nv = vb[night]
+        ns = stamp[night]
+        ndays, nfirst = numpy.unique(nday, return_index=True)
+        nlast = numpy.concatenate((nfirst[1:], [len(night)])) - 1
+        nsag = nv[nfirst] - numpy.fmin.reduceat(nv, nfirst)
+        pos = numpy.minimum(numpy.searchsorted(days, ndays), n - 1)
+        ok = (days[pos] == ndays) & (ns[nlast] - ns[nfirst] >= MinNight)
+        sag[pos[ok]] = nsag[ok]
+    out['night_sag'] = sag
+    return out
+# ... End dailyAggregates Function ...
+
+class HealthCache(object):
+
+    # ===================================================================
+    # StationName_health.csv, the days worked out so far.
+    # ===================================================================
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}       # day -> {field: text}
+        if os.path.exists(path):
+            f = open(path, 'rb')
+            try:
+                for row in csv.DictReader(f):
+                    self.rows[int(row['day'])] = row
+            finally:
+                f.close()
+
+    def lastDay(self):
+        return max(self.rows) if self.rows else None
+
+    # ===================================================================
+    # Put in the days of a dailyAggregates result from 'since' on,
+    # replacing any already there.
+    # ===================================================================
+    def merge(self, agg, since=None):
+        for i in range(len(agg['day'])):
+            d = int(agg['day'][i])
+            if since is not None and d < since:
+                continue
+            row = {'day': str(d), 'date': time.strftime('%Y-%m-%d', time.gmtime(d * Day))}
+            for name in Fields[2:]:
+                v = float(agg[name][i])
+                row[name] = '' if v != v else ('%d' % v if name == 'samples' else '%.3f' % v)
+            self.rows[d] = row
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            w = csv.DictWriter(f, Fields)
+            w.writerow(dict((name, name) for name in Fields))
+            for d in sorted(self.rows):
+                w.writerow(self.rows[d])
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+
+    # the last 'n' days as {field: [float or None, ...]}
+    def recent(self, n):
+        days = sorted(self.rows)[-n:]
+        out = {}
+        for name in Fields[2:]:
+            out[name] = [float(self.rows[d][name]) if self.rows[d][name] else None for d in days]
+        return out
+# ... End HealthCache Class ...
+
+# ===================================================================
+# Bring one station's health file up to date.
+#  job - (StationName, rrd file, rawdir or None, outdir, days, daemon)
+# ...Returns (StationName, days computed, error or None).
+# ===================================================================
+def updateStation(job):
+    StationName, rrdfile, rawdir, outdir, days, daemon = job
+    now = time.time()
+    offset = utcOffset(now)
+    cache = HealthCache(os.path.join(outdir, StationName + HealthSuffix))
+    last = cache.lastDay()
+    if last is None:
+        since = None
+        t0 = now - days * Day
+    else:
+        # from the day before the last one kept: its reset runs and
+        # night carry into the last day, which is done again
+        since = last
+        t0 = (last - 1) * Day - offset
+    try:
+        if rawdir is not None and os.path.isdir(os.path.join(rawdir, StationName)):
+            h, maxgap = rawHistory(rawdir, StationName, t0)
+        else:
+            import rrdtool
+            try:
+                h, maxgap = rrdHistory(rrdfile, t0, now, daemon)
+            except rrdtool.error as e:
+                return StationName, 0, str(e)
+    except (IOError, OSError) as e:
+        return StationName, 0, str(e)
+    agg = dailyAggregates(h, offset, maxgap)
+    if agg is None:
+        return StationName, 0, None
+    if since is None and len(agg['day']) > 1:
+        since = int(agg['day'][1])    # the first day is only part of one
+    cache.merge(agg, since)
+    cache.save()
+    return StationName, sum(1 for d in agg['day'] if since is None or d >= since), None
+# ... End updateStation Function ...
+
+# mean / min / max of the values that are known, None if none are
+def _mean(values):
+    known = [v for v in values if v is not None]
+    return sum(known) / len(known) if known else None
+
+def _min(values):
+    known = [v for v in values if v is not None]
+    return min(known) if known else None
+
+def _max(values):
+    known = [v for v in values if v is not None]
+    return max(known) if known else None
+
+def _fmt(v, fmt='%7.2f'):
+    return fmt % v if v is not None else '%7s' % '-'
+
+# ===================================================================
+# One summary line for a station over its last 'n' days.
+# ===================================================================
+def summary(StationName, cache, n=Window):
+    r = cache.recent(n)
+    balance = _mean(r['ah_balance'])
+    vdiff = _min(r['vdiff_min'])
+    sag = _max(r['night_sag'])
+    watch = []
+    if balance is not None and balance < 0:
+        watch.append('Ah balance')
+    if vdiff is not None and vdiff < VdiffWarn:
+        watch.append('near LVD')
+    if sag is not None and sag > SagWarn:
+        watch.append('night sag')
+    return '%-16s %s %s %s %s %s %s  %s' % (
+        StationName, _fmt(balance), _fmt(_min(r['vb_min'])), _fmt(vdiff), _fmt(sag),
+        _fmt(_mean(r['absorption_h']), '%7.1f'), _fmt(_mean(r['float_h']), '%7.1f'),
+        ('WATCH: ' + ', '.join(watch)) if watch else '')
+# ... End summary Function ...
+
+# ===================================================================
+# Update every station's health file, in 'jobs' processes.
+#  paths - optional {StationName: RRD file} for RRDs not in rrddir
+# ...Returns [(StationName, days computed, error or None), ...]
+# ===================================================================
+def analyzeFleet(names, rrddir='.', rawdir=None, outdir='.', jobs=None, days=History, daemon=None, paths=None):
+    work = [(name, (paths or {}).get(name) or os.path.join(rrddir, name + '.rrd'),
+             rawdir, outdir, days, daemon) for name in names]
+    if jobs == 1 or len(work) < 2:
+        return map(updateStation, work)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return pool.map(updateStation, work)
+    finally:
+        pool.close()
+        pool.join()
+# ... End analyzeFleet Function ...
+
+if __name__ == '__main__':
+    rrddir = '.'
+    rawdir = None
+    outdir = None
+    jobs = None
+    days = History
+    daemon = None
+    names = []
+    args = sys.argv[1:]
+    usage = 'usage: %s [-d rrddir] [--raw rawdir] [-o outdir] [-j jobs] [--days N] [--daemon addr] [StationName ...]' % sys.argv[0]
+    try:
+        while args:
+            a = args.pop(0)
+            if a == '-d':
+                rrddir = args.pop(0)
+            elif a == '--raw':
+                rawdir = args.pop(0)
+            elif a == '-o':
+                outdir = args.pop(0)
+            elif a == '-j':
+                jobs = int(args.pop(0))
+            elif a == '--days':
+                days = int(args.pop(0))
+            elif a == '--daemon':
+                daemon = args.pop(0)
+            elif a.startswith('-'):
+                raise ValueError(a)
+            else:
+                names.append(a)
+    except (ValueError, IndexError):
+        print usage
+        sys.exit(1)
+    if numpy is None:
+        print 'analytics.py needs numpy'
+        sys.exit(1)
+    if outdir is None:
+        outdir = rrddir
+    stations = StationRegistry(os.path.join(rrddir, StationFile))
+    stations.refresh()
+    if not names:
+        names = stations.names()
+
+    start = time.time()
+    results = analyzeFleet(names, rrddir, rawdir, outdir, jobs, days, daemon, stations.rrds())
+    print '%-16s %7s %7s %7s %7s %7s %7s   last %d days' % ('station', 'Ah bal', 'Vb min', 'Vdiff', 'sag',
+                                                            'absorb', 'float', Window)
+    failed = 0
+    for name, computed, err in results:
+        if err:
+            print '%-16s error: %s' % (name, err)
+            failed += 1
+            continue
+        print summary(name, HealthCache(os.path.join(outdir, name + HealthSuffix)))
+    print '%d stations in %.1f s' % (len(results), time.time() - start)
+    if failed:
+        sys.exit(1)
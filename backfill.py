@@ -0,0 +1,229 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Backfill of the MPPT daily log records (PLogLst) after an outage.
+#
+# The SunSaver MPPT keeps a log record per day (min/max battery volts,
+# Ah charged / drawn, faults, alarms, time in absorption / equalize /
+# float). When a radio or cell link is down those days never make it
+# into the RRD, but they are still in the controller.
+#
+# For each station this:
+#  1. finds the gap days: days in the last LogDays with an hour of
+#     unknown Comm_Duration in the station's RRD, and no log record
+#     already backfilled for that day
+#  2. connects once, sends 'R' for a status frame (the current
+#     Hourmeter), then asks for the gap days' log records, LogBatch
+#     requests at a time down the same socket without waiting for each
+#     answer
+#  3. stamps each record from its hourmeter (now minus the hours since)
+#     and merges them, in one write, into StationName_daily.csv next to
+#     the RRD. An RRD can't take updates older than its last one, so the
+#     daily records get their own file, keyed and sorted by hourmeter.
+#
+# LogCmd is the translator command for log record n (0 = the newest,
+# yesterday), answered with one '$hdr,fwrev,<PLogLst registers>*XX' frame.
+#
+#   python backfill.py [-d rrddir] [--days N] [--daemon addr] [StationName ...]
+#---------------------------------------------------------------
+import os
+import socket
+import sys
+import time
+
+import rrdtool
+
+from mppt import LogPlan, PLogLst, StatusPlan, mysend
+from framer import Framer
+from stations import StationFile, StationRegistry
+
+LogCmd = 'L%d\r'    # request daily log record n
+LogDays = 32        # days back to look for gaps
+LogBatch = 8        # requests in flight on the connection
+SockTimeout = 30
+DailySuffix = '_daily.csv'
+
+Day = 86400
+
+# ===================================================================
+# Days with missing data in a station's RRD, as day numbers: day n
+# covers [now - n*Day, now - (n-1)*Day) (to the hour), so day 1 is the
+# last 24 hours and log record n-1 is day n's summary.
+# ===================================================================
+def gapDays(rrdfile, days=LogDays, daemon=None, now=None):
+    if now is None:
+        now = time.time()
+    end = int(now) // 3600 * 3600
+    args = [rrdfile, 'AVERAGE', '-r', '3600', '-s', str(end - days * Day), '-e', str(end)]
+    if daemon:
+        args += ['--daemon', daemon]
+    try:
+        (start, stop, step), names, rows = rrdtool.fetch(*args)
+    except rrdtool.error as e:
+        print '%s fetch error: %s' % (rrdfile, e)
+        return []
+    i = list(names).index('Comm_Duration')
+    gaps = set()
+    t = start
+    for row in rows:
+        t += step
+        if row[i] is None and t <= end:
+            gaps.add(int((end - t) // Day) + 1)
+    return sorted(n for n in gaps if 1 <= n <= days)
+# ... End gapDays Function ...
+
+class DailyLog(object):
+
+    # ===================================================================
+    # StationName_daily.csv: one line per backfilled log record,
+    #   stamp,hourmeter,alarm_daily,...  (raw PLogLst values)
+    # keyed by hourmeter, sorted.
+    # ===================================================================
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}    # hourmeter -> (stamp, raw values)
+        try:
+            f = open(path)
+        except IOError:
+            return
+        for line in f:
+            if line.startswith('stamp'):
+                continue
+            fields = line.strip().split(',')
+            if len(fields) != len(PLogLst) + 1:
+                continue
+            raw = [int(v) for v in fields[1:]]
+            self.rows[raw[0]] = (float(fields[0]), raw)
+        f.close()
+
+    # True if a record is already stored for the time range
+    def covers(self, t0, t1):
+        for stamp, raw in self.rows.values():
+            if t0 <= stamp < t1:
+                return True
+        return False
+
+    def add(self, stamp, raw):
+        self.rows[raw[0]] = (stamp, list(raw))
+
+    # write the whole file, replacing the old one in one step
+    def save(self):
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'w')
+        f.write('stamp,' + ','.join([row[0] for row in PLogLst]) + '\n')
+        for hm in sorted(self.rows):
+            stamp, raw = self.rows[hm]
+            f.write('%d,%s\n' % (stamp, ','.join([str(v) for v in raw])))
+        f.close()
+        os.rename(tmp, self.path)
+# ... End DailyLog Class ...
+
+# ===================================================================
+# Read the next good frame with 'nreg' registers off a blocking socket
+# through 'framer'. Frames of another kind (a Timed mode status frame
+# sent before the request got there) are skipped.
+# ...Raises socket.timeout / socket.error.
+# ===================================================================
+def _nextFrame(sock, framer, frames, nreg):
+    while True:
+        while not frames:
+            if not framer.recvInto(sock):
+                raise socket.error('connection closed by station')
+            frames.extend([f.tobytes() for f in framer.frames()])
+        frame = frames.pop(0)
+        if frame.count(',') == nreg + 1:
+            return frame
+# ... End _nextFrame Function ...
+
+# ===================================================================
+# Fetch daily log records from one station over a single connection.
+#  indexes - log record numbers to ask for
+# ...Returns (now, Hourmeter now, [Record, ...]).
+# ...Raises socket errors, ValueError if the status reply doesn't decode.
+# ...Log records that don't decode are reported and skipped.
+# ===================================================================
+def fetchLogs(StationName, host, port, indexes, timeout=SockTimeout):
+    s = socket.create_connection((host, port), timeout)
+    framer = Framer()
+    frames = []
+    try:
+        mysend(s, 'R\r', StationName)
+        status = StatusPlan.decodeFrame(_nextFrame(s, framer, frames, StatusPlan.n), StationName, time.time())
+        hm = status.get('Hourmeter')
+        recs = []
+        for b in range(0, len(indexes), LogBatch):
+            batch = indexes[b:b + LogBatch]
+            # pipeline the batch, the answers come back in order
+            mysend(s, ''.join([LogCmd % n for n in batch]), StationName)
+            for n in batch:
+                frame = _nextFrame(s, framer, frames, LogPlan.n)
+                try:
+                    recs.append(LogPlan.decodeFrame(frame, StationName))
+                except ValueError as e:
+                    print 'Station %s bad log record %d: %s' % (StationName, n, e)
+        # Return translator to Timed Message Mode
+        mysend(s, 'T\r', StationName)
+        return status.stamp, hm, recs
+    finally:
+        s.close()
+# ... End fetchLogs Function ...
+
+# ===================================================================
+# Backfill one station. Returns the number of records added.
+#  rrd     - the station's RRD file if not rrddir/StationName.rrd
+#  timeout - socket timeout, SockTimeout if None
+# ===================================================================
+def backfillStation(StationName, host, port, rrddir, days=LogDays, daemon=None, rrd=None, timeout=None):
+    now = time.time()
+    if rrd is None:
+        rrd = os.path.join(rrddir, StationName + '.rrd')
+    daily = DailyLog(os.path.join(os.path.dirname(rrd), StationName + DailySuffix))
+    end = int(now) // 3600 * 3600
+    # a log record is written as the day it sums up ends, so day n's
+    # record is stamped in day n-1
+    wanted = [n for n in gapDays(rrd, days, daemon, now)
+              if not daily.covers(end - (n - 1) * Day, end - (n - 2) * Day)]
+    if not wanted:
+        return 0
+    try:
+        then, hm, recs = fetchLogs(StationName, host, port, [n - 1 for n in wanted], timeout or SockTimeout)
+    except (socket.timeout, socket.error) as e:
+        print 'Station %s backfill connection error: %s' % (StationName, e)
+        return 0
+    except (ValueError, OverflowError) as e:    # status reply that doesn't decode
+        print 'Station %s backfill status error: %s' % (StationName, e)
+        return 0
+    for rec in recs:
+        # the log record holds one 16 bit hourmeter register, the low
+        # bits of the 24 bit status one
+        hours = (int(hm) - rec.rawOf('hourmeter')) & 0xFFFF
+        daily.add(then - hours * 3600, rec.raw)
+    daily.save()
+    print 'Station %s: %d gap days, %d daily log records backfilled' % (StationName, len(wanted), len(recs))
+    return len(recs)
+# ... End backfillStation Function ...
+
+if __name__ == '__main__':
+    rrddir = '.'
+    days = LogDays
+    daemon = None
+    names = []
+    args = sys.argv[1:]
+    while args:
+        a = args.pop(0)
+        if a == '-d':
+            rrddir = args.pop(0)
+        elif a == '--days':
+            days = int(args.pop(0))
+        elif a == '--daemon':
+            daemon = args.pop(0)
+        elif a.startswith('-'):
+            print 'usage: %s [-d rrddir] [--days N] [--daemon addr] [StationName ...]' % sys.argv[0]
+            sys.exit(1)
+        else:
+            names.append(a)
+    stations = StationRegistry(os.path.join(rrddir, StationFile))
+    stations.refresh()
+    for st in stations.stations:
+        if names and st.name not in names:
+            continue
+        backfillStation(st.name, st.host, st.port, rrddir, days, daemon, st.rrd, st.ceiling())
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Polling loop benchmark against the simulated fleet (simulator.py).
+#
+# Starts a simulator with n stations in a child process, then polls the
+# whole fleet for a number of cycles the way Insert8.3.py does (frames
+# checked and decoded with doStatus) and reports:
+#
+#   stations/s      good samples per second of polling
+#   cycle           seconds to poll the whole fleet (mean, max)
+#   Comm_Duration   request to frame, p50 / p99
+#   poll            whole per-station poll as seen by the loop
+#                   (connect included in oneshot mode), p50 / p99
+#   decode          checksum + decode per frame, p50 / p99
+#
+#   python bench.py [-n stations] [-c cycles] [--mode oneshot|persistent]
+#       [--maxinflight n] [--timeout s] [--latency s] [--jitter s]
+#       [--fragment n] [--corrupt f] [--drop f] [-p first port]
+#
+# Run it before and after a change to the poll path, same arguments.
+#---------------------------------------------------------------
+import multiprocessing
+import sys
+import time
+
+import simulator
+from connpool import ConnectionPool, UP
+from mppt import BadChecksum, doStatus
+from poller import pollStations
+
+Cycles = 5
+Stations = 200
+MaxInFlight = 32
+Timeout = 10
+ConnectWait = 30    # seconds persistent mode waits for the pool to connect
+
+# ===================================================================
+# Nearest rank percentile of a sorted list, None if it is empty.
+# ===================================================================
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+# ... End percentile Function ...
+
+# ===================================================================
+# Run the simulator (in the child process) until killed.
+# ===================================================================
+def _simulate(stations, ready):
+    simulator.raiseFileLimit()
+    sim = simulator.Simulator(stations)
+    ready.set()
+    sim.run()
+# ... End _simulate Function ...
+
+class Results(object):
+
+    def __init__(self):
+        self.ok = 0
+        self.failed = 0
+        self.cycles = []       # seconds per cycle
+        self.comm = []         # Comm_Duration per good sample
+        self.poll = []         # start of cycle to result, per station
+        self.decode = []       # doStatus time per frame
+
+    # one (StationName, data, Comm_Duration, stamp) poll result
+    def add(self, result, start):
+        name, data, duration, stamp = result
+        self.poll.append(time.time() - start)
+        if data is None:
+            self.failed += 1
+            return
+        t = time.time()
+        try:
+            doStatus(data, name, stamp, duration, echo=False)
+        except (BadChecksum, ValueError):
+            self.failed += 1
+            return
+        self.decode.append(time.time() - t)
+        self.comm.append(duration)
+        self.ok += 1
+
+    def report(self, mode, n):
+        total = sum(self.cycles)
+        print 'mode %s, %d stations, %d cycles' % (mode, n, len(self.cycles))
+        print '  samples        %d good, %d failed' % (self.ok, self.failed)
+        print '  stations/s     %.1f' % (self.ok / total if total else 0.0)
+        print '  cycle          mean %.3f s, max %.3f s' % (total / len(self.cycles), max(self.cycles))
+        for label, values, scale, unit in (('Comm_Duration', self.comm, 1e3, 'ms'),
+                                           ('poll', self.poll, 1e3, 'ms'),
+                                           ('decode', self.decode, 1e6, 'us')):
+            values.sort()
+            if values:
+                print '  %-14s p50 %.3f %s, p99 %.3f %s' % (label, percentile(values, 0.5) * scale, unit,
+                                                          percentile(values, 0.99) * scale, unit)
+# ... End Results Class ...
+
+# ===================================================================
+# Poll the fleet 'cycles' times with poller.pollStations.
+# ===================================================================
+def benchOneshot(stations, cycles, maxinflight, timeout):
+    r = Results()
+    for i in range(cycles):
+        start = time.time()
+        for result in pollStations(stations, maxinflight, timeout):
+            r.add(result, start)
+        r.cycles.append(time.time() - start)
+    return r
+# ... End benchOneshot Function ...
+
+# ===================================================================
+# Poll the fleet 'cycles' times through a persistent ConnectionPool.
+# Connecting the pool is not timed.
+# ===================================================================
+def benchPersistent(stations, cycles, timeout):
+    pool = ConnectionPool(timeout)
+    pool.setStations(stations)
+    names = [stn[0] for stn in stations]
+    until = time.time() + ConnectWait
+    while time.time() < until and any(c.state != UP for c in pool.conns.values()):
+        pool.service(0.05)
+    r = Results()
+    for i in range(cycles):
+        start = time.time()
+        pool.ask(names)
+        left = len(names)
+        until = start + timeout + 1
+        while left and time.time() < until:
+            pool.service(0.05)
+            for result in pool.answers():
+                r.add(result, start)
+                left -= 1
+        r.cycles.append(time.time() - start)
+    pool.close()
+    return r
+# ... End benchPersistent Function ...
+
+if __name__ == '__main__':
+    n = Stations
+    cycles = Cycles
+    mode = 'oneshot'
+    maxinflight = MaxInFlight
+    timeout = Timeout
+    first = simulator.FirstPort
+    opts = {}
+    args = sys.argv[1:]
+    try:
+        while args:
+            a = args.pop(0)
+            if a == '-n':
+                n = int(args.pop(0))
+            elif a == '-c':
+                cycles = int(args.pop(0))
+            elif a == '-p':
+                first = int(args.pop(0))
+            elif a == '--mode' and args[0] in ('oneshot', 'persistent'):
+                mode = args.pop(0)
+            elif a == '--maxinflight':
+                maxinflight = int(args.pop(0))
+            elif a == '--timeout':
+                timeout = float(args.pop(0))
+            elif a in ('--latency', '--jitter', '--corrupt', '--drop'):
+                opts[a[2:]] = float(args.pop(0))
+            elif a == '--fragment':
+                opts['fragment'] = int(args.pop(0))
+            else:
+                raise ValueError(a)
+    except (ValueError, IndexError):
+        print 'usage: %s [-n stations] [-c cycles] [--mode oneshot|persistent] [--maxinflight n] [--timeout s] [--latency s] [--jitter s] [--fragment n] [--corrupt f] [--drop f] [-p first port]' % sys.argv[0]
+        sys.exit(1)
+
+    simulator.raiseFileLimit()
+    fleet = simulator.fleet(n, first, **opts)
+    ready = multiprocessing.Event()
+    sim = multiprocessing.Process(target=_simulate, args=(fleet, ready))
+    sim.daemon = True
+    sim.start()
+    if not ready.wait(60):
+        print 'simulator did not start'
+        sys.exit(1)
+    stations = [(st.name, '127.0.0.1', st.port) for st in fleet]
+    try:
+        if mode == 'oneshot':
+            r = benchOneshot(stations, cycles, maxinflight, timeout)
+        else:
+            r = benchPersistent(stations, cycles, timeout)
+    finally:
+        sim.terminate()
+    r.report(mode, n)
@@ -0,0 +1,302 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Raw frame capture archive and replay.
+#
+# Once a frame is decoded the string is gone, so a decode or storage
+# bug can't be reproduced and old data can't be run in again after a
+# schema change. With capture on (CaptureFrames in Insert8.3.py) every
+# frame received, good or bad, is appended to a gzip'ed archive:
+#
+#   CapturePath/frames-YYYYmmdd-HHMMSS.gz    one segment per SegmentSecs
+#
+# one line per frame, tab separated:
+#   stamp  Comm_Duration  StationName  frame (no CRLF, string_escape'd)
+#
+# Segments are flushed with the other buffered writes (flushDue/flush),
+# a crash loses at most the unflushed tail of the open one.
+#
+# replay streams archives back through the checksum, the decoder
+# (DecodePlan.decodeFrames, ReplayBatch frames at a time) and storage
+# as fast as it can:
+#
+#   python capture.py replay [-d rrddir] [--raw rawdir] [--delta deltadir]
+#       [--log] [--alerts] [--station StationName] [--batch N] archive.gz|directory ...
+#
+#   -d      write the samples to StationName.rrd files in rrddir,
+#           created (starting before their first sample) if missing
+#   --raw   write them to a raw store (rawstore.py) in rawdir
+#   --delta write them to a change-only archive (delta.py) in deltadir
+#   --log   print every sample's log line (logsink.csvLine), to diff
+#           the output of two versions
+#   --alerts  print the alerts (alerts.py) the frames would have sent,
+#           to try out rule changes on old data
+# With none of -d, --raw or --delta the frames are only checked and decoded, a
+# regression / speed test of the decoder.
+#---------------------------------------------------------------
+import glob
+import gzip
+import os
+import sys
+import time
+import zlib
+
+from logsink import csvLine
+from mppt import StatusPlan, checksum
+
+SegmentSecs = 3600   # seconds per archive segment
+Level = 6            # gzip compression level
+FlushSecs = 60       # longest a captured frame waits in the gzip buffer
+ReplayBatch = 1000   # frames decoded per batch in replay
+
+Prefix = 'frames-'
+
+class FrameArchive(object):
+
+    # ===================================================================
+    #  path - directory for the segments, made if missing
+    # ===================================================================
+    def __init__(self, path, segsecs=SegmentSecs, level=Level, flushsecs=FlushSecs):
+        self.path = path
+        self.segsecs = segsecs
+        self.level = level
+        self.flushsecs = flushsecs
+        self.f = None
+        self.ends = 0        # time.time() the open segment ends
+        self.flushed = 0
+        self.frames = 0      # frames captured
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    # ===================================================================
+    # Append one received frame.
+    # ===================================================================
+    def add(self, StationName, stamp, duration, frame):
+        if self.f is None or stamp >= self.ends:
+            self._segment(stamp)
+        self.f.write('%.3f\t%.3f\t%s\t%s\n' % (stamp, duration, StationName,
+                                                frame.rstrip('\r\n').encode('string_escape')))
+        self.frames += 1
+
+    def flushDue(self, now=None):
+        if now is None:
+            now = time.time()
+        if self.f is not None and now - self.flushed >= self.flushsecs:
+            self.flush()
+
+    # write the buffered frames out (a gzip sync point, readable after a crash)
+    def flush(self):
+        if self.f is not None:
+            self.f.flush()
+        self.flushed = time.time()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    # start a new segment for frames from 'stamp' on
+    def _segment(self, stamp):
+        self.close()
+        name = os.path.join(self.path, Prefix + time.strftime('%Y%m%d-%H%M%S', time.localtime(stamp)) + '.gz')
+        self.f = gzip.open(name, 'ab', self.level)
+        self.ends = (int(stamp) // self.segsecs + 1) * self.segsecs
+        self.flushed = time.time()
+# ... End FrameArchive Class ...
+
+# ===================================================================
+# Archive segments named on the command line (files or directories),
+# oldest first.
+# ===================================================================
+def archives(paths):
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            out.extend(sorted(glob.glob(os.path.join(p, Prefix + '*.gz'))))
+        else:
+            out.append(p)
+    return out
+# ... End archives Function ...
+
+# ===================================================================
+# Read one segment. Yields (frame, StationName, stamp, duration). A
+# segment cut short (the open one, or a crash) ends at the last whole
+# line.
+# ===================================================================
+def readArchive(path):
+    f = gzip.open(path, 'rb')
+    try:
+        while True:
+            try:
+                line = f.readline()
+            except (IOError, EOFError, zlib.error) as e:
+                print '%s: %s, stopped there' % (path, e)
+                return
+            if not line:
+                return
+            if not line.endswith('\n'):
+                return
+            fields = line[:-1].split('\t')
+            if len(fields) != 4:
+                continue
+            yield (fields[3].decode('string_escape'), fields[2], float(fields[0]), float(fields[1]))
+    finally:
+        f.close()
+# ... End readArchive Function ...
+
+# ===================================================================
+# True if a frame's checksum is right.
+# ===================================================================
+def checked(frame):
+    eod = frame.find('*')
+    if eod < 0:
+        return False
+    try:
+        return int(frame[eod + 1:eod + 3], 16) == checksum(frame)
+    except ValueError:
+        return False
+# ... End checked Function ...
+
+class Replay(object):
+
+    # ===================================================================
+    #  store   - storage.Storage the decoded samples go to, or None
+    #  log     - print each sample's log line
+    #  station - only this station's frames, None for all
+    # ===================================================================
+    def __init__(self, store=None, log=False, station=None, batch=ReplayBatch, created=None, alerts=None):
+        self.store = store
+        self.log = log
+        self.alerts = alerts      # alerts.AlertEngine the samples are run through, or None
+        self.station = station
+        self.batch = batch
+        self.created = created    # function(StationName, stamp) called for each new station
+        self.seen = set()
+        self.frames = 0
+        self.badsums = 0
+        self.badframes = 0
+        self.records = 0
+
+    # ===================================================================
+    # Replay a list of segments.
+    # ===================================================================
+    def run(self, paths):
+        pending = []
+        for path in paths:
+            for item in readArchive(path):
+                if self.station is not None and item[1] != self.station:
+                    continue
+                self.frames += 1
+                if not checked(item[0]):
+                    self.badsums += 1
+                    continue
+                pending.append(item)
+                if len(pending) >= self.batch:
+                    self._decode(pending)
+                    pending = []
+        if pending:
+            self._decode(pending)
+        if self.store is not None:
+            self.store.flush()
+
+    def _decode(self, batch):
+        for rec in StatusPlan.decodeFrames(batch):
+            if rec is None:
+                self.badframes += 1
+                continue
+            self.records += 1
+            if rec.station not in self.seen:
+                self.seen.add(rec.station)
+                if self.created is not None:
+                    self.created(rec.station, rec.stamp)
+            if self.log:
+                print csvLine(rec)
+            if self.store is not None:
+                self.store.add(rec)
+            if self.alerts is not None:
+                self.alerts.check(rec)
+# ... End Replay Class ...
+
+if __name__ == '__main__':
+    rrddir = None
+    rawdir = None
+    deltadir = None
+    log = False
+    alerts = None
+    station = None
+    batch = ReplayBatch
+    paths = []
+    args = sys.argv[1:]
+    usage = 'usage: %s replay [-d rrddir] [--raw rawdir] [--delta deltadir] [--log] [--alerts] [--station StationName] [--batch N] archive.gz|directory ...' % sys.argv[0]
+    if not args or args.pop(0) != 'replay':
+        print usage
+        sys.exit(1)
+    try:
+        while args:
+            a = args.pop(0)
+            if a == '-d':
+                rrddir = args.pop(0)
+            elif a == '--raw':
+                rawdir = args.pop(0)
+            elif a == '--delta':
+                deltadir = args.pop(0)
+            elif a == '--log':
+                log = True
+            elif a == '--alerts':
+                from alerts import AlertEngine, PrintSink, alertRules
+                alerts = AlertEngine(alertRules(), [PrintSink()])
+            elif a == '--station':
+                station = args.pop(0)
+            elif a == '--batch':
+                batch = int(args.pop(0))
+            elif a.startswith('-'):
+                raise ValueError(a)
+            else:
+                paths.append(a)
+    except (ValueError, IndexError):
+        print usage
+        sys.exit(1)
+    if not paths:
+        print usage
+        sys.exit(1)
+
+    backends = []
+    created = None
+    if rrddir is not None:
+        import rrdschema
+        from rrdstore import RRDWriter
+        from storage import RRDStorage
+        update = rrdschema.UpdateTemplate()
+        rrddir = os.path.join(rrddir, '')
+        writer = RRDWriter(rrddir, batch, sys.maxint, None, update.template)
+        backends.append(RRDStorage(writer, update))
+
+        # a missing RRD is created to start just before the station's first frame
+        def createMissing(StationName, stamp):
+            path = writer.path(StationName)
+            if not os.path.exists(path):
+                try:
+                    rrdschema.create(path, stamp - rrdschema.Step)
+                except rrdschema.rrdtool.error as e:
+                    print 'Station %s rrdtool create error: %s' % (StationName, e)
+        created = createMissing
+    if rawdir is not None:
+        from rawstore import RawStore
+        backends.append(RawStore(rawdir, batch, sys.maxint))
+    if deltadir is not None:
+        from delta import DeltaStore
+        backends.append(DeltaStore(deltadir))
+    store = None
+    if backends:
+        from storage import Storages
+        store = Storages(backends)
+
+    r = Replay(store, log, station, batch, created, alerts)
+    start = time.time()
+    r.run(archives(paths))
+    secs = time.time() - start
+    msg = '%d frames, %d bad checksums, %d bad frames, %d samples in %.2f s (%.0f frames/s)' % (
+        r.frames, r.badsums, r.badframes, r.records, secs, r.frames / secs if secs else 0)
+    if log:
+        sys.stderr.write(msg + '\n')
+    else:
+        print msg
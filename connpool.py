@@ -0,0 +1,378 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Persistent per-station connection pool.
+#
+# The one-shot poller (poller.py) opens a new TCP socket for every
+# station on every cycle. Over cellular links the connect dominates
+# Comm_Duration (4+ seconds for LCCR vs 0.3 for MARC), so this pool
+# keeps one long lived socket per station instead.
+#
+# Two ways to use it:
+#  ask()/answers() - 'persistent' mode. Send 'R\r' down the open socket
+#              of each due station and collect the status frames as they
+#              come in, then 'T\r' as before.
+#  take()    - 'passive' mode. Never send a request. The translator
+#              already emits a frame every 5 seconds in Timed mode,
+#              just keep the newest one per station.
+#
+# A socket that errors, times out or goes quiet is closed and retried
+# with exponential backoff (BackoffMin doubling up to BackoffMax).
+#
+# Given a linkhealth.LinkHealth, connects and requests use that station's
+# own timeouts and connect times are reported back to it. Given a
+# metrics.Metrics, phase times and errors are recorded per station.
+#---------------------------------------------------------------
+import errno
+import random
+import select
+import socket
+import time
+
+from framer import Framer
+from poller import resolve
+
+DOWN       = 0   # no socket, waiting for retry_at
+CONNECTING = 1   # non-blocking connect issued
+UP         = 2   # connected, reading frames
+
+BackoffMin = 1.0    # seconds before the first reconnect
+BackoffMax = 300.0  # cap for the doubling reconnect delay
+
+# ===================================================================
+# One station's long lived connection and its reconnect state.
+# ===================================================================
+class StationConn(object):
+    __slots__ = ('name', 'host', 'port', 'sock', 'state', 'framer',
+                 'backoff', 'retry_at', 'deadline', 'req_at', 'rx_at',
+                 'frame', 'stamp', 'duration', 'fresh', 'conn_at')
+
+    def __init__(self, name, host, port):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.state = DOWN
+        self.framer = Framer()   # checksums verified, corrupt frames skipped
+        self.backoff = BackoffMin
+        self.retry_at = 0
+        self.deadline = 0
+        self.req_at = None     # time 'R\r' was sent, None if no request open
+        self.rx_at = None      # time the first byte of the current frame arrived
+        self.frame = None      # newest complete frame
+        self.stamp = 0         # time.time() 'frame' arrived
+        self.duration = 0      # Comm_Duration for 'frame'
+        self.fresh = False     # 'frame' not handed out yet
+        self.conn_at = 0       # time the current connect was issued
+# ... End StationConn Class ...
+
+class ConnectionPool(object):
+
+    # ===================================================================
+    #  timeout - seconds allowed to connect, and to answer a request.
+    #            In passive mode a socket with no frame for this long is
+    #            considered dead and reconnected.
+    #  passive - True to listen to Timed mode frames only.
+    #  health  - optional linkhealth.LinkHealth for per-station connect
+    #            and request timeouts. The passive idle timeout stays
+    #            'timeout'.
+    #  metrics - optional metrics.Metrics
+    # ===================================================================
+    def __init__(self, timeout=30, passive=False, health=None, metrics=None):
+        self.timeout = timeout
+        self.passive = passive
+        self.health = health
+        self.metrics = metrics
+        self.conns = {}    # StationName -> StationConn
+        self.byfd = {}     # fileno -> StationConn
+        self.asked = {}    # StationName -> StationConn with an ask() open
+        self.failed = []   # ask()s that failed before a request went out
+        if hasattr(select, 'poll'):
+            self.p = select.poll()
+        else:
+            self.p = None
+
+    # ===================================================================
+    # Bring the pool in line with the station list. New stations are
+    # connected on the next service pass, removed ones are closed.
+    #  stations - list of (StationName, IP, Port)
+    # ===================================================================
+    def setStations(self, stations):
+        wanted = {}
+        for name, host, port in stations:
+            wanted[name] = (host, port)
+        for name in self.conns.keys():
+            c = self.conns[name]
+            if wanted.get(name) != (c.host, c.port):
+                self._drop(c, None)
+                del self.conns[name]
+        for name, (host, port) in wanted.items():
+            if name not in self.conns:
+                self.conns[name] = StationConn(name, host, port)
+
+    # ===================================================================
+    # Close every socket in the pool.
+    # ===================================================================
+    def close(self):
+        for c in self.conns.values():
+            self._drop(c, None)
+        self.conns = {}
+
+    # ===================================================================
+    # 'persistent' mode: send 'R\r' to the named stations. The frames are
+    # picked up with answers() as they come in. A station that is not
+    # connected right now is answered as failed straight away.
+    # ===================================================================
+    def ask(self, names):
+        now = time.time()
+        for name in names:
+            c = self.conns.get(name)
+            if c is None or c.state != UP or c.req_at is not None:
+                self.failed.append((name, None, 0, now))
+                continue
+            c.fresh = False
+            c.req_at = now
+            c.deadline = now + self._timeouts(name)[1]
+            if self._send(c, 'R\r', 'request'):
+                self.asked[name] = c
+            else:
+                self.failed.append((name, None, 0, now))
+
+    # ===================================================================
+    # Finished ask()s since the last call, as a list of
+    # (StationName, data, Comm_Duration, stamp) like poller.pollStations.
+    # 'data' is None for a station that failed, its error was printed
+    # when it went down. Answered stations are sent 'T\r'.
+    # ===================================================================
+    def answers(self):
+        results = self.failed
+        self.failed = []
+        for name, c in self.asked.items():
+            if c.fresh:
+                c.fresh = False
+                c.req_at = None
+                # Return translator to Timed Message Mode like doShortScan
+                self._send(c, 'T\r', 'release')
+                results.append((name, c.frame, c.duration, c.stamp))
+            elif c.req_at is None or self.conns.get(name) is not c:
+                results.append((name, None, 0, time.time()))    # dropped
+            else:
+                continue
+            del self.asked[name]
+        return results
+
+    # ===================================================================
+    # 'passive' mode: the newest frame each named station sent since it
+    # was last taken. Same tuples as answers(), 'data' is None for a
+    # station with nothing new.
+    # ===================================================================
+    def take(self, names):
+        now = time.time()
+        results = []
+        for name in names:
+            c = self.conns.get(name)
+            if c is not None and c.fresh:
+                c.fresh = False
+                results.append((name, c.frame, c.duration, c.stamp))
+            else:
+                results.append((name, None, 0, now))
+        return results
+
+    # ===================================================================
+    # Keep the pool serviced until 'until' (a time.time() value). Used in
+    # place of time.sleep between cycles so sockets keep draining and
+    # dropped stations get reconnected.
+    # ===================================================================
+    def serviceUntil(self, until):
+        while True:
+            left = until - time.time()
+            if left <= 0:
+                break
+            self.service(min(left, 1.0))
+
+    # ===================================================================
+    # One pass of the pool: start due reconnects, wait up to 'wait'
+    # seconds for socket activity and handle it, then expire deadlines.
+    # ===================================================================
+    def service(self, wait):
+        now = time.time()
+        for c in self.conns.values():
+            if c.state == DOWN and c.retry_at <= now:
+                self._connect(c)
+
+        ready = self._wait(max(0, wait))
+        for fd in ready:
+            c = self.byfd.get(fd)
+            if c is None:
+                continue
+            try:
+                if c.state == CONNECTING:
+                    self._connected(c)
+                else:
+                    self._read(c)
+            except (socket.timeout, socket.error) as e:
+                if c.state == CONNECTING:
+                    self._drop(c, 'Station %s (%s:%s) connection error: %s' % (c.name, c.host, c.port, e), 'connection_errors')
+                else:
+                    self._drop(c, 'Station %s receive error: %s' % (c.name, e), 'receive_errors')
+
+        now = time.time()
+        for c in self.conns.values():
+            if c.state == CONNECTING and c.deadline < now:
+                self._drop(c, 'Station %s (%s:%s) connection error: timed out' % (c.name, c.host, c.port), 'timeouts')
+            elif c.state == UP and c.deadline < now and (self.passive or c.req_at is not None):
+                self._drop(c, 'Station %s receive error: timed out' % (c.name), 'timeouts')
+
+    # ===================================================================
+    # ------------------------ internals --------------------------------
+    # ===================================================================
+    def _wait(self, wait):
+        if not self.byfd:
+            if wait:
+                time.sleep(wait)
+            return []
+        if self.p is not None:
+            return [fd for fd, ev in self.p.poll(wait * 1000)]
+        rd = [fd for fd, c in self.byfd.items() if c.state == UP]
+        wr = [fd for fd, c in self.byfd.items() if c.state == CONNECTING]
+        r, w, x = select.select(rd, wr, [], wait)
+        return r + w
+
+    # (connect timeout, request timeout) for a station
+    def _timeouts(self, name):
+        if self.health is not None:
+            return self.health.timeouts(name)
+        return self.timeout, self.timeout
+
+    def _connect(self, c):
+        c.state = CONNECTING
+        t = time.time()
+        try:
+            addr = resolve(c.host, c.port)
+            self._observe('resolve', c.name, time.time() - t)
+            c.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            c.sock.setblocking(0)
+            c.conn_at = time.time()
+            c.deadline = c.conn_at + self._timeouts(c.name)[0]
+            err = c.sock.connect_ex(addr)
+        except (socket.error, socket.gaierror) as e:
+            if c.sock is not None:
+                c.sock.close()
+                c.sock = None
+            self._drop(c, 'Station %s (%s:%s) connection error: %s' % (c.name, c.host, c.port, e), 'connection_errors')
+            return
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+            self._drop(c, 'Station %s (%s:%s) connection error: %s' % (c.name, c.host, c.port, errno.errorcode.get(err, err)), 'connection_errors')
+            return
+        fd = c.sock.fileno()
+        self.byfd[fd] = c
+        if self.p is not None:
+            self.p.register(fd, select.POLLOUT)
+
+    def _connected(self, c):
+        err = c.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            raise socket.error(err, errno.errorcode.get(err, 'connect failed'))
+        c.state = UP
+        c.framer.reset()
+        c.rx_at = None
+        now = time.time()
+        if self.health is not None:
+            self.health.connected(c.name, now - c.conn_at)
+        self._observe('connect', c.name, now - c.conn_at)
+        c.deadline = now + self.timeout     # idle, no request outstanding yet
+        if self.p is not None:
+            self.p.modify(c.sock.fileno(), select.POLLIN)
+        if self.passive:
+            # make sure the translator is streaming. Cell modems ignore it.
+            self._send(c, 'T\r', 'release')
+
+    def _read(self, c):
+        if c.framer.pending() == 0:
+            c.rx_at = None
+        try:
+            n = c.framer.recvInto(c.sock)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        if not n:
+            raise socket.error(errno.ECONNRESET, 'connection closed by station')
+        now = time.time()
+        if c.rx_at is None:
+            c.rx_at = now
+        # keep only the newest good frame, the Framer holds on to any partial tail
+        frame = None
+        bad = c.framer.bad
+        for f in c.framer.frames():
+            frame = f
+        if c.framer.bad != bad:
+            print 'Station %s CHECKSUM MISMATCH %s,%0X' % ((c.name,) + c.framer.lastbad)
+            if self.metrics is not None:
+                self.metrics.count('checksum_mismatches', c.name, c.framer.bad - bad)
+            if frame is None and c.req_at is not None:
+                # the reply to 'R\r' was corrupt: fail the ask now rather than
+                # wait out the deadline, the connection itself is fine
+                c.req_at = None
+                self.asked.pop(c.name, None)
+                self.failed.append((c.name, None, 0, now))
+                self._send(c, 'T\r', 'release')
+                c.rx_at = now if c.framer.pending() else None
+                return
+        if frame is None:
+            return
+        if self.passive or c.req_at is not None:
+            c.frame = frame.tobytes()
+            c.stamp = now
+            if c.req_at is not None:
+                c.duration = now - c.req_at
+                self._observe('receive', c.name, c.duration)
+            else:
+                c.duration = now - c.rx_at
+            c.fresh = True
+            c.backoff = BackoffMin
+        c.rx_at = now if c.framer.pending() else None
+        # any request is answered now, back to the idle timeout (ask() sets
+        # the station's request timeout while one is outstanding)
+        c.deadline = now + self.timeout
+
+    # send 'msg', timed as 'phase'
+    def _send(self, c, msg, phase):
+        t = time.time()
+        try:
+            c.sock.send(msg)
+        except socket.error as e:
+            self._drop(c, 'Station %s send error: %s' % (c.name, e), 'receive_errors')
+            return False
+        self._observe(phase, c.name, time.time() - t)
+        return True
+
+    def _observe(self, phase, name, secs):
+        if self.metrics is not None:
+            self.metrics.observe(phase, name, secs)
+
+    # close the socket (always) and schedule a reconnect with backoff,
+    # counting 'counter' in the metrics
+    def _drop(self, c, why, counter=None):
+        if why:
+            print why
+        if counter and self.metrics is not None:
+            self.metrics.count(counter, c.name)
+        if c.sock is not None:
+            fd = c.sock.fileno()
+            if fd in self.byfd:
+                del self.byfd[fd]
+                if self.p is not None:
+                    self.p.unregister(fd)
+            try:
+                c.sock.close()
+            except socket.error:
+                pass
+            c.sock = None
+        if c.state != DOWN or why:
+            c.retry_at = time.time() + c.backoff * random.uniform(0.9, 1.1)
+            c.backoff = min(c.backoff * 2, BackoffMax)
+        c.state = DOWN
+        c.req_at = None
+        c.framer.reset()
+        c.rx_at = None
+# ... End ConnectionPool Class ...
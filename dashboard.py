@@ -0,0 +1,247 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Built in web dashboard.
+#
+# MCSOH2.html only showed MARC and LCCR, and its PNGs were only as new
+# as the last all.sh run, which drew every graph whether anyone looked
+# or not. This serves the page itself:
+#
+#   /                     page with every station's graphs, built from
+#                         StationList.txt (re-read when it changes)
+#   /MARC_voltage_graph.png, ... the graphs.py graphs, same names
+#   /latest               each station's last sample as JSON, from the
+#                         running Insert8.3.py's live socket (--live,
+#                         live.py), once per shard with supervisor.py
+#
+# A graph is drawn in memory the first time it is asked for and kept in
+# an LRU cache of CacheSize images. For CacheTTL seconds it is served
+# as is. After that the RRD's mtime / last update are checked, and it is
+# only redrawn if they moved. Each image has an ETag made from the graph
+# arguments and the RRD state, so a browser's conditional GET
+# (If-None-Match) gets a 304 without anything being drawn.
+#
+#   python dashboard.py [-p port] [-d rrddir] [--daemon addr] [--ttl secs] [--live socket ...]
+#---------------------------------------------------------------
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import BaseHTTPServer
+import SocketServer
+
+import rrdtool
+
+import graphs
+import live
+from stations import StationRegistry
+
+Port = 8080
+CacheSize = 256     # images kept
+CacheTTL = 60       # seconds an image is served without looking at its RRD
+StationReload = 60  # seconds between checks for a changed StationList.txt
+
+Style = 'float: left; width: %d%%; margin-right: 1%%; margin-bottom: 0.1em;'
+
+class CachedImage(object):
+    __slots__ = ('checked', 'etag', 'data', 'lock')
+
+    def __init__(self):
+        self.checked = 0     # time.time() the RRD state was last looked at
+        self.etag = None
+        self.data = None     # PNG bytes
+        self.lock = threading.Lock()    # one drawer at a time per image
+# ... End CachedImage Class ...
+
+class Dashboard(object):
+
+    # ===================================================================
+    #  rrddir - directory holding StationList.txt and the RRD files
+    #  daemon - rrdcached address the RRDs are updated through, if any
+    # ===================================================================
+    def __init__(self, rrddir='.', daemon=None, ttl=CacheTTL, size=CacheSize):
+        self.rrddir = rrddir
+        self.daemon = daemon
+        self.ttl = ttl
+        self.size = size
+        self.lock = threading.Lock()
+        self.images = OrderedDict()   # png name -> CachedImage, oldest first
+        self.registry = StationRegistry(os.path.join(rrddir, graphs.StationFile), StationReload)
+        self.names = []
+        self.graphs = {}              # png name -> (png, rrds, args)
+        self.fleet = False            # FleetFile there when the list was built
+        self.draws = 0
+        self.hits = 0
+
+    # ===================================================================
+    # The station names, the graph list rebuilt if StationList.txt
+    # changed or fleet.py's FleetFile came or went.
+    # ===================================================================
+    def stations(self):
+        with self.lock:
+            fleet = os.path.exists(os.path.join(self.rrddir, graphs.FleetFile))
+            if not self.registry.refresh() and fleet == self.fleet:
+                return self.names
+            self.fleet = fleet
+            names = self.registry.names()
+            glist = {}
+            for png, rrds, args in graphs.graphList(names, self.rrddir, '', self.registry.rrds()):
+                glist[png] = (png, rrds, args)
+            self.names = names
+            self.graphs = glist
+            return names
+
+    # ===================================================================
+    # The HTML page, laid out like MCSOH2.html: a row per graph kind with
+    # the stations side by side, the fleet graphs last.
+    # ===================================================================
+    def page(self):
+        names = self.stations()
+        width = max(1, 96 // max(1, len(names)) - 1) if len(names) > 2 else 48
+        out = ['<HTML>', '<HEAD>', '<TITLE>STATION MPPT SOH Graphs</TITLE>', '</HEAD>',
+               '<BODY BGCOLOR="black" TEXT="white">',
+               '<H1>Station Power System State of Health Graphs:</H1>', '']
+        for kind in graphs.Kinds:
+            suffix = graphs.Templates[kind][0]
+            for name in names:
+                out.append('<img src=%s style="%s">' % (graphs.shortName(name) + suffix, Style % width))
+            out.append('')
+        for png in ['CommDura_graph.png'] + [graphs.FleetTemplates[kind][0] for kind in graphs.FleetKinds]:
+            if png in self.graphs:
+                out.append('<img src=%s style="%s">' % (png, Style % 96))
+        out += ['<p style="clear: both;">', '</BODY>', '</HTML>', '']
+        return '\n'.join(out)
+
+    # ===================================================================
+    # Look up a graph by PNG name.
+    # ...Returns (etag, data). 'data' is None if 'inm' (the request's
+    # ...If-None-Match) already matches, (None, None) for an unknown name.
+    # ...Raises rrdtool.error if drawing fails.
+    # ===================================================================
+    def image(self, name, inm=None):
+        self.stations()
+        with self.lock:
+            graph = self.graphs.get(name)
+            if graph is None:
+                return None, None
+            ci = self.images.pop(name, None)
+            if ci is None:
+                ci = CachedImage()
+            self.images[name] = ci     # most recently used last
+            while len(self.images) > self.size:
+                self.images.popitem(last=False)
+
+        with ci.lock:
+            now = time.time()
+            if ci.data is None or now - ci.checked >= self.ttl:
+                png, rrds, args = graph
+                state = graphs.rrdState(rrds, self.daemon)
+                etag = '"%s"' % hashlib.sha1(repr((args, state))).hexdigest()[:20]
+                if etag != ci.etag or ci.data is None:
+                    if inm is not None and etag in inm:
+                        return etag, None    # browser has it, nothing to draw
+                    ci.data = self._draw(args)
+                    ci.etag = etag
+                    ci.checked = now
+                    self.draws += 1
+                    return ci.etag, ci.data
+                ci.checked = now
+            self.hits += 1
+            if inm is not None and ci.etag in inm:
+                return ci.etag, None
+            return ci.etag, ci.data
+
+    # draw into memory instead of a file
+    def _draw(self, args):
+        extra = ['--watermark', time.ctime()]
+        if self.daemon:
+            extra += ['--daemon', self.daemon]
+        return rrdtool.graphv(*(['-'] + args[1:] + extra))['image']
+# ... End Dashboard Class ...
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    dash = None    # set by serve()
+    live = []      # live.py sockets for /latest
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].lstrip('/')
+        if path in ('', 'index.html', 'MCSOH2.html'):
+            self._send(200, 'text/html', self.dash.page(), [('Cache-Control', 'no-cache')])
+            return
+        if path == 'latest' and self.live:
+            try:
+                body = json.dumps(live.query(self.live, 'latest'), sort_keys=True)
+            except (socket.error, ValueError) as e:
+                self._send(503, 'text/plain', 'live socket error: %s\n' % e)
+                return
+            self._send(200, 'application/json', body, [('Cache-Control', 'no-cache')])
+            return
+        try:
+            etag, data = self.dash.image(path, self.headers.get('If-None-Match'))
+        except rrdtool.error as e:
+            self._send(500, 'text/plain', 'graph error: %s\n' % e)
+            return
+        if etag is None:
+            self._send(404, 'text/plain', 'no such graph\n')
+            return
+        headers = [('ETag', etag), ('Cache-Control', 'max-age=%d' % self.dash.ttl)]
+        if data is None:
+            self._send(304, None, None, headers)
+        else:
+            self._send(200, 'image/png', data, headers)
+
+    def _send(self, code, ctype, body, headers=()):
+        self.send_response(code)
+        if ctype:
+            self.send_header('Content-Type', ctype)
+        if body is not None:
+            self.send_header('Content-Length', str(len(body)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        if body is not None:
+            self.wfile.write(body)
+# ... End Handler Class ...
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# ===================================================================
+# Serve the dashboard until killed.
+# ===================================================================
+def serve(port=Port, rrddir='.', daemon=None, ttl=CacheTTL, sockets=None):
+    Handler.dash = Dashboard(rrddir, daemon, ttl)
+    Handler.live = sockets or []
+    httpd = Server(('', port), Handler)
+    print 'dashboard on port %d for %s' % (port, os.path.abspath(rrddir))
+    httpd.serve_forever()
+# ... End serve Function ...
+
+if __name__ == '__main__':
+    port = Port
+    rrddir = '.'
+    daemon = None
+    ttl = CacheTTL
+    sockets = []
+    args = sys.argv[1:]
+    while args:
+        a = args.pop(0)
+        if a == '-p':
+            port = int(args.pop(0))
+        elif a == '-d':
+            rrddir = args.pop(0)
+        elif a == '--daemon':
+            daemon = args.pop(0)
+        elif a == '--ttl':
+            ttl = float(args.pop(0))
+        elif a == '--live':
+            sockets.append(args.pop(0))
+        else:
+            print 'usage: %s [-p port] [-d rrddir] [--daemon addr] [--ttl secs] [--live socket ...]' % sys.argv[0]
+            sys.exit(1)
+    serve(port, rrddir, daemon, ttl, sockets)
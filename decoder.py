@@ -0,0 +1,227 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Table driven register decoder.
+#
+# A DecodePlan is built once from a register table laid out like
+# PStatLst / PLogLst ([Name, Scaler, Units] rows, see the "Key to Scaler
+# Field" comment in mppt.py). It turns a status frame into a Record in
+# one pass:
+#
+#   raw    - array('l') of the register integers, in table order
+#   value  - array('d') of the scaled values. _HI/_LO pairs (-3/-4) are
+#            joined into the 32 bit value and scaled, both slots hold it
+#   state  - tuple of the decoded state strings for the -1 registers
+#   bits   - tuple of the names of the set bits for the -2 registers
+#   regtext- the register part of the frame as received ('v,v,...'),
+#            decodeFrame only. The RRD update reuses it (rrdschema.py).
+#
+# Everything downstream (log line, RRD, alerts, ...) uses the Record
+# instead of re-indexing and int()'ing the params list again.
+#---------------------------------------------------------------
+import json
+from array import array
+from operator import mul
+
+# ===================================================================
+# Decode a bit field against a bit table laid out like PArryFault /
+# PLoadFault / PDipSwitch ([Name, bit=0 string, bit=1 string] per bit).
+# ...Returns a list of (Name, string for the bit's value), one per bit.
+# ===================================================================
+def bitdecode(value, bitlist):
+    out = []
+    for bit in range(len(bitlist)):
+        entry = bitlist[bit]
+        out.append((entry[0].strip(), entry[1 + ((value >> bit) & 1)]))
+    return out
+# ... End bitdecode Function ...
+
+class DecodePlan(object):
+
+    # ===================================================================
+    # Compile a register table.
+    #  table - list of [Name, Scaler, Units] as PStatLst / PLogLst
+    # ===================================================================
+    def __init__(self, table):
+        self.names = [row[0] for row in table]
+        self.n = len(table)
+        self.index = {}           # Name -> register offset
+        self.units = []           # units string per register
+        self.scales = array('d')  # scale factor per register
+        self.states = []          # (offset, state list) for -1 entries
+        self.bitfields = []       # (offset, bit name tuple, bit table) for -2 entries
+        self.longs = []           # (HI offset, LO offset, scale) for -3/-4 pairs
+        self.stateindex = {}      # Name -> offset into Record.state
+        self.bitindex = {}        # Name -> offset into Record.bits
+
+        for i in range(self.n):
+            name, scaler, units = table[i][0], table[i][1], table[i][2]
+            self.index[name] = i
+            if scaler == -1:
+                self.stateindex[name] = len(self.states)
+                self.states.append((i, list(units)))
+                self.scales.append(1)
+                self.units.append('')
+            elif scaler == -2:
+                self.bitindex[name] = len(self.bitfields)
+                self.bitfields.append((i, tuple([b[0].strip() for b in units]), units))
+                self.scales.append(1)
+                self.units.append('(bit field)')
+            elif scaler == -3:
+                # scale factor in the _HI units slot, units in the _LO one
+                if i + 1 >= self.n or table[i + 1][1] != -4:
+                    raise ValueError('%s (-3) is not followed by its -4 _LO register' % name)
+                self.longs.append((i, i + 1, units))
+                if name.endswith('_HI'):
+                    self.index[name[:-3]] = i
+                self.scales.append(0)
+                self.units.append(table[i + 1][2])
+            elif scaler == -4:
+                if not self.longs or self.longs[-1][1] != i:
+                    raise ValueError('%s (-4) does not follow a -3 _HI register' % name)
+                self.scales.append(0)
+                self.units.append(units)
+            else:
+                self.scales.append(scaler)
+                self.units.append(units)
+    # ... End __init__ ...
+
+    # ===================================================================
+    # Decode a list of register strings (or ints), already split, with
+    # any header items removed.
+    # ...Raises ValueError on a short list or a non numeric register.
+    # ===================================================================
+    def decodeFields(self, fields, station=None, stamp=0, duration=0.0, hdr=None, fwrev=None, regtext=None):
+        if len(fields) < self.n:
+            raise ValueError('%d registers, expected %d' % (len(fields), self.n))
+        raw = array('l', map(int, fields[:self.n]))
+        value = array('d', map(mul, raw, self.scales))
+        return self._record(raw, value, station, stamp, duration, hdr, fwrev, regtext)
+
+    # Record from the register integers and their plain scaled values
+    def _record(self, raw, value, station, stamp, duration, hdr, fwrev, regtext):
+        for hi, lo, sf in self.longs:
+            v = ((raw[hi] << 16) | raw[lo]) * sf
+            value[hi] = v
+            value[lo] = v
+        state = []
+        for i, lst in self.states:
+            v = raw[i]
+            state.append(lst[v] if 0 <= v < len(lst) else None)
+        bits = []
+        for i, names, lst in self.bitfields:
+            v = raw[i]
+            if v:
+                bits.append(tuple([names[b] for b in range(len(names)) if (v >> b) & 1]))
+            else:
+                bits.append(())
+        return Record(self, station, stamp, duration, hdr, fwrev, raw, value, tuple(state), tuple(bits), regtext)
+
+    # ===================================================================
+    # Decode a complete '$hdr,fwrev,reg...*XX\r\n' status frame. The
+    # checksum is not checked here, see mppt.doStatus.
+    # ===================================================================
+    def decodeFrame(self, frame, station=None, stamp=0, duration=0.0):
+        eod = frame.find('*')
+        fields = frame[1:eod].split(',')
+        sor = frame.find(',', frame.find(',') + 1) + 1    # past hdr,fwrev,
+        return self.decodeFields(fields[2:], station, stamp, duration, fields[0], fields[1], frame[sor:eod])
+
+    # ===================================================================
+    # Decode a batch of frames (replay, bulk re-ingest).
+    #  frames - list of (frame, station, stamp, duration)
+    # The register texts of the whole batch are joined and parsed in one
+    # go by the json module's C scanner (about 4x int() per field), and
+    # scaled in one map() call. Only text of nothing but digits, commas
+    # and minus signs is handed to it. If that or the parse fails the
+    # batch is split in halves down to a few frames, which are decoded
+    # one by one, so a bad frame only slows down its neighbours.
+    # ...Returns a list of Records, None for a frame that doesn't decode.
+    # ===================================================================
+    def decodeFrames(self, frames):
+        out = [None] * len(frames)
+        texts = []
+        good = []        # (offset in frames, hdr, fwrev, register text)
+        for k in range(len(frames)):
+            frame = frames[k][0]
+            eod = frame.find('*')
+            c1 = frame.find(',')
+            c2 = frame.find(',', c1 + 1)
+            text = frame[c2 + 1:eod]
+            if c1 < 0 or c2 < 0 or eod < c2:
+                continue
+            extra = text.count(',') - (self.n - 1)
+            if extra < 0:
+                continue
+            # like decodeFields, registers past the first n are ignored
+            texts.append(text.rsplit(',', extra)[0] if extra else text)
+            good.append((k, frame[1:c1], frame[c1 + 1:c2], text))
+        joined = ','.join(texts)
+        allraw = None
+        if joined.replace(',', '').replace('-', '').isdigit():
+            try:
+                allraw = array('l', json.loads('[' + joined + ']'))
+            except (ValueError, TypeError, OverflowError):    # '007', '1-2', out of range, ...
+                pass
+        if allraw is None:
+            if len(frames) > 16:
+                half = len(frames) // 2
+                return self.decodeFrames(frames[:half]) + self.decodeFrames(frames[half:])
+            for k, hdr, fwrev, text in good:
+                frame, station, stamp, duration = frames[k]
+                try:
+                    out[k] = self.decodeFields(text.split(','), station, stamp, duration, hdr, fwrev, text)
+                except (ValueError, OverflowError):
+                    pass
+            return out
+        allvalue = array('d', map(mul, allraw, self.scales * len(good)))
+        n = self.n
+        for j in range(len(good)):
+            k, hdr, fwrev, text = good[j]
+            frame, station, stamp, duration = frames[k]
+            out[k] = self._record(allraw[j * n:(j + 1) * n], allvalue[j * n:(j + 1) * n],
+                                  station, stamp, duration, hdr, fwrev, text)
+        return out
+# ... End DecodePlan Class ...
+
+# ===================================================================
+# One decoded sample. See the top of this file for the fields.
+# ===================================================================
+class Record(object):
+    __slots__ = ('plan', 'station', 'stamp', 'duration', 'hdr', 'fwrev',
+                 'raw', 'value', 'state', 'bits', 'regtext')
+
+    def __init__(self, plan, station, stamp, duration, hdr, fwrev, raw, value, state, bits, regtext=None):
+        self.plan = plan
+        self.station = station
+        self.stamp = stamp          # time.time() the frame was captured
+        self.duration = duration    # Comm_Duration in seconds
+        self.hdr = hdr
+        self.fwrev = fwrev
+        self.raw = raw
+        self.value = value
+        self.state = state
+        self.bits = bits
+        self.regtext = regtext
+
+    # scaled value by register name. _HI/_LO pairs also answer to the
+    # name without the suffix, e.g. get('Hourmeter')
+    def get(self, name):
+        return self.value[self.plan.index[name]]
+
+    # raw register integer by name
+    def rawOf(self, name):
+        return self.raw[self.plan.index[name]]
+
+    # state string of a -1 register, None if the value is out of range
+    def text(self, name):
+        return self.state[self.plan.stateindex[name]]
+
+    # names of the set bits of a -2 register
+    def setbits(self, name):
+        return self.bits[self.plan.bitindex[name]]
+
+    # full (Name, value string) expansion of a -2 register
+    def bitdecode(self, name):
+        i, names, lst = self.plan.bitfields[self.plan.bitindex[name]]
+        return bitdecode(self.raw[i], lst)
+# ... End Record Class ...
@@ -0,0 +1,382 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Change-only (delta) encoding of decoded samples.
+#
+# Most of the 45 registers hardly move from one poll to the next, yet
+# every one went to the log and to storage every cycle. DeltaEncoder
+# keeps each station's last Record and says what changed:
+#
+#   changes - transitions of the slow registers (Events): the states
+#             (Charge_State FLOAT>BULK_CHARGE), the fault / alarm / dip
+#             switch bit fields (Array_Fault +Overcurrent) and their
+#             _daily copies. Nothing when they didn't change.
+#   prev    - the station's previous Record, for the analog registers
+#             to be written relative to it. None when the sample has to
+#             be written whole: a station's first sample, one after a
+#             gap of more than MaxGap, and one every KeySecs so a reader
+#             can start part way in.
+#
+# Used by:
+#   logsink.LogSink - LogDelta in Insert8.3.py. A key line is the usual
+#                     line, the others only give the changes and the
+#                     VBatt / Vlvd steps of the logged (2 decimal) values
+#   DeltaStore      - 'delta' in StorageBackends, an archive of every
+#                     sample (like rawstore.py, a fraction of the size):
+#
+#   DeltaPath/deltas-YYYYmmdd-HHMMSS.gz    one segment per SegmentSecs
+#     stamp  StationName  Comm_Duration  K  v,v,...       every register
+#     stamp  StationName  Comm_Duration  D  i:d,i:d,...   register index:
+#                                          raw count change, 0s left out
+#   Each station's first sample in a segment is a K line, a segment
+#   reads on its own.
+#
+#   DeltaPath/changes.log   stamp  StationName  register  text
+#   every transition, a few lines a day per station, for "what changed"
+#
+#   python delta.py changes [--station StationName] [--register Name]
+#       [--since time] DeltaPath    transitions from changes.log
+#   python delta.py cat [--station StationName] DeltaPath|segment ...
+#                                   the archive back as full raw rows
+#   python capture.py replay --delta DeltaPath ...  builds an archive
+#                                   from captured frames
+#---------------------------------------------------------------
+import glob
+import gzip
+import os
+import sys
+import time
+import zlib
+
+from mppt import PAlarm, StatusPlan
+
+KeySecs = 3600       # seconds between whole samples (key lines) per station
+MaxGap = 600         # a sample after a longer gap is written whole
+SegmentSecs = 3600   # seconds per archive segment
+Level = 6            # gzip compression level
+FlushSecs = 60       # longest a sample waits in the gzip buffer
+
+Prefix = 'deltas-'
+ChangeFile = 'changes.log'
+
+KEY = 'K'
+DELTA = 'D'
+
+# ===================================================================
+# The slow registers, whose transitions are events:
+#   (name, register offsets joined high first, state list or None,
+#    bit names or None)
+# ===================================================================
+def _events():
+    out = []
+    for i, states in StatusPlan.states:
+        out.append((StatusPlan.names[i], (i,), states, None))
+    for i, names, table in StatusPlan.bitfields:
+        out.append((StatusPlan.names[i], (i,), None, names))
+    bitnames = dict((StatusPlan.names[i], names) for i, names, table in StatusPlan.bitfields)
+    alarms = tuple([entry[0].strip() for entry in PAlarm])
+    ix = StatusPlan.index
+    out.append(('Alarm', (ix['Alarm_HI'], ix['Alarm_LO']), None, alarms))
+    out.append(('Alarm_daily', (ix['Alarm_HI_daily'], ix['Alarm_LO_daily']), None, alarms))
+    out.append(('Array_Fault_daily', (ix['Array_Fault_daily'],), None, bitnames['Array_Fault']))
+    out.append(('Load_Fault_daily', (ix['Load_Fault_daily'],), None, bitnames['Load_Fault']))
+    return out
+# ... End _events Function ...
+
+Events = _events()
+
+class Change(object):
+    __slots__ = ('station', 'stamp', 'name', 'old', 'new', 'text')
+
+    def __init__(self, station, stamp, name, old, new, text):
+        self.station = station
+        self.stamp = stamp
+        self.name = name
+        self.old = old         # raw values
+        self.new = new
+        self.text = text       # 'FLOAT>BULK_CHARGE', '+Overcurrent -HVD'
+
+    def line(self):
+        return 'Station %s %s %s' % (self.station, self.name, self.text)
+# ... End Change Class ...
+
+def _value(raw, offsets):
+    v = 0
+    for i in offsets:
+        v = (v << 16) | raw[i]
+    return v
+
+def _state(states, v):
+    if 0 <= v < len(states):
+        return states[v]
+    return str(v)
+
+# ===================================================================
+# The transitions of the slow registers from one Record to the next.
+# ...Returns a list of Change.
+# ===================================================================
+def changes(prev, rec):
+    out = []
+    for name, offsets, states, bits in Events:
+        old = _value(prev.raw, offsets)
+        new = _value(rec.raw, offsets)
+        if old == new:
+            continue
+        if states is not None:
+            text = '%s>%s' % (_state(states, old), _state(states, new))
+        else:
+            flips = []
+            for b in range(len(bits)):
+                if (old ^ new) >> b & 1:
+                    flips.append(('+' if new >> b & 1 else '-') + bits[b])
+            text = ' '.join(flips)
+        out.append(Change(rec.station, rec.stamp, name, old, new, text))
+    return out
+# ... End changes Function ...
+
+class DeltaEncoder(object):
+
+    # ===================================================================
+    #  keysecs - seconds between samples written whole, per station
+    #  maxgap  - a sample this long after the last is written whole
+    # ===================================================================
+    def __init__(self, keysecs=KeySecs, maxgap=MaxGap):
+        self.keysecs = keysecs
+        self.maxgap = maxgap
+        self.last = {}       # StationName -> last Record
+        self.keyed = {}      # StationName -> stamp of its last key sample
+
+    # ===================================================================
+    # Take the station's next sample.
+    # ...Returns (prev, changes): prev the Record to write it relative
+    # ...to, None to write it whole; changes a list of Change (against
+    # ...the last sample, even across a gap).
+    # ===================================================================
+    def step(self, rec):
+        prev = self.last.get(rec.station)
+        self.last[rec.station] = rec
+        if prev is None:
+            self.keyed[rec.station] = rec.stamp
+            return None, []
+        out = changes(prev, rec)
+        keyed = self.keyed.get(rec.station)
+        if keyed is None or rec.stamp - prev.stamp > self.maxgap or rec.stamp - keyed >= self.keysecs:
+            self.keyed[rec.station] = rec.stamp
+            prev = None
+        return prev, out
+
+    # next sample of the station (all of them for None) written whole
+    def reset(self, StationName=None):
+        if StationName is None:
+            self.last.clear()
+            self.keyed.clear()
+        else:
+            self.last.pop(StationName, None)
+            self.keyed.pop(StationName, None)
+
+    # next sample of every station written whole, changes still found
+    def rekey(self):
+        for name in self.keyed:
+            self.keyed[name] = None
+# ... End DeltaEncoder Class ...
+
+# ===================================================================
+# The register part of an archive line: every raw value for a key,
+# else 'index:change' for the ones that moved.
+# ===================================================================
+def encodeRaw(raw, prev=None):
+    if prev is None:
+        return ','.join(map(str, raw))
+    return ','.join(['%d:%d' % (i, raw[i] - prev[i]) for i in range(len(raw)) if raw[i] != prev[i]])
+# ... End encodeRaw Function ...
+
+class DeltaStore(object):
+
+    # ===================================================================
+    # Storage backend (see storage.py) keeping every sample delta
+    # encoded in gzip'ed segments, and the transitions in changes.log.
+    #  path - directory for the segments, made if missing
+    # ===================================================================
+    def __init__(self, path, segsecs=SegmentSecs, level=Level, flushsecs=FlushSecs, maxgap=MaxGap):
+        self.path = path
+        self.segsecs = segsecs
+        self.level = level
+        self.flushsecs = flushsecs
+        self.encoder = DeltaEncoder(segsecs, maxgap)
+        self.f = None
+        self.ends = 0        # stamp the open segment ends
+        self.flushed = 0
+        self.samples = 0
+        self.keys = 0
+        self.changes = 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.log = open(os.path.join(path, ChangeFile), 'a')
+
+    def setStations(self, names):
+        for name in self.encoder.last.keys():
+            if name not in names:
+                self.encoder.reset(name)
+
+    def add(self, rec):
+        if self.f is None or rec.stamp >= self.ends:
+            self._segment(rec.stamp)
+        prev, found = self.encoder.step(rec)
+        if prev is None:
+            self.f.write('%.3f\t%s\t%.3f\t%s\t%s\n' % (rec.stamp, rec.station, rec.duration, KEY, encodeRaw(rec.raw)))
+            self.keys += 1
+        else:
+            self.f.write('%.3f\t%s\t%.3f\t%s\t%s\n' % (rec.stamp, rec.station, rec.duration, DELTA,
+                                                       encodeRaw(rec.raw, prev.raw)))
+        for c in found:
+            self.log.write('%.3f\t%s\t%s\t%s\n' % (c.stamp, c.station, c.name, c.text))
+        self.changes += len(found)
+        self.samples += 1
+
+    def flushDue(self, now=None):
+        if now is None:
+            now = time.time()
+        if now - self.flushed >= self.flushsecs:
+            self.flush()
+
+    # write the buffered samples out (a gzip sync point, readable after a crash)
+    def flush(self):
+        if self.f is not None:
+            self.f.flush()
+        self.log.flush()
+        self.flushed = time.time()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        self.log.flush()
+
+    # start a new segment for samples from 'stamp' on, every station's
+    # next sample written whole
+    def _segment(self, stamp):
+        self.close()
+        name = os.path.join(self.path, Prefix + time.strftime('%Y%m%d-%H%M%S', time.localtime(stamp)) + '.gz')
+        self.f = gzip.open(name, 'ab', self.level)
+        self.ends = (int(stamp) // self.segsecs + 1) * self.segsecs
+        self.flushed = time.time()
+        self.encoder.rekey()
+# ... End DeltaStore Class ...
+
+# ===================================================================
+# Archive segments named on the command line (files or directories),
+# oldest first.
+# ===================================================================
+def segments(paths):
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            out.extend(sorted(glob.glob(os.path.join(p, Prefix + '*.gz'))))
+        else:
+            out.append(p)
+    return out
+# ... End segments Function ...
+
+# ===================================================================
+# Read one segment back. Yields (StationName, stamp, duration, raw
+# list) per sample. D lines of a station with no K line before them
+# are skipped; a segment cut short ends at its last whole line.
+# ===================================================================
+def readDeltas(path):
+    last = {}
+    f = gzip.open(path, 'rb')
+    try:
+        while True:
+            try:
+                line = f.readline()
+            except (IOError, EOFError, zlib.error) as e:
+                print >>sys.stderr, '%s: %s, stopped there' % (path, e)
+                return
+            if not line or not line.endswith('\n'):
+                return
+            fields = line[:-1].split('\t')
+            if len(fields) != 5:
+                continue
+            stamp, name, duration, kind, regs = fields
+            if kind == KEY:
+                raw = map(int, regs.split(','))
+            else:
+                raw = last.get(name)
+                if raw is None:
+                    continue
+                raw = list(raw)
+                if regs:
+                    for item in regs.split(','):
+                        i, d = item.split(':')
+                        raw[int(i)] += int(d)
+            last[name] = raw
+            yield name, float(stamp), float(duration), raw
+    finally:
+        f.close()
+# ... End readDeltas Function ...
+
+# ===================================================================
+# Transitions out of DeltaPath/changes.log, oldest first. Yields
+# (stamp, StationName, register, text).
+# ===================================================================
+def readChanges(path, station=None, register=None, since=None):
+    f = open(os.path.join(path, ChangeFile))
+    try:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 4:
+                continue
+            stamp = float(fields[0])
+            if since is not None and stamp < since:
+                continue
+            if station is not None and fields[1] != station:
+                continue
+            if register is not None and fields[2] != register:
+                continue
+            yield stamp, fields[1], fields[2], fields[3]
+    finally:
+        f.close()
+# ... End readChanges Function ...
+
+if __name__ == '__main__':
+    station = None
+    register = None
+    since = None
+    paths = []
+    args = sys.argv[1:]
+    usage = ('usage: %s changes [--station StationName] [--register Name] [--since time] DeltaPath\n'
+             '       %s cat [--station StationName] DeltaPath|segment ...' % (sys.argv[0], sys.argv[0]))
+    cmd = args.pop(0) if args else None
+    try:
+        if cmd not in ('changes', 'cat'):
+            raise ValueError(cmd)
+        while args:
+            a = args.pop(0)
+            if a == '--station':
+                station = args.pop(0)
+            elif a == '--register' and cmd == 'changes':
+                register = args.pop(0)
+            elif a == '--since' and cmd == 'changes':
+                from export import parseTime
+                since = parseTime(args.pop(0))
+            elif a.startswith('-'):
+                raise ValueError(a)
+            else:
+                paths.append(a)
+        if not paths or (cmd == 'changes' and len(paths) != 1):
+            raise ValueError(paths)
+    except (ValueError, IndexError):
+        print usage
+        sys.exit(1)
+
+    if cmd == 'changes':
+        try:
+            for stamp, name, reg, text in readChanges(paths[0], station, register, since):
+                print '%s %s %s %s' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stamp)), name, reg, text)
+        except IOError as e:
+            print e
+            sys.exit(1)
+    else:
+        for path in segments(paths):
+            for name, stamp, duration, raw in readDeltas(path):
+                if station is None or name == station:
+                    print '%.3f,%s,%.3f,%s' % (stamp, name, duration, ','.join(map(str, raw)))
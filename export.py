@@ -0,0 +1,471 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Bulk export of station history, streamed a chunk at a time.
+#
+# Getting data out used to mean an rrdtool fetch per StationName.rrd and
+# the factors at the top of mppt.py applied by hand. This exports any
+# stations, registers and time range to:
+#
+#   csv    station,time,register,... a row per sample, unknown left empty
+#   jsonl  {"station": ..., "time": ..., register: value or null} a line
+#   npz    per station 'StationName' (rows x registers) and
+#          'StationName_time' arrays, plus 'columns' (the register names)
+#
+# Values are scaled through the PStatLst factors (StatusPlan) the way a
+# decoded Record is: volts, amps, Ah, and both halves of a _HI/_LO pair
+# holding the joined value. States and bit fields stay numbers. --counts
+# gives the raw register values instead.
+#
+# A station with a raw store (--raw, rawstore.py) is read from it, every
+# sample as polled. Otherwise from its RRD, the finest archive for each
+# part of the range: 1 minute rows for the last 14 days, 5 minute, hourly
+# and daily rows further back (rrdschema.Tiers). --step skips the finer
+# ones, --cf MIN / MAX reads those archives (the 1 minute one has only
+# AVERAGE). Times are the end of the row's step, as rrdtool fetch prints.
+#
+# The range is cut into chunks of ChunkRows rows. They are fetched and
+# scaled in worker processes (-j, one per CPU default), Ahead per worker
+# in flight at most, and written in station then time order as they come
+# back. Memory stays a few chunks whatever the range, 10 years included.
+# npz members are spooled to temp files (in TMPDIR) and added to the zip
+# when the station is done.
+#
+#   python export.py [-d rrddir] [--raw rawdir] [-o file] [-f csv|jsonl|npz]
+#       [-r Register,...] [--start time] [--end time] [--counts]
+#       [--cf AVERAGE|MIN|MAX] [--step secs] [-j jobs] [--daemon addr] [StationName ...]
+#
+# time is Unix seconds, YYYY-MM-DD[THH:MM] (local) or -N[dhm] back from
+# now. Default range is everything the RRDs hold (the raw store's
+# first sample with --raw) up to now. As a library:
+#
+#   for StationName, columns, stamp, a in iterChunks(['MARC_mppt'], ['Adc_vb_f']):
+#       ...    # a is rows x columns float64, nan where unknown
+#---------------------------------------------------------------
+import collections
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from cStringIO import StringIO
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import rrdtool
+
+import rrdschema
+from graphs import rrdFile
+from mppt import StatusPlan
+from rawstore import ColumnFile, RawReader
+from stations import StationFile, StationRegistry
+
+ChunkRows = 1440     # rows per fetch (a day of the 1 minute archive)
+Ahead = 2            # chunks in flight per worker process
+Formats = ('csv', 'jsonl', 'npz')
+Registers = [ds[0] for ds in rrdschema.DSList]
+
+# _HI/_LO partner of each half of a -3/-4 pair
+Partner = {}
+for hi, lo, scale in StatusPlan.longs:
+    Partner[StatusPlan.names[hi]] = StatusPlan.names[lo]
+    Partner[StatusPlan.names[lo]] = StatusPlan.names[hi]
+
+# ===================================================================
+# Check a register list, None for every register.
+# ...Raises ValueError naming an unknown register.
+# ===================================================================
+def registers(regs=None):
+    if not regs:
+        return list(Registers)
+    for name in regs:
+        if name not in Registers:
+            raise ValueError('unknown register %r' % name)
+    return list(regs)
+# ... End registers Function ...
+
+# ===================================================================
+# Time from the command line: Unix seconds, YYYY-MM-DD[THH:MM[:SS]]
+# local time, or -N[dhm] (days, hours, minutes) back from 'now'.
+# ...Raises ValueError.
+# ===================================================================
+def parseTime(text, now=None):
+    if now is None:
+        now = time.time()
+    if text.startswith('-') and text[-1:] in ('d', 'h', 'm'):
+        return now - float(text[1:-1]) * {'d': 86400, 'h': 3600, 'm': 60}[text[-1]]
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise ValueError('bad time %r' % text)
+# ... End parseTime Function ...
+
+# ===================================================================
+# Scale fetched register values in place the way DecodePlan does.
+#  a     - rows x len(names) float64
+#  names - the columns; a _HI/_LO pair is only joined if both are there
+# ===================================================================
+def scaleColumns(a, names):
+    col = dict((name, j) for j, name in enumerate(names))
+    for hi, lo, scale in StatusPlan.longs:
+        h = col.get(StatusPlan.names[hi])
+        l = col.get(StatusPlan.names[lo])
+        if h is not None and l is not None:
+            a[:, h] = (a[:, h] * 65536 + a[:, l]) * scale
+            a[:, l] = a[:, h]
+    for j, name in enumerate(names):
+        i = StatusPlan.index.get(name)
+        if i is not None and StatusPlan.scales[i] not in (0, 1):
+            a[:, j] *= StatusPlan.scales[i]
+    return a
+# ... End scaleColumns Function ...
+
+# ===================================================================
+# RRD chunks for one station, oldest first: the finest tier (with 'cf'
+# and rows no finer than 'res') covering each part of t0..t1.
+# ...Returns [(start, end, tier resolution), ...], rows in (start, end].
+# ===================================================================
+def rrdChunks(t0, t1, now, cf='AVERAGE', res=None):
+    out = []
+    end = int(t1)
+    align = max([steps for steps, rows, cfs in rrdschema.Tiers]) * rrdschema.Step
+    for steps, rows, cfs in rrdschema.Tiers:
+        tres = steps * rrdschema.Step
+        if cf not in cfs or (res and tres < res):
+            continue
+        end = end // tres * tres
+        oldest = int(now) - rows * tres
+        if t0 >= oldest:
+            start = int(t0) // tres * tres
+        else:    # hand over to the next tier on a row boundary of every tier
+            start = -(-oldest // align) * align
+        while end > start:
+            out.append((max(start, end - ChunkRows * tres), end, tres))
+            end = out[-1][0]
+        if end <= t0:
+            break
+    out.reverse()
+    return out
+# ... End rrdChunks Function ...
+
+# ===================================================================
+# Fetch and scale one chunk. Runs in a worker process.
+#  job - ('rrd', StationName, rrd file, start, end, resolution, cf, daemon, fetch, regs, scaled)
+#     or ('raw', StationName, rawdir, first row, end row, None, None, None, fetch, regs, scaled)
+#        fetch - the registers read, regs plus the other half of any
+#                _HI/_LO pair when scaling
+# ...Returns (StationName, stamp array, rows x regs array, error).
+# ===================================================================
+def fetchChunk(job):
+    kind, StationName, path, start, end, res, cf, daemon, fetch, regs, scaled = job
+    try:
+        if kind == 'raw':
+            r = RawReader(path, StationName)
+            stamp = numpy.array(r.column('stamp')[start:end], dtype=numpy.float64)
+            a = numpy.empty((len(stamp), len(fetch)))
+            for j, name in enumerate(fetch):
+                a[:, j] = r.column(name)[start:end]
+        else:
+            extra = ['--daemon', daemon] if daemon else []
+            (first, last, step), names, data = rrdtool.fetch(path, cf, '-r', str(res), '-s', str(start),
+                                                             '-e', str(end), *extra)
+            if not data:
+                return StationName, None, None, None
+            names = list(names)
+            rows = numpy.array(data, dtype=numpy.float64)    # None (unknown) -> nan
+            stamp = first + step * numpy.arange(1, len(data) + 1, dtype=numpy.float64)
+            keep = (stamp > start) & (stamp <= end)          # fetch widens to whole rows
+            a = rows[:, [names.index(name) for name in fetch]][keep]
+            stamp = stamp[keep]
+            keep = ~numpy.isnan(a).all(axis=1)               # gaps
+            a, stamp = a[keep], stamp[keep]
+    except (rrdtool.error, IOError, OSError, ValueError) as e:
+        return StationName, None, None, '%s: %s' % (e.__class__.__name__, e)
+    if scaled:
+        scaleColumns(a, fetch)
+    if fetch != regs:
+        a = a[:, [fetch.index(name) for name in regs]]
+    return StationName, stamp, a, None
+# ... End fetchChunk Function ...
+
+# ===================================================================
+# The chunk jobs for every station, station by station. Generator, a
+# station's raw store is only opened when its turn comes.
+# ===================================================================
+def _jobs(names, fetch, regs, t0, t1, now, scaled, rrddir, paths, rawdir, cf, res, daemon):
+    for name in names:
+        if rawdir and os.path.exists(os.path.join(rawdir, name, ColumnFile)):
+            stamp = RawReader(rawdir, name).column('stamp')
+            lo = 0 if t0 is None else int(numpy.searchsorted(stamp, t0, 'left'))
+            hi = int(numpy.searchsorted(stamp, t1, 'right'))
+            del stamp
+            for first in range(lo, hi, ChunkRows):
+                yield ('raw', name, rawdir, first, min(hi, first + ChunkRows), None, None, None, fetch, regs, scaled)
+            continue
+        rrd = rrdFile(name, rrddir, paths)
+        start = 0 if t0 is None else t0
+        for cstart, cend, tres in rrdChunks(start, t1, now, cf, res):
+            yield ('rrd', name, rrd, cstart, cend, tres, cf, daemon, fetch, regs, scaled)
+# ... End _jobs Function ...
+
+# ===================================================================
+# Stream station history a chunk at a time.
+#  names  - StationNames, exported in this order
+#  regs   - registers (Registers names), None for all of them
+#  t0, t1 - time range, None for all of it / now
+#  scaled - PStatLst factors applied, False for raw register values
+#  paths  - optional {StationName: RRD file} for RRDs not in rrddir
+#  rawdir - raw store directory, used for the stations that have one
+# ...Yields (StationName, regs, stamp array, rows x regs array), each
+# ...station's chunks in time order. A chunk that can't be read is
+# ...reported on stderr and skipped.
+# ===================================================================
+def iterChunks(names, regs=None, t0=None, t1=None, scaled=True, rrddir='.', paths=None, rawdir=None,
+               jobs=None, cf='AVERAGE', res=None, daemon=None, now=None):
+    regs = registers(regs)
+    if now is None:
+        now = time.time()
+    if t1 is None:
+        t1 = now
+    fetch = list(regs)
+    if scaled:
+        fetch += [Partner[name] for name in regs if name in Partner and Partner[name] not in regs]
+    work = _jobs(names, fetch, regs, t0, t1, now, scaled, rrddir, paths, rawdir, cf, res, daemon)
+    pool = None
+    if jobs != 1:
+        pool = multiprocessing.Pool(jobs)
+        ahead = Ahead * (jobs or multiprocessing.cpu_count())
+    errors = {}
+    pending = collections.deque()
+    try:
+        while True:
+            if pool is None:
+                job = next(work, None)
+                if job is None:
+                    break
+                result = fetchChunk(job)
+            else:
+                for job in work:
+                    pending.append(pool.apply_async(fetchChunk, (job,)))
+                    if len(pending) >= ahead:
+                        break
+                if not pending:
+                    break
+                result = pending.popleft().get()
+            name, stamp, a, err = result
+            if err is not None:
+                if errors.get(name) != err:
+                    print >>sys.stderr, 'Station %s export error: %s' % (name, err)
+                errors[name] = err
+                continue
+            if stamp is not None and len(stamp):
+                yield name, regs, stamp, a
+    finally:
+        if pool is not None:
+            pool.terminate()    # a consumer may stop early, nothing left worth waiting for
+            pool.join()
+# ... End iterChunks Function ...
+
+def _fmt(v):
+    return '' if v != v else '%.10g' % v
+
+class CSVWriter(object):
+
+    def __init__(self, f, regs):
+        self.f = f
+        f.write(','.join(['station', 'time'] + regs) + '\n')
+
+    def write(self, StationName, stamp, a):
+        lines = []
+        for t, row in zip(stamp.tolist(), a.tolist()):
+            lines.append('%s,%.15g,%s\n' % (StationName, t, ','.join(map(_fmt, row))))
+        self.f.write(''.join(lines))
+
+    def close(self):
+        self.f.flush()
+# ... End CSVWriter Class ...
+
+class JSONLWriter(object):
+
+    def __init__(self, f, regs):
+        self.f = f
+        self.regs = regs
+
+    def write(self, StationName, stamp, a):
+        lines = []
+        for t, row in zip(stamp.tolist(), a.tolist()):
+            d = dict(zip(self.regs, [None if v != v else v for v in row]))
+            d['station'] = StationName
+            d['time'] = t
+            lines.append(json.dumps(d, sort_keys=True) + '\n')
+        self.f.write(''.join(lines))
+
+    def close(self):
+        self.f.flush()
+# ... End JSONLWriter Class ...
+
+class NPZWriter(object):
+
+    # ===================================================================
+    # numpy.load()able .npz. A station's rows are spooled to temp files
+    # as they come and become its two .npy members when the next station
+    # starts, so no array is ever held whole.
+    # ===================================================================
+    def __init__(self, path, regs):
+        self.zf = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True)
+        self.regs = regs
+        self.station = None
+        self.values = None
+        self.stamps = None
+        self.n = 0
+
+    def write(self, StationName, stamp, a):
+        if StationName != self.station:
+            self._finish()
+            self.station = StationName
+            self.values = tempfile.TemporaryFile()
+            self.stamps = tempfile.TemporaryFile()
+            self.n = 0
+        self.values.write(a.astype('<f8').tostring())
+        self.stamps.write(stamp.astype('<f8').tostring())
+        self.n += len(stamp)
+
+    def _member(self, key, data, shape):
+        npy = tempfile.NamedTemporaryFile(suffix='.npy')
+        try:
+            numpy.lib.format.write_array_header_1_0(npy, {'descr': '<f8', 'fortran_order': False, 'shape': shape})
+            data.seek(0)
+            shutil.copyfileobj(data, npy)
+            npy.flush()
+            self.zf.write(npy.name, key + '.npy')
+        finally:
+            npy.close()
+            data.close()
+
+    def _finish(self):
+        if self.station is None:
+            return
+        self._member(self.station, self.values, (self.n, len(self.regs)))
+        self._member(self.station + '_time', self.stamps, (self.n,))
+        self.station = None
+
+    def close(self):
+        self._finish()
+        columns = StringIO()
+        numpy.save(columns, numpy.array(self.regs))
+        self.zf.writestr('columns.npy', columns.getvalue())
+        self.zf.close()
+# ... End NPZWriter Class ...
+
+# ===================================================================
+# Export to a file (or an open file object for csv / jsonl). Takes the
+# iterChunks arguments.
+# ...Returns (rows written, stations with rows).
+# ===================================================================
+def export(names, out, fmt='csv', regs=None, **kw):
+    if fmt not in Formats:
+        raise ValueError('format %r is not one of %s' % (fmt, ', '.join(Formats)))
+    regs = registers(regs)
+    f = None
+    if fmt == 'npz':
+        writer = NPZWriter(out, regs)
+    else:
+        if isinstance(out, basestring):
+            out = f = open(out, 'w')
+        writer = {'csv': CSVWriter, 'jsonl': JSONLWriter}[fmt](out, regs)
+    rows = 0
+    seen = set()
+    try:
+        for name, columns, stamp, a in iterChunks(names, regs, **kw):
+            writer.write(name, stamp, a)
+            rows += len(stamp)
+            seen.add(name)
+        writer.close()
+    finally:
+        if f is not None:
+            f.close()
+    return rows, len(seen)
+# ... End export Function ...
+
+if __name__ == '__main__':
+    rrddir = '.'
+    rawdir = None
+    out = None
+    fmt = None
+    regs = None
+    t0 = t1 = None
+    scaled = True
+    cf = 'AVERAGE'
+    res = None
+    jobs = None
+    daemon = None
+    names = []
+    args = sys.argv[1:]
+    usage = ('usage: %s [-d rrddir] [--raw rawdir] [-o file] [-f csv|jsonl|npz] [-r Register,...]'
+             ' [--start time] [--end time] [--counts] [--cf AVERAGE|MIN|MAX] [--step secs] [-j jobs]'
+             ' [--daemon addr] [StationName ...]' % sys.argv[0])
+    try:
+        while args:
+            a = args.pop(0)
+            if a == '-d':
+                rrddir = args.pop(0)
+            elif a == '--raw':
+                rawdir = args.pop(0)
+            elif a == '-o':
+                out = args.pop(0)
+            elif a == '-f':
+                fmt = args.pop(0)
+            elif a == '-r':
+                regs = registers(args.pop(0).split(','))
+            elif a == '--start':
+                t0 = parseTime(args.pop(0))
+            elif a == '--end':
+                t1 = parseTime(args.pop(0))
+            elif a == '--counts':
+                scaled = False
+            elif a == '--cf':
+                cf = args.pop(0).upper()
+            elif a == '--step':
+                res = int(args.pop(0))
+            elif a == '-j':
+                jobs = int(args.pop(0))
+            elif a == '--daemon':
+                daemon = args.pop(0)
+            elif a.startswith('-'):
+                raise ValueError(a)
+            else:
+                names.append(a)
+        if fmt is None:    # from the file name, csv to stdout
+            fmt = os.path.splitext(out)[1][1:] if out else 'csv'
+        if fmt not in Formats:
+            raise ValueError('format %r is not one of %s' % (fmt, ', '.join(Formats)))
+        if fmt == 'npz' and not out:
+            raise ValueError('npz needs -o file')
+        if cf not in ('AVERAGE', 'MIN', 'MAX'):
+            raise ValueError('bad --cf %r' % cf)
+    except (ValueError, IndexError) as e:
+        print >>sys.stderr, e
+        print >>sys.stderr, usage
+        sys.exit(1)
+    if numpy is None:
+        print >>sys.stderr, 'export.py needs numpy'
+        sys.exit(1)
+    stations = StationRegistry(os.path.join(rrddir, StationFile))
+    stations.refresh()
+    if not names:
+        names = stations.names()
+    start = time.time()
+    rows, found = export(names, out or sys.stdout, fmt, regs, t0=t0, t1=t1, scaled=scaled, rrddir=rrddir,
+                         paths=stations.rrds(), rawdir=rawdir, jobs=jobs, cf=cf, res=res, daemon=daemon)
+    print >>sys.stderr, '%d rows from %d of %d stations in %.1f s' % (rows, found, len(names), time.time() - start)
@@ -0,0 +1,256 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Fleet summary RRD.
+#
+# A fleet view drawn straight from the station RRDs needs a DEF / CDEF
+# chain per station in one rrdtool command (as CommDura_graph does), and
+# gets slower and harder to read with every station added. This job
+# exports each station's Vdiff, Vbatt, Load_State and Comm_Duration
+# with rrdtool xport, in worker processes (-j, one per CPU default),
+# lines them up by timestamp and reduces across the fleet with NumPy:
+#
+#   reporting              stations with a sample in the step
+#   vdiff_min / _p10 / _p50  Vbatt - LVD of the worst station, 10th
+#                          percentile and median
+#   vbatt_min / _p50       battery volts, worst and median
+#   in_lvd                 stations in LVD_WARNING or LVD
+#   comm_p50 / _p95 / _max   Comm_Duration across the stations
+#
+# into FleetFile (fleet.rrd, next to the station RRDs, same tiers as
+# rrdschema). graphs.py draws the fleet graphs from that one file
+# whatever the size of the fleet.
+#
+# Each run carries on from the last row in fleet.rrd (the first run goes
+# back Backfill days) up to Settle seconds ago, as Insert8.3.py may
+# still be holding newer samples in its RRD buffer. A Chunk of steps is
+# exported and reduced at a time, memory is stations x Chunk rows.
+# Run it before graphs.py (all.sh does).
+#
+#   python fleet.py [-d rrddir] [-j jobs] [--daemon addr] [--days N] [StationName ...]
+#---------------------------------------------------------------
+import multiprocessing
+import os
+import sys
+import time
+import warnings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import rrdtool
+
+import rrdschema
+from graphs import FleetFile, rrdFile
+from stations import StationFile, StationRegistry
+
+Step = rrdschema.Step
+Backfill = 14        # days summarised on the first run (the 1 minute archive)
+Settle = 900         # seconds back from now left for the next run (RRDMaxAge + a step)
+Chunk = 240          # steps exported and reduced at a time (4 hours)
+
+# the summary DS: (name, min, max)
+Summary = [('reporting', 0, 1000000),
+           ('vdiff_min', -100, 100), ('vdiff_p10', -100, 100), ('vdiff_p50', -100, 100),
+           ('vbatt_min', 0, 100), ('vbatt_p50', 0, 100),
+           ('in_lvd', 0, 1000000),
+           ('comm_p50', 0, 600), ('comm_p95', 0, 600), ('comm_max', 0, 600)]
+
+# ===================================================================
+# rrdtool xport arguments for one station: vdiff, vbatt (volts),
+# Load_State and Comm_Duration, in that order.
+# ===================================================================
+def xportArgs(rrd, start, end, daemon=None):
+    args = ['--start', str(start), '--end', str(end), '--step', str(Step)]
+    if daemon:
+        args += ['--daemon', daemon]
+    args += ['DEF:vb=%s:Adc_vb_f:AVERAGE' % rrd,
+             'DEF:lvd=%s:V_lvd:AVERAGE' % rrd,
+             'DEF:ls=%s:Load_State:AVERAGE' % rrd,
+             'DEF:cd=%s:Comm_Duration:AVERAGE' % rrd,
+             'CDEF:vdiff=vb,lvd,-,100,32768,/,*',
+             'CDEF:vbatt=vb,100,32768,/,*',
+             'XPORT:vdiff', 'XPORT:vbatt', 'XPORT:ls', 'XPORT:cd']
+    return args
+# ... End xportArgs Function ...
+
+# ===================================================================
+# Export one station. Runs in a worker process.
+#  job - (StationName, rrd file, start, end, daemon)
+# ...Returns (StationName, first row time, step, rows x 4 array, error).
+# ===================================================================
+def exportStation(job):
+    StationName, rrd, start, end, daemon = job
+    try:
+        x = rrdtool.xport(*xportArgs(rrd, start, end, daemon))
+    except rrdtool.error as e:
+        return StationName, None, None, None, str(e)
+    meta = x['meta']
+    if not x['data']:
+        return StationName, None, None, None, None
+    a = numpy.array(x['data'], dtype=numpy.float64)    # None (unknown) -> nan
+    return StationName, meta['start'] + meta['step'], meta['step'], a, None
+# ... End exportStation Function ...
+
+# ===================================================================
+# Reduce one chunk across stations.
+#  cube - stations x rows x 4 (vdiff, vbatt, Load_State, Comm_Duration),
+#         nan where a station had no sample
+# ...Returns {summary DS name: array per row}.
+# ===================================================================
+def reduceFleet(cube):
+    vdiff = cube[:, :, 0]
+    vbatt = cube[:, :, 1]
+    ls = numpy.rint(cube[:, :, 2])
+    comm = cube[:, :, 3]
+    out = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)    # steps nobody reported in
+        out['reporting'] = numpy.sum(~numpy.isnan(vbatt), axis=0).astype(numpy.float64)
+        out['vdiff_min'] = numpy.nanmin(vdiff, axis=0)
+        out['vdiff_p10'], out['vdiff_p50'] = numpy.nanpercentile(vdiff, [10, 50], axis=0)
+        out['vbatt_min'] = numpy.nanmin(vbatt, axis=0)
+        out['vbatt_p50'] = numpy.nanpercentile(vbatt, 50, axis=0)
+        out['in_lvd'] = numpy.sum((ls == 2) | (ls == 3), axis=0).astype(numpy.float64)   # LVD_WARNING, LVD
+        out['comm_p50'], out['comm_p95'] = numpy.nanpercentile(comm, [50, 95], axis=0)
+        out['comm_max'] = numpy.nanmax(comm, axis=0)
+    return out
+# ... End reduceFleet Function ...
+
+class FleetSummary(object):
+
+    # ===================================================================
+    #  rrddir - where the station RRDs and FleetFile are
+    #  paths  - optional {StationName: RRD file} for RRDs not in rrddir
+    #  jobs   - export processes, default one per CPU
+    # ===================================================================
+    def __init__(self, rrddir='.', paths=None, jobs=None, daemon=None):
+        self.path = os.path.join(rrddir, FleetFile)
+        self.rrddir = rrddir
+        self.paths = paths or {}
+        self.jobs = jobs
+        self.daemon = daemon
+        self.rows = 0
+        self.errors = {}     # StationName -> last export error
+
+    # create FleetFile, its first row just after 'start'
+    def create(self, start):
+        ds = ['DS:%s:GAUGE:%d:%d:%d' % (name, rrdschema.Heartbeat, lo, hi) for name, lo, hi in Summary]
+        rrdtool.create(self.path, '--step', str(Step), '--start', str(int(start)), *(ds + rrdschema.rraDefs()))
+
+    def last(self):
+        if self.daemon:
+            return rrdtool.last('--daemon', self.daemon, self.path)
+        return rrdtool.last(self.path)
+
+    # ===================================================================
+    # Summarise from the last row written up to Settle seconds ago.
+    # ...Returns the rows written.
+    # ===================================================================
+    def run(self, names, days=Backfill, now=None):
+        if now is None:
+            now = time.time()
+        end = int(now - Settle) // Step * Step
+        if os.path.exists(self.path):
+            start = self.last()
+        else:
+            start = int(now - days * 86400) // Step * Step
+            self.create(start)
+        if start >= end or not names:
+            return 0
+        pool = None
+        if self.jobs != 1 and len(names) > 1:
+            pool = multiprocessing.Pool(self.jobs)
+        try:
+            while start < end:
+                stop = min(end, start + Chunk * Step)
+                work = [(name, rrdFile(name, self.rrddir, self.paths), start, stop, self.daemon) for name in names]
+                results = pool.map(exportStation, work) if pool is not None else map(exportStation, work)
+                self._chunk(start, stop, results)
+                start = stop
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return self.rows
+
+    # line the stations' rows up on one grid, reduce, write
+    def _chunk(self, start, stop, results):
+        n = (stop - start) // Step
+        cube = numpy.full((len(results), n, 4), numpy.nan)
+        for i, (name, first, step, a, err) in enumerate(results):
+            if err is not None:
+                if self.errors.get(name) != err:
+                    print 'Station %s fleet export error: %s' % (name, err)
+                self.errors[name] = err
+                continue
+            self.errors.pop(name, None)
+            if a is None:
+                continue
+            if step != Step:    # only coarse archives left for this range
+                a = numpy.repeat(a, step // Step, axis=0)
+                first -= step - Step    # a row stands for the step before its time
+            at = (first - (start + Step)) // Step
+            lo, hi = max(at, 0), min(at + len(a), n)
+            if lo < hi:
+                cube[i, lo:hi] = a[lo - at:hi - at]
+        out = reduceFleet(cube)
+        template = ':'.join([name for name, lo, hi in Summary])
+        updates = []
+        for r in range(n):
+            if not out['reporting'][r]:
+                continue
+            values = [out[name][r] for name, lo, hi in Summary]
+            updates.append('%d:' % (start + (r + 1) * Step) +
+                           ':'.join(['U' if v != v else '%.4f' % v for v in values]))
+        if not updates:
+            return
+        args = [self.path, '--template', template]
+        if self.daemon:
+            args += ['--daemon', self.daemon]
+        try:
+            rrdtool.update(*(args + updates))
+        except rrdtool.error as e:
+            print 'fleet summary update error (%d rows dropped): %s' % (len(updates), e)
+            return
+        self.rows += len(updates)
+# ... End FleetSummary Class ...
+
+if __name__ == '__main__':
+    rrddir = '.'
+    jobs = None
+    daemon = None
+    days = Backfill
+    names = []
+    args = sys.argv[1:]
+    usage = 'usage: %s [-d rrddir] [-j jobs] [--daemon addr] [--days N] [StationName ...]' % sys.argv[0]
+    try:
+        while args:
+            a = args.pop(0)
+            if a == '-d':
+                rrddir = args.pop(0)
+            elif a == '-j':
+                jobs = int(args.pop(0))
+            elif a == '--daemon':
+                daemon = args.pop(0)
+            elif a == '--days':
+                days = int(args.pop(0))
+            elif a.startswith('-'):
+                raise ValueError(a)
+            else:
+                names.append(a)
+    except (ValueError, IndexError):
+        print usage
+        sys.exit(1)
+    if numpy is None:
+        print 'fleet.py needs numpy'
+        sys.exit(1)
+    stations = StationRegistry(os.path.join(rrddir, StationFile))
+    stations.refresh()
+    if not names:
+        names = stations.names()
+    t = time.time()
+    fs = FleetSummary(rrddir, stations.rrds(), jobs, daemon)
+    rows = fs.run(names, days)
+    print '%d stations, %d rows written to %s in %.1f s' % (len(names), rows, fs.path, time.time() - t)
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Streaming frame parser for the translator's status strings.
+#
+#   $hdr,fwrev,reg0,...,reg44*XX\r\n
+#
+# The old myreceive() joined string chunks and stopped at the first chunk
+# holding "\r\n". Anything after the CRLF was dropped and a frame split
+# oddly across reads, or two frames in one read, came out garbled.
+#
+# Framer keeps the received bytes in one preallocated bytearray. Sockets
+# read straight into it (recvInto), frames are found incrementally and
+# handed out as memoryview slices of that buffer, no copies. The XOR
+# checksum is computed over the slice with a handful of long integer
+# operations instead of a Python loop over every character.
+#
+# A frame view is only good until the next recvInto()/feed() call, the
+# buffer is compacted in place to make room. Use .tobytes() to keep one.
+#---------------------------------------------------------------
+import binascii
+
+FrameBufLen = 4096   # default buffer size, a status frame is ~250 bytes
+
+# ===================================================================
+# XOR of every byte in a buffer (bytearray, memoryview or string)
+# ------------------------------------------------------
+# ...The whole buffer is turned into one long integer and folded in
+# ...half, byte aligned, until one byte is left. XOR is the same no
+# ...matter how the bytes are grouped, so this is log2(len) big
+# ...integer operations instead of len Python level ord() calls.
+# ===================================================================
+def xorsum(buf):
+    n = len(buf)
+    if n == 0:
+        return 0
+    v = int(binascii.hexlify(buf), 16)
+    width = 1
+    while width < n:
+        width <<= 1
+    while width > 1:
+        width >>= 1
+        bits = width << 3
+        v = (v >> bits) ^ (v & ((1 << bits) - 1))
+    return v
+# ... End xorsum Function ...
+
+# ===================================================================
+# Checksum a complete frame (view or string). The leading '$' and
+# everything from '*' on are not included, just like checksum().
+# ...Returns (calculated, sent). 'sent' is None if it can't be read.
+# ===================================================================
+def frameChecksum(frame):
+    if not isinstance(frame, memoryview):
+        frame = memoryview(frame)
+    star = len(frame) - 1
+    while star > 0 and frame[star] != '*':
+        star -= 1
+    calc = xorsum(frame[1:star])
+    try:
+        sent = int(frame[star + 1:].tobytes().strip(), 16)
+    except ValueError:
+        sent = None
+    return calc, sent
+# ... End frameChecksum Function ...
+
+class Framer(object):
+
+    # ===================================================================
+    #  size   - bytes of buffer. A run of this many bytes with no CRLF
+    #           is thrown away as line noise.
+    #  verify - True to check each frame's checksum and skip (and count
+    #           in .bad) the corrupt ones. False hands every frame out
+    #           and leaves the check to the caller (doStatus).
+    # ===================================================================
+    def __init__(self, size=FrameBufLen, verify=True):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.head = 0      # first byte not yet handed out
+        self.tail = 0      # end of received bytes
+        self.scan = 0      # where to resume looking for CRLF
+        self.verify = verify
+        self.good = 0      # frames handed out
+        self.bad = 0       # frames dropped on checksum
+        self.lastbad = None  # (sent, calculated) of the last dropped frame
+
+    # ===================================================================
+    # Forget anything buffered (new connection).
+    # ===================================================================
+    def reset(self):
+        self.head = self.tail = self.scan = 0
+
+    # ===================================================================
+    # Number of bytes received that are not part of a handed out frame.
+    # ===================================================================
+    def pending(self):
+        return self.tail - self.head
+
+    # ===================================================================
+    # Read whatever the socket has straight into the buffer.
+    # ...Returns the byte count, 0 means the peer closed the socket.
+    # ...socket errors (EAGAIN on non-blocking sockets too) are raised.
+    # ===================================================================
+    def recvInto(self, sock):
+        self._makeRoom()
+        n = sock.recv_into(self.view[self.tail:], len(self.buf) - self.tail)
+        self.tail += n
+        return n
+
+    # ===================================================================
+    # Add bytes from a string (simulators, replay, tests).
+    # ===================================================================
+    def feed(self, data):
+        while data:
+            self._makeRoom()
+            n = min(len(data), len(self.buf) - self.tail)
+            self.buf[self.tail:self.tail + n] = data[:n]
+            self.tail += n
+            data = data[n:]
+
+    # ===================================================================
+    # Generator of complete '$...*XX\r\n' frames received so far, as
+    # memoryviews into the buffer. Bytes in front of a '$' (a partial
+    # frame from mid stream, noise) are skipped.
+    # ===================================================================
+    def frames(self):
+        buf = self.buf
+        while True:
+            eol = buf.find('\r\n', max(self.scan, self.head), self.tail)
+            if eol < 0:
+                self.scan = max(self.head, self.tail - 1)
+                return
+            end = eol + 2
+            sof = buf.rfind('$', self.head, eol)
+            self.head = self.scan = end
+            if sof < 0:
+                continue        # tail of a frame we never saw the start of
+            frame = self.view[sof:end]
+            if self.verify:
+                calc, sent = frameChecksum(frame)
+                if calc != sent:
+                    self.bad += 1
+                    self.lastbad = (sent, calc)
+                    continue
+            self.good += 1
+            yield frame
+
+    # ===================================================================
+    # Make space at the end of the buffer, sliding unconsumed bytes to
+    # the front once less than a quarter is free. If the buffer is full
+    # of junk with no CRLF, drop it.
+    # ===================================================================
+    def _makeRoom(self):
+        if self.head == self.tail:
+            self.head = self.tail = self.scan = 0
+            return
+        if len(self.buf) - self.tail >= len(self.buf) >> 2:
+            return
+        if self.head == 0 and self.tail == len(self.buf):
+            self.head = self.tail = self.scan = 0    # no CRLF in a full buffer
+            return
+        if self.head == 0:
+            return
+        n = self.tail - self.head
+        self.buf[0:n] = self.view[self.head:self.tail]
+        self.scan -= self.head
+        self.head = 0
+        self.tail = n
+# ... End Framer Class ...
@@ -0,0 +1,475 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Graph renderer.
+#
+# Replaces the per-station MARC_vgraph.sh, LCCR_cgraph.sh, ... copies
+# and the generic vgraph.sh, cgraph.sh, ... templates they came from.
+# One template per graph kind, filled in for every station in
+# StationList.txt (or the ones named on the command line):
+#
+#   StationName_voltage_graph.png      Vbatt / Varray / LVD / Load_State
+#   StationName_currents_graph.png     Icharge / Iload
+#   StationName_ChargeState_graph.png  Charge_State
+#   StationName_Temps_graph.png        T_amb / T_batt
+#   StationName_vbatt-lvd_graph.png    Vbatt - LVD
+#   CommDura_graph.png                 Comm_Duration of every station
+#   Fleet_vdiff_graph.png, Fleet_lvd_graph.png, Fleet_CommDura_graph.png
+#                                      fleet summaries from fleet.rrd
+#                                      (fleet.py), if it exists
+#
+# StationName is the StationList name less '_mppt' (MARC_mppt -> MARC),
+# the same file names MCSOH2.html already shows.
+#
+# The graphs are drawn in a pool of worker processes (rrdtool graph is
+# CPU bound), and a PNG is only redrawn when one of its RRDs changed:
+# GraphCache remembers each RRD's mtime and last update time, and the
+# graph arguments, from when the PNG was last drawn.
+#
+#   python graphs.py [-d rrddir] [-o pngdir] [-j jobs] [--daemon addr]
+#                    [--force] [StationName_mppt ...]
+#---------------------------------------------------------------
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import rrdtool
+
+from stations import StationFile, StationRegistry
+
+CacheFile = 'graphcache.json'
+
+# arguments common to every graph
+Common = ['-w', '785', '-h', '120', '-a', 'PNG', '--slope-mode', '--end', 'now',
+          '--font', 'DEFAULT:7:', '--right-axis', '1:0', '--color', 'CANVAS#000000']
+
+# white on black, as the station graphs were drawn
+Dark = ['--color', 'FONT#FFFFFF', '--color', 'BACK#000000']
+
+StationStart = '-360000'   # ~4 days
+FleetStart = '-864000'     # 10 days
+
+# ===================================================================
+# Per-station graph templates.
+#   kind -> (png suffix, vertical label, lower limit, rrdtool lines)
+# '{rrd}' in a line is replaced by the station's RRD file.
+# ===================================================================
+Templates = {
+    'voltage': ('_voltage_graph.png', 'Volts', '0', [
+        'DEF:Adc_vb_f={rrd}:Adc_vb_f:AVERAGE',
+        'DEF:Adc_va_f={rrd}:Adc_va_f:AVERAGE',
+        'DEF:V_lvd={rrd}:V_lvd:AVERAGE',
+        'DEF:Load_State={rrd}:Load_State:AVERAGE',
+        'CDEF:LS=Load_State',
+        'CDEF:START=LS,0,EQ,LS,0,IF',
+        'CDEF:LOAD_ON=LS,1,EQ,LS,0,IF',
+        'CDEF:LVD_WARNING=LS,2,EQ,LS,0,IF',
+        'CDEF:Vbatt=Adc_vb_f,100,32768,/,*',
+        'CDEF:Varray=Adc_va_f,100,32768,/,*',
+        'CDEF:LVD=V_lvd,100,32768,/,*',
+        'COMMENT:The LVD voltage is a load current compensated, Low Voltage Disconnect.\\l',
+        'COMMENT:This line is a constant set point, but may adjust based on loading.\\l',
+        'COMMENT:The LVD Alarm will become visible(a yelow area), when Vbatt approaches/drops to LVD voltage.\\:\\l',
+        'LINE2:LVD#ff0000:LVD',
+        'GPRINT:LVD:LAST: Last\\:%2.2lf\\l',
+        'LINE2:Vbatt#ff00ff:Vbatt',
+        'GPRINT:Vbatt:LAST:Last\\:%2.2lf',
+        'GPRINT:Vbatt:AVERAGE:Avg\\:%2.2lf',
+        'GPRINT:Vbatt:MAX:Max\\:%2.2lf',
+        'GPRINT:Vbatt:MIN:Min\\:%2.2lf\\n',
+        'LINE2:Varray#0000ff:Varray',
+        'GPRINT:Varray:LAST:Last\\:%2.2lf',
+        'GPRINT:Varray:AVERAGE:Avg\\:%2.2lf',
+        'GPRINT:Varray:MAX:Max\\:%2.2lf',
+        'GPRINT:Varray:MIN:Min\\:%2.2lf\\n',
+        'AREA:LS#00ff00:Load_State',
+        'GPRINT:LS:LAST:Last\\:%2.1lf\\n']),
+
+    'currents': ('_currents_graph.png', 'Amps', '-5', [
+        'DEF:Adc_ic_f={rrd}:Adc_ic_f:AVERAGE',
+        'DEF:Adc_il_f={rrd}:Adc_il_f:AVERAGE',
+        'CDEF:Icharge=Adc_ic_f,79.16,32768,/,*',
+        'CDEF:Iload=Adc_il_f,-79.16,32768,/,*',
+        'COMMENT:The Icharge values are of positive value,(shown on the +y axis). Iload are negative,(shown on the -y axis).\\l',
+        'AREA:Icharge#00ff00:Icharge',
+        'GPRINT:Icharge:LAST:Last\\:%2.2lf',
+        'GPRINT:Icharge:AVERAGE:Avg\\:%2.2lf',
+        'GPRINT:Icharge:MAX:Max\\:%2.2lf',
+        'GPRINT:Icharge:MIN:Min\\:%2.2lf\\n',
+        'AREA:Iload#ff0000:Iload',
+        'GPRINT:Iload:LAST:Last\\:%2.2lf',
+        'GPRINT:Iload:AVERAGE:Avg\\:%2.2lf',
+        'GPRINT:Iload:MIN:Max\\:%2.2lf',     # Iload is negative, MIN is the largest load
+        'GPRINT:Iload:MAX:Min\\:%2.2lf\\n']),
+
+    'charge': ('_ChargeState_graph.png', 'Charge States', '0', [
+        'DEF:Charge_State={rrd}:Charge_State:AVERAGE',
+        'COMMENT:BULK CHARGE-The battery is not at 100% state of charge and battery voltage has not yet charged to the\\n',
+        'COMMENT:Absorption voltage setpoint. The controller will deliver 100% of available solar power to recharge\\n',
+        'COMMENT:the battery.\\n',
+        'COMMENT:' + '-' * 120 + '\\n',
+        'COMMENT:ABSORPTION-When the battery has recharged to the Absorption voltage setpoint, constant-voltage regulation\\n',
+        'COMMENT:is used to maintain battery voltage at the Absorption setpoint. This prevents heating and excessive battery gassing.\\n',
+        'COMMENT:The battery is allowed to come to full state of charge at the Absorption voltage setpoint.\\n',
+        'COMMENT:The battery must remain in the Absorption charging stage for a cumulative 120-150 minutes, depending on battery type,\\n',
+        'COMMENT:before transition to the Float stage will occur. However, Absorption time will be extended by 30 minutes if the battery\\n',
+        'COMMENT:dicharges below 12.5 V the previous night. The Absorption setpoint is temperature compensated if the RTS is connected.\\n',
+        'COMMENT:' + '-' * 120 + '\\n',
+        'COMMENT:FLOAT-After the battery is fully charged in the Absorption stage, the MPPT reduces the battery voltage to the Float\\n',
+        'COMMENT:voltage setpoint. When the battery is fully recharged, there can be no more chemical reactions and all the charging\\n',
+        'COMMENT:current is turned into heat and gassing. The float stage provides a very low rate of maintenance charging while reducing\\n',
+        'COMMENT:the heating and gassing of a fully charged battery. The purpose of Float is to protect the battery from long-term\\n',
+        'COMMENT:overcharge.\\n',
+        'COMMENT:Once in Float stage, loads can continue to draw power from the battery. In the event that the system load exceeds solar\\n',
+        'COMMENT:charge current, the controller will no longer be able to maintain the battery at the Float setpoint. Should the battery\\n',
+        'COMMENT:voltage remain below the Float setpoint for a cumulative 30 minutes, the controller will exit Float and retrun to Bulk.\\n',
+        'COMMENT:The Float setpoint is temperature compensated if the RTS is connected.\\n',
+        'COMMENT:' + '-' * 120 + '\\n',
+        'CDEF:CS=Charge_State',
+        'CDEF:Start=CS,0,EQ,CS,0,IF',
+        'AREA:Start#0099ff:Start=0',
+        'CDEF:Night_Check=CS,1,EQ,CS,0,IF',
+        'AREA:Night_Check#660066:Night_Check=1',
+        'CDEF:Disconnect=CS,2,EQ,CS,0,IF',
+        'AREA:Disconnect#990000:Disconnect=2',
+        'CDEF:Night=CS,3,EQ,CS,0,IF',
+        'AREA:Night#555555:Night=3',
+        'CDEF:Fault=CS,4,EQ,CS,0,IF',
+        'AREA:Fault#ff0000:Fault=4',
+        'CDEF:Bulk_Charge=CS,5,EQ,CS,0,IF',
+        'AREA:Bulk_Charge#ff9900:Bulk_Charge=5',
+        'CDEF:Absorption=CS,6,EQ,CS,0,IF',
+        'AREA:Absorption#ffff00:Absorption=6',
+        'CDEF:Float=CS,7,EQ,CS,0,IF',
+        'AREA:Float#00ff00:Float=7',
+        'CDEF:Equalize=CS,8,EQ,CS,0,IF',
+        'AREA:Equalize#ff00ff:Equalize=8\\n',
+        'GPRINT:CS:LAST:Last\\:%2.2lf\\n']),
+
+    'temps': ('_Temps_graph.png', 'Temperature in C degrees', '-30', [
+        'DEF:T_amb={rrd}:T_amb:AVERAGE',
+        'DEF:T_batt={rrd}:T_batt:AVERAGE',
+        'CDEF:Temp_Amb=T_amb,1,*',
+        'CDEF:Temp_Batt=T_batt,1,*',
+        'LINE1:Temp_Amb#ff0000:Ambient Temperature in Celcius',
+        'GPRINT:Temp_Amb:LAST:Last\\:%2.2lf',
+        'GPRINT:Temp_Amb:AVERAGE:Avg\\:%2.2lf',
+        'GPRINT:Temp_Amb:MAX:Max\\:%2.2lf',
+        'GPRINT:Temp_Amb:MIN:Min\\:%2.2lf\\n',
+        'LINE1:Temp_Batt#0000ff:Battery Temperature in Celcius',
+        'GPRINT:Temp_Batt:LAST:Last\\:%2.2lf',
+        'GPRINT:Temp_Batt:AVERAGE:Avg\\:%2.2lf',
+        'GPRINT:Temp_Batt:MAX:Max\\:%2.2lf',
+        'GPRINT:Temp_Batt:MIN:Min\\:%2.2lf\\n']),
+
+    'vbatt-lvd': ('_vbatt-lvd_graph.png', 'Volts', '0', [
+        'DEF:Adc_vb_f={rrd}:Adc_vb_f:AVERAGE',
+        'DEF:V_lvd={rrd}:V_lvd:AVERAGE',
+        'CDEF:Vbatt=Adc_vb_f,100,32768,/,*',
+        'CDEF:LVD=V_lvd,100,32768,/,*',
+        'CDEF:Vbatt-LVD=Vbatt,LVD,-',
+        'COMMENT:This line is the difference of Vbatt and LVD. When this line hits Zero, the Low Voltage Disconnect is activated.\\n',
+        'COMMENT:I think this may be a good way to watch mulitple systems longterm, it simplifies the graphs...I think. ~Marc \\n',
+        'LINE2:Vbatt-LVD#ff0000:Vbatt-LVD',
+        'GPRINT:Vbatt-LVD:LAST: Last\\:%2.2lf',
+        'GPRINT:Vbatt-LVD:AVERAGE: Avg\\:%2.2lf',
+        'GPRINT:Vbatt-LVD:MAX: Max\\:%2.2lf',
+        'GPRINT:Vbatt-LVD:MIN: Min\\:%2.2lf\\n']),
+}
+
+# drawing order of the per-station graphs
+Kinds = ['voltage', 'currents', 'temps', 'charge', 'vbatt-lvd']
+
+# line colors for the fleet Comm_Duration graph, reused past the end
+Palette = ['#ff0000', '#00ff00', '#000ff0', '#ffff00', '#ff00ff', '#00ffff',
+           '#ff9900', '#9999ff', '#ffffff', '#990000', '#009900', '#555555']
+
+# ===================================================================
+# Fleet summary graphs, all drawn from the one FleetFile fleet.py
+# writes, however many stations there are.
+#   kind -> (png name, title, vertical label, rrdtool lines)
+# ===================================================================
+FleetFile = 'fleet.rrd'
+FleetTemplates = {
+    'fleet-vdiff': ('Fleet_vdiff_graph.png', 'Fleet Vbatt - LVD', 'Volts', [
+        'DEF:min={rrd}:vdiff_min:AVERAGE',
+        'DEF:p10={rrd}:vdiff_p10:AVERAGE',
+        'DEF:p50={rrd}:vdiff_p50:AVERAGE',
+        'LINE2:min#ff0000:Worst station',
+        'GPRINT:min:LAST:Last\\:%2.2lf',
+        'GPRINT:min:MIN:Min\\:%2.2lf\\n',
+        'LINE2:p10#ffff00:10th percentile',
+        'GPRINT:p10:LAST:Last\\:%2.2lf\\n',
+        'LINE2:p50#00ff00:Median',
+        'GPRINT:p50:LAST:Last\\:%2.2lf\\n']),
+
+    'fleet-lvd': ('Fleet_lvd_graph.png', 'Stations in LVD_WARNING or LVD', 'Stations', [
+        'DEF:lvd={rrd}:in_lvd:MAX',
+        'DEF:up={rrd}:reporting:AVERAGE',
+        'AREA:lvd#ffff00:In LVD_WARNING / LVD',
+        'GPRINT:lvd:LAST:Last\\:%2.0lf',
+        'GPRINT:lvd:MAX:Max\\:%2.0lf\\n',
+        'LINE1:up#00ff00:Stations reporting',
+        'GPRINT:up:LAST:Last\\:%2.0lf\\n']),
+
+    'fleet-comm': ('Fleet_CommDura_graph.png', 'Fleet Communication Duration', 'Seconds', [
+        'DEF:p50={rrd}:comm_p50:AVERAGE',
+        'DEF:p95={rrd}:comm_p95:AVERAGE',
+        'DEF:max={rrd}:comm_max:AVERAGE',
+        'LINE1:max#ff0000:Slowest station',
+        'GPRINT:max:LAST:Last\\:%2.2lf',
+        'GPRINT:max:MAX:Max\\:%2.2lf\\n',
+        'LINE2:p95#ffff00:95th percentile',
+        'GPRINT:p95:LAST:Last\\:%2.2lf\\n',
+        'LINE2:p50#00ff00:Median',
+        'GPRINT:p50:LAST:Last\\:%2.2lf\\n']),
+}
+FleetKinds = ['fleet-vdiff', 'fleet-lvd', 'fleet-comm']
+
+# above this many stations the per-station CommDura graph is left to
+# the fleet graphs (when there is a FleetFile)
+FleetLines = len(Palette)
+
+# RRD file for a station, 'paths' {StationName: RRD file} overriding rrddir
+def rrdFile(StationName, rrddir, paths=None):
+    if paths and StationName in paths:
+        return paths[StationName]
+    return os.path.join(rrddir, StationName + '.rrd')
+
+# short station name used in the PNG names and titles, MARC_mppt -> MARC
+def shortName(StationName):
+    if StationName.endswith('_mppt'):
+        return StationName[:-5]
+    return StationName
+
+# ===================================================================
+# rrdtool.graph argument list for one station graph.
+# ...Returns (png path, [rrd files], args). The watermark (the time
+# ...drawn) is left out of 'args' so it doesn't change the cache key.
+# ===================================================================
+def stationGraph(kind, StationName, rrddir, pngdir, paths=None):
+    suffix, label, lower, lines = Templates[kind]
+    stn = shortName(StationName)
+    rrd = rrdFile(StationName, rrddir, paths)
+    png = os.path.join(pngdir, stn + suffix)
+    args = [png] + Common + Dark + [
+        '--start', StationStart,
+        '--title', 'Station %s MPPT Solar Controller Data' % stn,
+        '--vertical-label', label, '--right-axis-label', label,
+        '--lower-limit', lower]
+    args += [line.format(rrd=rrd) for line in lines]
+    return png, [rrd], args
+# ... End stationGraph Function ...
+
+# ===================================================================
+# rrdtool.graph argument list for the Comm_Duration graph of every
+# station, like CommDurationgraph.sh. Same return as stationGraph.
+# ===================================================================
+def fleetGraph(names, rrddir, pngdir, paths=None):
+    png = os.path.join(pngdir, 'CommDura_graph.png')
+    rrds = []
+    args = [png] + Common + [
+        '--start', FleetStart,
+        '--title', 'Round Trip Communication Duration',
+        '--vertical-label', 'Seconds', '--right-axis-label', 'Seconds',
+        '--lower-limit', '0']
+    for i in range(len(names)):
+        rrd = rrdFile(names[i], rrddir, paths)
+        rrds.append(rrd)
+        v = '%s_Comm_Duration%d' % (shortName(names[i]), i)
+        args += ['DEF:CD%d=%s:Comm_Duration:AVERAGE' % (i, rrd),
+                 'CDEF:%s=CD%d,1,*' % (v, i),
+                 'LINE1:%s%s:%s Communications Duration in Seconds' % (v, Palette[i % len(Palette)], names[i]),
+                 'GPRINT:%s:LAST:Last\\:%%2.2lf' % v,
+                 'GPRINT:%s:AVERAGE:Avg\\:%%2.2lf' % v,
+                 'GPRINT:%s:MAX:Max\\:%%2.2lf' % v,
+                 'GPRINT:%s:MIN:Min\\:%%2.2lf\\n' % v]
+    return png, rrds, args
+# ... End fleetGraph Function ...
+
+# ===================================================================
+# rrdtool.graph argument list for a fleet summary graph, drawn from
+# rrddir/FleetFile. Same return as stationGraph.
+# ===================================================================
+def fleetSummaryGraph(kind, rrddir, pngdir):
+    name, title, label, lines = FleetTemplates[kind]
+    rrd = os.path.join(rrddir, FleetFile)
+    png = os.path.join(pngdir, name)
+    args = [png] + Common + Dark + [
+        '--start', FleetStart,
+        '--title', title,
+        '--vertical-label', label, '--right-axis-label', label]
+    args += [line.format(rrd=rrd) for line in lines]
+    return png, [rrd], args
+# ... End fleetSummaryGraph Function ...
+
+# ===================================================================
+# Every graph for the passed stations, the per-station ones in Kinds
+# order then the fleet graphs. List of (png, [rrd files], args).
+#  paths - optional {StationName: RRD file} for RRDs not in rrddir
+# With a FleetFile (fleet.py) the summary graphs are added, and a fleet
+# of more than FleetLines stations no longer gets a line per station.
+# ===================================================================
+def graphList(names, rrddir='.', pngdir='.', paths=None):
+    graphs = []
+    for name in names:
+        for kind in Kinds:
+            graphs.append(stationGraph(kind, name, rrddir, pngdir, paths))
+    summary = os.path.exists(os.path.join(rrddir, FleetFile))
+    if names and (len(names) <= FleetLines or not summary):
+        graphs.append(fleetGraph(names, rrddir, pngdir, paths))
+    if summary:
+        for kind in FleetKinds:
+            graphs.append(fleetSummaryGraph(kind, rrddir, pngdir))
+    return graphs
+# ... End graphList Function ...
+
+# ===================================================================
+# [[rrd, mtime, last update], ...] for the passed RRDs. A missing file
+# is listed with None so it shows up once it appears.
+# ===================================================================
+def rrdState(rrds, daemon=None):
+    out = []
+    for rrd in rrds:
+        try:
+            mtime = os.stat(rrd).st_mtime
+            if daemon:
+                last = rrdtool.last('--daemon', daemon, rrd)
+            else:
+                last = rrdtool.last(rrd)
+        except (OSError, rrdtool.error):
+            mtime = last = None
+        out.append([rrd, mtime, last])
+    return out
+# ... End rrdState Function ...
+
+# ===================================================================
+# Remembers what each PNG was drawn from, in a JSON file:
+#   png -> [args, [[rrd, mtime, last update], ...]]
+# ===================================================================
+class GraphCache(object):
+
+    def __init__(self, path, daemon=None):
+        self.path = path
+        self.daemon = daemon
+        self.entries = {}
+        try:
+            f = open(path)
+            self.entries = json.load(f)
+            f.close()
+        except (IOError, ValueError):
+            pass    # no cache yet or a bad one, draw everything
+
+    def state(self, rrds):
+        return rrdState(rrds, self.daemon)
+
+    # True if 'png' exists and was drawn from the same args and RRD state
+    def fresh(self, png, args, state):
+        if not os.path.exists(png):
+            return False
+        return self.entries.get(png) == [args, state]
+
+    def drawn(self, png, args, state):
+        self.entries[png] = [args, state]
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'w')
+        json.dump(self.entries, f)
+        f.close()
+        os.rename(tmp, self.path)
+# ... End GraphCache Class ...
+
+# ===================================================================
+# Draw one graph. Runs in a worker process.
+# ...Returns (png, None) or (png, error string).
+# ===================================================================
+def render(job):
+    png, args, extra = job
+    try:
+        rrdtool.graph(*(args + extra + ['--watermark', time.ctime()]))
+    except rrdtool.error as e:
+        return png, str(e)
+    return png, None
+# ... End render Function ...
+
+# ===================================================================
+# Draw every graph for the passed stations whose RRDs changed since it
+# was last drawn.
+#  names  - StationList names (MARC_mppt, ...)
+#  jobs   - worker processes, default one per CPU
+#  daemon - rrdcached address the RRDs are updated through, if any
+#  force  - redraw everything
+# ...Returns (drawn, skipped, failed) counts.
+# ===================================================================
+def renderAll(names, rrddir='.', pngdir='.', jobs=None, daemon=None, force=False, paths=None):
+    cache = GraphCache(os.path.join(pngdir, CacheFile), daemon)
+    graphs = graphList(names, rrddir, pngdir, paths)
+
+    extra = []
+    if daemon:
+        extra = ['--daemon', daemon]
+    work = []
+    states = {}
+    skipped = 0
+    for png, rrds, args in graphs:
+        state = cache.state(rrds)
+        if not force and cache.fresh(png, args, state):
+            skipped += 1
+            continue
+        states[png] = (args, state)
+        work.append((png, args, extra))
+
+    failed = 0
+    if work:
+        if jobs == 1 or len(work) == 1:
+            results = map(render, work)
+        else:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(render, work)
+            finally:
+                pool.close()
+                pool.join()
+        for png, err in results:
+            if err:
+                print '%s graph error: %s' % (png, err)
+                failed += 1
+            else:
+                cache.drawn(png, *states[png])
+        cache.save()
+    return len(work) - failed, skipped, failed
+# ... End renderAll Function ...
+
+if __name__ == '__main__':
+    rrddir = pngdir = '.'
+    jobs = daemon = None
+    force = False
+    names = []
+    args = sys.argv[1:]
+    while args:
+        a = args.pop(0)
+        if a == '-d':
+            rrddir = args.pop(0)
+        elif a == '-o':
+            pngdir = args.pop(0)
+        elif a == '-j':
+            jobs = int(args.pop(0))
+        elif a == '--daemon':
+            daemon = args.pop(0)
+        elif a == '--force':
+            force = True
+        elif a.startswith('-'):
+            print 'usage: %s [-d rrddir] [-o pngdir] [-j jobs] [--daemon addr] [--force] [StationName ...]' % sys.argv[0]
+            sys.exit(1)
+        else:
+            names.append(a)
+    stations = StationRegistry(os.path.join(rrddir, StationFile))
+    stations.refresh()
+    if not names:
+        names = stations.names()
+    drawn, skipped, failed = renderAll(names, rrddir, pngdir, jobs, daemon, force, stations.rrds())
+    print '%d graphs drawn, %d unchanged, %d failed' % (drawn, skipped, failed)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Per-station link health: adaptive timeouts and a circuit breaker.
+#
+# Every socket used a hard coded 30 second timeout. A LAN radio answers
+# in 0.3 seconds, so a dead one cost 100 times its normal poll, every
+# poll. LinkHealth keeps a rolling window of each link's connect times
+# and Comm_Durations and derives that station's timeouts from them:
+#
+#   timeout = Percentile of the window * Factor + Margin
+#             clamped to [Floor, Ceiling]
+#
+# Until a link has MinSamples good polls it gets the Ceiling (the old 30).
+# A station can have its own, lower or higher, ceiling (setCeiling, from
+# the timeout / link fields of its StationList line).
+#
+# After Trip polls in a row fail the breaker opens: the station is only
+# probed every ProbeInterval seconds until a probe succeeds, so dead
+# sites stop eating poller capacity. One good sample closes it again.
+#---------------------------------------------------------------
+from array import array
+
+CLOSED = 'closed'   # normal polling
+OPEN   = 'open'     # link is down, slow probe schedule
+
+Window = 50          # samples kept per link
+MinSamples = 5       # good polls needed before timeouts adapt
+Percentile = 0.95
+Factor = 3.0         # head room over the percentile
+Margin = 1.0         # seconds added on top, covers jitter on fast links
+Floor = 2.0          # never time out faster than this
+Ceiling = 30.0       # nor slower. The old fixed timeout.
+Trip = 5             # consecutive failures that open the breaker
+ProbeInterval = 900  # seconds between probes of an open station
+
+# ===================================================================
+# Fixed size ring of the last 'size' float samples.
+# ===================================================================
+class Ring(object):
+    __slots__ = ('data', 'pos', 'full', 'cache')
+
+    def __init__(self, size):
+        self.data = array('d', [0.0] * size)
+        self.pos = 0
+        self.full = False
+        self.cache = None    # percentile cache, cleared on add
+
+    def add(self, v):
+        self.data[self.pos] = v
+        self.pos += 1
+        if self.pos == len(self.data):
+            self.pos = 0
+            self.full = True
+        self.cache = None
+
+    def __len__(self):
+        return len(self.data) if self.full else self.pos
+
+    def percentile(self, p):
+        if self.cache is None or self.cache[0] != p:
+            n = len(self)
+            vals = sorted(self.data[:n])
+            self.cache = (p, vals[min(n - 1, int(p * n))])
+        return self.cache[1]
+# ... End Ring Class ...
+
+class StationHealth(object):
+    __slots__ = ('connect', 'comm', 'fails', 'state', 'ceiling')
+
+    def __init__(self):
+        self.connect = Ring(Window)   # seconds to connect
+        self.comm = Ring(Window)      # Comm_Duration, request to frame
+        self.fails = 0                # failures in a row
+        self.state = CLOSED
+        self.ceiling = None           # None for LinkHealth.ceiling
+# ... End StationHealth Class ...
+
+class LinkHealth(object):
+
+    # ===================================================================
+    #  ceiling - longest timeout handed out, and the one used until a
+    #            link has MinSamples good polls
+    #  probe   - seconds between polls of a station with an open breaker
+    #  trip    - failed polls in a row that open the breaker
+    # ===================================================================
+    def __init__(self, ceiling=Ceiling, probe=ProbeInterval, trip=Trip):
+        self.ceiling = ceiling
+        self.probe = probe
+        self.trip = trip
+        self.stns = {}    # StationName -> StationHealth
+
+    def _get(self, StationName):
+        sh = self.stns.get(StationName)
+        if sh is None:
+            sh = self.stns[StationName] = StationHealth()
+        return sh
+
+    # ===================================================================
+    # (connect timeout, read timeout) in seconds for the station.
+    # ===================================================================
+    def timeouts(self, StationName):
+        sh = self._get(StationName)
+        ceiling = sh.ceiling if sh.ceiling is not None else self.ceiling
+        return self._timeout(sh.connect, ceiling), self._timeout(sh.comm, ceiling)
+
+    def _timeout(self, ring, ceiling):
+        if len(ring) < MinSamples:
+            return ceiling
+        t = ring.percentile(Percentile) * Factor + Margin
+        return min(ceiling, max(Floor, t))
+
+    # ===================================================================
+    # Longest timeout for one station, None to go back to the default.
+    # ===================================================================
+    def setCeiling(self, StationName, seconds):
+        self._get(StationName).ceiling = seconds
+
+    # ===================================================================
+    # The poller connected to the station in 'seconds'.
+    # ===================================================================
+    def connected(self, StationName, seconds):
+        self._get(StationName).connect.add(seconds)
+
+    # ===================================================================
+    # A poll finished. 'ok' True with the Comm_Duration for a good sample.
+    # ...Returns True if this poll opened or closed the breaker.
+    # ===================================================================
+    def record(self, StationName, ok, duration=None):
+        sh = self._get(StationName)
+        if ok:
+            if duration is not None:
+                sh.comm.add(duration)
+            sh.fails = 0
+            if sh.state == OPEN:
+                sh.state = CLOSED
+                print 'Station %s link recovered, back on normal polling' % (StationName)
+                return True
+            return False
+        sh.fails += 1
+        if sh.state == CLOSED and sh.fails >= self.trip:
+            sh.state = OPEN
+            print 'Station %s failed %d polls in a row, probing every %d seconds' % (StationName, sh.fails, self.probe)
+            return True
+        return False
+
+    # ===================================================================
+    # Interval override for the scheduler: ProbeInterval while the
+    # breaker is open, None (the station's normal interval) otherwise.
+    # ===================================================================
+    def interval(self, StationName):
+        sh = self.stns.get(StationName)
+        if sh is not None and sh.state == OPEN:
+            return self.probe
+        return None
+
+    def state(self, StationName):
+        return self._get(StationName).state
+
+    # ===================================================================
+    # Fill a station's Comm_Duration window from history, e.g. the
+    # Comm_Duration DS of its RRD, so timeouts adapt from the first poll.
+    # NaN / None (unknown) values are skipped.
+    # ===================================================================
+    def seed(self, StationName, durations):
+        ring = self._get(StationName).comm
+        for d in durations:
+            if d is not None and d == d:
+                ring.add(d)
+
+    def forget(self, StationName):
+        self.stns.pop(StationName, None)
+# ... End LinkHealth Class ...
+
+# ===================================================================
+# Last 'count' Comm_Duration values from a station's RRD, for seed().
+# ...Returns [] if the RRD can't be read.
+# ===================================================================
+def rrdDurations(rrdfile, count=Window, step=60):
+    import rrdtool
+    try:
+        (start, end, res), names, rows = rrdtool.fetch(rrdfile, 'AVERAGE', '--start', '-%d' % (count * step * 2))
+    except rrdtool.error:
+        return []
+    if 'Comm_Duration' not in names:
+        return []
+    i = list(names).index('Comm_Duration')
+    vals = [row[i] for row in rows if row[i] is not None]
+    return vals[-count:]
+# ... End rrdDurations Function ...
@@ -0,0 +1,296 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Latest samples, kept in memory by the poller and served locally.
+#
+# A station's current values used to mean tailing the log or waiting for
+# the next graph, and a tool polling the station itself competes with
+# Insert8.3.py on a slow cell link. LiveCache keeps each station's last
+# RingSize samples (a ring of arrays, not Records: the raw registers,
+# capture time and Comm_Duration) and Insert8.3.py serves them on a Unix
+# stream socket (LiveSocket). Nothing touches the network.
+#
+# One request line per connection, the reply is a JSON object per line
+# then the socket is closed:
+#
+#   stations                    {"station", "time" (last), "samples"}
+#   latest [StationName ...]    each station's last sample (all stations)
+#   last N [StationName ...]    the samples of the last N minutes
+#
+# A sample is {"station", "time", "Comm_Duration", "values": {register:
+# scaled value}, "states": {register: text}, "bits": {register: [set
+# bit names]}}, decoded (StatusPlan) when asked for. A bad request gets
+# {"error": ...}.
+#
+#   python live.py [-s socket ...] [--json] stations | latest [StationName ...] | last N [StationName ...]
+#
+# -s more than once asks each socket (supervisor.py shards each have
+# their own, live-shard<i>.sock) and merges the replies.
+#---------------------------------------------------------------
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from array import array
+
+import SocketServer
+
+from mppt import StatusPlan
+
+RingSize = 180       # samples kept per station (3 hours at 60 s)
+Socket = 'live.sock'
+Timeout = 5          # seconds a client may take to send its request
+MaxRequest = 4096
+
+class SampleRing(object):
+    __slots__ = ('size', 'nreg', 'n', 'head', 'stamps', 'durations', 'raw')
+
+    def __init__(self, size, nreg):
+        self.size = size
+        self.nreg = nreg
+        self.n = 0           # samples held
+        self.head = 0        # slot the next one goes in
+        self.stamps = array('d', [0.0]) * size
+        self.durations = array('d', [0.0]) * size
+        self.raw = array('l', [0]) * (size * nreg)
+
+    def add(self, stamp, duration, raw):
+        i = self.head
+        self.stamps[i] = stamp
+        self.durations[i] = duration
+        self.raw[i * self.nreg:(i + 1) * self.nreg] = raw
+        self.head = (i + 1) % self.size
+        if self.n < self.size:
+            self.n += 1
+
+    # ===================================================================
+    # Samples with stamp >= t0 (all of them for None), oldest first.
+    # ...Returns [(stamp, duration, raw array), ...], copies.
+    # ===================================================================
+    def since(self, t0=None):
+        out = []
+        i = self.head
+        for k in range(self.n):
+            i = (i - 1) % self.size
+            if t0 is not None and self.stamps[i] < t0:
+                break
+            out.append((self.stamps[i], self.durations[i], self.raw[i * self.nreg:(i + 1) * self.nreg]))
+        out.reverse()
+        return out
+
+    def latest(self):
+        if not self.n:
+            return None
+        i = (self.head - 1) % self.size
+        return self.stamps[i], self.durations[i], self.raw[i * self.nreg:(i + 1) * self.nreg]
+# ... End SampleRing Class ...
+
+class LiveCache(object):
+
+    # ===================================================================
+    # A storage backend (storage.py): Insert8.3.py hands it every sample
+    # with the others. The socket server reads it from its own threads.
+    #  size - samples kept per station
+    # ===================================================================
+    def __init__(self, size=RingSize, plan=StatusPlan):
+        self.size = size
+        self.plan = plan
+        self.rings = {}      # StationName -> SampleRing
+        self.lock = threading.Lock()
+
+    def setStations(self, names):
+        with self.lock:
+            for name in self.rings.keys():
+                if name not in names:
+                    del self.rings[name]
+
+    def add(self, rec):
+        with self.lock:
+            ring = self.rings.get(rec.station)
+            if ring is None:
+                ring = self.rings[rec.station] = SampleRing(self.size, self.plan.n)
+            ring.add(rec.stamp, rec.duration, rec.raw)
+
+    def flushDue(self, now=None):
+        pass
+
+    def flush(self):
+        pass
+
+    # StationNames asked for that are held, all of them for none
+    def _names(self, names):
+        if not names:
+            return sorted(self.rings)
+        return [name for name in names if name in self.rings]
+
+    # ===================================================================
+    # [(StationName, last stamp, samples held), ...]
+    # ===================================================================
+    def stations(self):
+        with self.lock:
+            return [(name, self.rings[name].latest()[0], self.rings[name].n) for name in sorted(self.rings)]
+
+    # ===================================================================
+    # Each station's last sample as a Record.
+    # ===================================================================
+    def latest(self, names=None):
+        with self.lock:
+            held = [(name, self.rings[name].latest()) for name in self._names(names)]
+        return [self._record(name, sample) for name, sample in held if sample is not None]
+
+    # ===================================================================
+    # The samples since t0 as Records, station by station, oldest first.
+    # ===================================================================
+    def since(self, t0, names=None):
+        with self.lock:
+            held = [(name, self.rings[name].since(t0)) for name in self._names(names)]
+        return [self._record(name, sample) for name, samples in held for sample in samples]
+
+    def _record(self, StationName, sample):
+        stamp, duration, raw = sample
+        return self.plan.decodeFields(raw, StationName, stamp, duration)
+# ... End LiveCache Class ...
+
+# ===================================================================
+# A Record as the JSON object the socket sends.
+# ===================================================================
+def sampleJSON(rec):
+    plan = rec.plan
+    return json.dumps({'station': rec.station, 'time': round(rec.stamp, 3),
+                       'Comm_Duration': round(rec.duration, 3),
+                       'values': dict(zip(plan.names, rec.value)),
+                       'states': dict((plan.names[i], rec.state[k]) for k, (i, lst) in enumerate(plan.states)),
+                       'bits': dict((plan.names[f[0]], list(rec.bits[k])) for k, f in enumerate(plan.bitfields))},
+                      sort_keys=True)
+# ... End sampleJSON Function ...
+
+# ===================================================================
+# Answer one request line.
+# ...Returns the reply lines.
+# ===================================================================
+def answer(cache, line, now=None):
+    words = line.split()
+    if not words:
+        return [json.dumps({'error': 'empty request'})]
+    cmd, args = words[0], words[1:]
+    if cmd == 'stations':
+        return [json.dumps({'station': name, 'time': round(stamp, 3), 'samples': n})
+                for name, stamp, n in cache.stations()]
+    if cmd == 'latest':
+        return map(sampleJSON, cache.latest(args))
+    if cmd == 'last' and args:
+        try:
+            minutes = float(args[0])
+        except ValueError:
+            return [json.dumps({'error': 'last N: N is minutes, not %r' % args[0]})]
+        if now is None:
+            now = time.time()
+        return map(sampleJSON, cache.since(now - minutes * 60, args[1:]))
+    return [json.dumps({'error': 'unknown request %r, try stations, latest or last N' % line.strip()[:80]})]
+# ... End answer Function ...
+
+class Handler(SocketServer.StreamRequestHandler):
+    cache = None    # set by serve()
+    timeout = Timeout
+
+    def handle(self):
+        try:
+            line = self.rfile.readline(MaxRequest)
+        except socket.timeout:
+            return
+        self.wfile.write(''.join([reply + '\n' for reply in answer(self.cache, line)]))
+# ... End Handler Class ...
+
+class Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+# ===================================================================
+# Serve 'cache' on the Unix socket 'path' from a background thread. A
+# socket file left by a run that is gone is replaced.
+# ...Returns the server. Raises socket.error if another process is
+# ...serving on 'path'.
+# ===================================================================
+def serve(cache, path=Socket):
+    if os.path.exists(path):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(path)
+        except socket.error:
+            os.remove(path)     # stale
+        else:
+            raise socket.error('%s is in use' % path)
+        finally:
+            s.close()
+    Handler.cache = cache
+    server = Server(path, Handler)
+    t = threading.Thread(target=server.serve_forever, name='live')
+    t.daemon = True
+    t.start()
+    return server
+# ... End serve Function ...
+
+# ===================================================================
+# Client side: send one request to each socket in 'paths'.
+# ...Returns the reply objects. Raises socket.error if a socket can't
+# ...be reached.
+# ===================================================================
+def query(paths, request, timeout=Timeout):
+    if isinstance(paths, basestring):
+        paths = [paths]
+    out = []
+    for path in paths:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(timeout)
+        try:
+            s.connect(path)
+            s.sendall(request + '\n')
+            f = s.makefile('rb')
+            for line in f:
+                out.append(json.loads(line))
+            f.close()
+        finally:
+            s.close()
+    return out
+# ... End query Function ...
+
+# a sample as a line like the CSV log's
+def _line(d):
+    v = d['values']
+    vb = v['Adc_vb_f']
+    lvd = v['V_lvd']
+    return '%s %s %-12s VBatt %6.2f Vlvd %6.2f Vdiff %6.2f %-12s Comm_Duration %.3f' % (
+        d['station'], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(d['time'])),
+        d['states'].get('Load_State'), vb, lvd, vb - lvd, d['states'].get('Charge_State'), d['Comm_Duration'])
+
+if __name__ == '__main__':
+    paths = []
+    raw = False
+    args = sys.argv[1:]
+    usage = 'usage: %s [-s socket ...] [--json] stations | latest [StationName ...] | last N [StationName ...]' % sys.argv[0]
+    while args and args[0].startswith('-'):
+        a = args.pop(0)
+        if a == '-s' and args:
+            paths.append(args.pop(0))
+        elif a == '--json':
+            raw = True
+        else:
+            args = []
+    if not args or args[0] not in ('stations', 'latest', 'last') or (args[0] == 'last' and len(args) < 2):
+        print usage
+        sys.exit(1)
+    try:
+        replies = query(paths or [Socket], ' '.join(args))
+    except socket.error as e:
+        print 'live socket %s: %s (is Insert8.3.py running with LiveSocket set?)' % (' '.join(paths or [Socket]), e)
+        sys.exit(1)
+    for d in replies:
+        if raw:
+            print json.dumps(d, sort_keys=True)
+        elif 'error' in d:
+            print d['error']
+        elif args[0] == 'stations':
+            print '%-16s %s %4d samples' % (d['station'], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(d['time'])),
+                                            d['samples'])
+        else:
+            print _line(d)
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Buffered, rotating log writer.
+#
+# The log used to be sys.stdout opened on Insert8.3.log, each sample
+# written by several prints (a trailing comma holding the line open),
+# and the file grew forever.
+#
+# LogSink takes whole lines and hands them to a background thread
+# which does all the file work, so a slow or full disk never holds up
+# polling:
+#  - writes go through a buffer, flushed every FlushSecs (or flush())
+#  - the file is rotated when it passes MaxBytes or is RotateSecs old,
+#    to Insert8.3.log.YYYYmmdd-HHMMSS, gzip'ed if Compress, keeping the
+#    newest Keep of them
+#  - 'csv' writes the familiar CSV line per sample, 'jsonl' one JSON
+#    object per line (other messages become {"time":..,"msg":..})
+#  - with a delta.DeltaEncoder only a station's key samples (the first,
+#    and one an hour) get the whole line. The others give the register
+#    transitions and how far VBatt / Vlvd moved since the last line:
+#      MARC_mppt,7/24/2016,17:44:11, Charge_State,FLOAT>BULK_CHARGE, VBatt,+0.02,V, Comm_Duration, 0.317, seconds,
+#    A key line carries the transitions since the line before at its end.
+#
+# LogSink is also file like (write/flush), so sys.stdout can point at it
+# and the error prints land in the same file, whole lines at a time.
+# If the thread falls QueueMax lines behind new lines are dropped and
+# counted rather than blocking, as are lines lost to a write error (the
+# file is reopened for the next line).
+#---------------------------------------------------------------
+import atexit
+import glob
+import gzip
+import json
+import os
+import Queue
+import shutil
+import sys
+import threading
+import time
+
+from mppt import StatusPlan, formatRecord
+
+FlushSecs = 5
+MaxBytes = 10 * 1024 * 1024
+RotateSecs = 86400
+Keep = 14
+Compress = True
+QueueMax = 100000
+
+_FLUSH = object()   # queue markers
+_STOP = object()
+
+# ===================================================================
+# One sample as a CSV line, the layout of the old prints:
+#   MARC_mppt,7/24/2016,17:43:11, LoadState,LOAD_ON, ..., Comm_Duration, 0.317, seconds,
+# ===================================================================
+def csvLine(rec):
+    return '%s Comm_Duration, %.3f, seconds,' % (formatRecord(rec), rec.duration)
+# ... End csvLine Function ...
+
+# ===================================================================
+# One sample as a JSON object, the same fields as csvLine.
+# ===================================================================
+def jsonFields(rec):
+    vb = rec.get('Adc_vb_f')
+    lvd = rec.get('V_lvd')
+    return {'station': rec.station, 'time': round(rec.stamp, 3),
+            'LoadState': rec.text('Load_State'), 'VBatt': round(vb, 2),
+            'Vlvd': round(lvd, 2), 'Vdiff': round(vb - lvd, 2),
+            'ChargeState': rec.text('Charge_State'),
+            'Comm_Duration': round(rec.duration, 3)}
+
+def jsonLine(rec):
+    return json.dumps(jsonFields(rec), sort_keys=True)
+# ... End jsonLine Function ...
+
+# the analog values in a delta line: (label, register)
+DeltaFields = [('VBatt', 'Adc_vb_f'), ('Vlvd', 'V_lvd')]
+
+# a value as logged (2 decimals) in hundredths, so the steps between
+# lines add up to the logged values exactly
+def _cents(v):
+    return int(round(float('%.2f' % v) * 100))
+
+# (label, step in hundredths, units) of the DeltaFields that moved
+def _steps(rec, prev):
+    out = []
+    for label, name in DeltaFields:
+        d = _cents(rec.get(name)) - _cents(prev.get(name))
+        if d:
+            out.append((label, d, StatusPlan.units[StatusPlan.index[name]]))
+    return out
+
+# ===================================================================
+# One sample against the station's previous one (DeltaEncoder.step),
+# CSV. 'prev' None for a key sample, the whole csvLine.
+# ===================================================================
+def csvDelta(rec, prev, changes):
+    text = ''.join([' %s,%s,' % (c.name, c.text) for c in changes])
+    if prev is None:
+        return csvLine(rec) + text
+    lt = time.localtime(rec.stamp)
+    out = ['%s,%d/%d/%d,%02d:%02d:%02d,%s' % (rec.station, lt.tm_mon, lt.tm_mday, lt.tm_year,
+                                              lt.tm_hour, lt.tm_min, lt.tm_sec, text)]
+    for label, d, units in _steps(rec, prev):
+        out.append('%s,%+.2f,%s,' % (label, d / 100.0, units))
+    out.append('Comm_Duration, %.3f, seconds,' % rec.duration)
+    return ' '.join(out)
+# ... End csvDelta Function ...
+
+# ===================================================================
+# The same as JSON: a key sample is the jsonLine object, the others
+# {"station", "time", "Comm_Duration", "delta": {label: step}}, both
+# with "changes": {register: text} when there were any.
+# ===================================================================
+def jsonDelta(rec, prev, changes):
+    if prev is None:
+        d = jsonFields(rec)
+    else:
+        d = {'station': rec.station, 'time': round(rec.stamp, 3),
+             'Comm_Duration': round(rec.duration, 3),
+             'delta': dict((label, step / 100.0) for label, step, units in _steps(rec, prev))}
+    if changes:
+        d['changes'] = dict((c.name, c.text) for c in changes)
+    return json.dumps(d, sort_keys=True)
+# ... End jsonDelta Function ...
+
+class LogSink(object):
+
+    # ===================================================================
+    #  path   - the log file
+    #  fmt    - 'csv' or 'jsonl'
+    #  delta  - delta.DeltaEncoder for change-only lines, None for a
+    #           whole line every sample
+    #  others - see the defaults at the top of this file
+    # ===================================================================
+    def __init__(self, path, fmt='csv', maxbytes=MaxBytes, rotatesecs=RotateSecs,
+                 keep=Keep, compress=Compress, flushsecs=FlushSecs, delta=None):
+        if fmt not in ('csv', 'jsonl'):
+            raise ValueError('log format %r, not csv or jsonl' % fmt)
+        self.path = path
+        self.fmt = fmt
+        self.maxbytes = maxbytes
+        self.rotatesecs = rotatesecs
+        self.keep = keep
+        self.compress = compress
+        self.flushsecs = flushsecs
+        self.format = csvLine if fmt == 'csv' else jsonLine
+        self.delta = delta
+        self.deltaFormat = csvDelta if fmt == 'csv' else jsonDelta
+        self.q = Queue.Queue(QueueMax)
+        self.dropped = 0
+        self.partial = ''       # text written so far without a newline (caller side)
+        self.softspace = 0      # for the print statement
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name='logsink')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    # ===================================================================
+    # Log one decoded sample (decoder.Record, duration filled in).
+    # ===================================================================
+    def record(self, rec):
+        if self.delta is None:
+            self._put(self.format(rec))
+        else:
+            prev, changes = self.delta.step(rec)
+            self._put(self.deltaFormat(rec, prev, changes))
+
+    # ===================================================================
+    # File interface, for sys.stdout. Text is passed on a line at a time.
+    # ===================================================================
+    def write(self, text):
+        with self.lock:
+            text = self.partial + text
+            lines = text.split('\n')
+            self.partial = lines.pop()
+        for line in lines:
+            if self.fmt == 'jsonl':
+                line = json.dumps({'time': round(time.time(), 3), 'msg': line})
+            self._put(line)
+
+    # ask the thread to flush now, doesn't wait for it
+    def flush(self):
+        try:
+            self.q.put_nowait(_FLUSH)
+        except Queue.Full:
+            pass
+
+    # ===================================================================
+    # Write out everything queued and stop the thread.
+    # ===================================================================
+    def close(self):
+        if self.thread.is_alive():
+            if self.partial:
+                self.write('\n')
+            self.q.put(_STOP)
+            self.thread.join()
+
+    def _put(self, line):
+        try:
+            self.q.put_nowait(line)
+        except Queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    # ===================================================================
+    # ------------------- background thread ------------------------------
+    # ===================================================================
+    def _run(self):
+        f = None
+        failing = None      # last error reported, not repeated for every line
+        lastflush = time.time()
+        while True:
+            try:
+                item = self.q.get(True, self.flushsecs)
+            except Queue.Empty:
+                item = _FLUSH
+            try:
+                if item is _STOP or item is _FLUSH:
+                    if f is not None:
+                        f.flush()
+                    lastflush = time.time()
+                    if item is _STOP:
+                        break
+                    continue
+                if f is None:
+                    f, opened, size = self._open()
+                with self.lock:
+                    n, self.dropped = self.dropped, 0
+                if n:
+                    line = '%s%s' % (self._note('log sink behind or failing, %d lines dropped' % n), '\n')
+                    f.write(line)
+                    size += len(line)
+                f.write(item + '\n')
+                size += len(item) + 1
+                failing = None
+                now = time.time()
+                if size >= self.maxbytes or now - opened >= self.rotatesecs:
+                    f.close()
+                    f = None
+                    self._rotate()
+                    f, opened, size = self._open()
+                elif now - lastflush >= self.flushsecs:
+                    f.flush()
+                    lastflush = now
+            except (IOError, OSError) as e:
+                # sys.stdout may be this sink, report on stderr. The log is
+                # reopened for the next line, what was buffered is lost.
+                if str(e) != failing:
+                    failing = str(e)
+                    sys.stderr.write('log sink %s error: %s\n' % (self.path, e))
+                if item is not _STOP and item is not _FLUSH:
+                    with self.lock:
+                        self.dropped += 1
+                if f is not None:
+                    try:
+                        f.close()
+                    except (IOError, OSError):
+                        pass
+                    f = None
+                if item is _STOP:
+                    break
+        if f is not None:
+            try:
+                f.close()
+            except (IOError, OSError) as e:
+                sys.stderr.write('log sink %s error: %s\n' % (self.path, e))
+
+    def _note(self, msg):
+        if self.fmt == 'jsonl':
+            return json.dumps({'time': round(time.time(), 3), 'msg': msg})
+        return msg
+
+    # open the log for appending. (file, time it was started, size)
+    def _open(self):
+        f = open(self.path, 'a', 65536)
+        f.seek(0, 2)
+        size = f.tell()
+        try:
+            opened = os.stat(self.path + '.started').st_mtime
+        except OSError:
+            opened = time.time()
+            open(self.path + '.started', 'w').close()
+        return f, opened, size
+
+    # move the log aside, compress it, drop the oldest ones
+    def _rotate(self):
+        old = base = self.path + time.strftime('.%Y%m%d-%H%M%S')
+        n = 0
+        while os.path.exists(old) or os.path.exists(old + '.gz'):
+            n += 1
+            old = '%s-%d' % (base, n)
+        try:
+            os.rename(self.path, old)
+            os.remove(self.path + '.started')
+            if self.compress:
+                src = open(old, 'rb')
+                dst = gzip.open(old + '.gz', 'wb')
+                shutil.copyfileobj(src, dst)
+                dst.close()
+                src.close()
+                os.remove(old)
+            rotated = sorted(glob.glob(self.path + '.[0-9]*'), key=os.path.getmtime)
+            for p in rotated[:len(rotated) - self.keep]:
+                os.remove(p)
+        except (IOError, OSError) as e:
+            # keep logging, the next rotation will try again
+            f = open(self.path, 'a')
+            f.write(self._note('log rotate error: %s' % e) + '\n')
+            f.close()
+# ... End LogSink Class ...
@@ -0,0 +1,168 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Per-phase latency histograms and error counters, served as
+# Prometheus text.
+#
+# Comm_Duration is only the request to frame time. A poll is timed in
+# phases, each kept as a histogram per station:
+#
+#   resolve  - host name lookup
+#   connect  - TCP connect
+#   request  - sending 'R\r'
+#   receive  - 'R\r' sent to the whole status frame in
+#   release  - sending 'T\r' (back to Timed mode)
+#   checksum - checking the frame's checksum
+#   decode   - decoding the registers into a Record
+#   store    - the rrdtool.update call (per batch of samples)
+#   log      - formatting and queueing the log line
+#   alert    - running the alert rules (alerts.py) and sending
+#
+# plus counters per station: polls, poll_failures, checksum_mismatches,
+# timeouts, connection_errors, receive_errors, bad_frames, alerts.
+#
+# serve() answers GET /metrics on a local port from a background thread:
+#   mcsoh_phase_seconds_bucket{phase="connect",station="LCCR_mppt",le="5"} 12
+#   mcsoh_timeouts_total{station="LCCR_mppt"} 3
+#---------------------------------------------------------------
+import bisect
+import threading
+import time
+
+import BaseHTTPServer
+import SocketServer
+
+Phases = ['resolve', 'connect', 'request', 'receive', 'release',
+          'checksum', 'decode', 'store', 'log', 'alert']
+
+# counter name -> help text
+Counters = [
+    ('polls', 'Polls that returned a good sample'),
+    ('poll_failures', 'Polls that did not'),
+    ('checksum_mismatches', 'Status frames with a bad checksum'),
+    ('timeouts', 'Connects or requests that timed out'),
+    ('connection_errors', 'Connects that failed'),
+    ('receive_errors', 'Send / receive errors on a connected socket'),
+    ('bad_frames', 'Frames that did not decode'),
+    ('alerts', 'Alerts sent (alerts.py)'),
+]
+
+# upper bounds, seconds. From the checksum (microseconds) to a slow
+# cell link (SockTimeout)
+Buckets = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+Prefix = 'mcsoh_'
+Port = 9108
+
+class Histogram(object):
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(Buckets) + 1)    # last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, secs):
+        self.counts[bisect.bisect_left(Buckets, secs)] += 1
+        self.sum += secs
+# ... End Histogram Class ...
+
+class Metrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hists = {}      # (phase, StationName) -> Histogram
+        self.counts = {}     # (counter, StationName) -> int
+        self.started = time.time()
+
+    # ===================================================================
+    # Record 'secs' spent in 'phase' for a station.
+    # ===================================================================
+    def observe(self, phase, StationName, secs):
+        with self.lock:
+            h = self.hists.get((phase, StationName))
+            if h is None:
+                h = self.hists[(phase, StationName)] = Histogram()
+            h.observe(secs)
+
+    # ===================================================================
+    # Add 'n' to a station's counter.
+    # ===================================================================
+    def count(self, counter, StationName, n=1):
+        key = (counter, StationName)
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    # ===================================================================
+    # Everything in the Prometheus text format (version 0.0.4).
+    # ===================================================================
+    def render(self):
+        with self.lock:
+            hists = [(k, list(h.counts), h.sum) for k, h in self.hists.items()]
+            counts = self.counts.items()
+        out = ['# HELP %sphase_seconds Time spent in each phase of a poll' % Prefix,
+               '# TYPE %sphase_seconds histogram' % Prefix]
+        order = dict((p, i) for i, p in enumerate(Phases))
+        hists.sort(key=lambda item: (order.get(item[0][0], len(order)), item[0]))
+        for (phase, name), hc, total in hists:
+            labels = 'phase="%s",station="%s"' % (phase, _escape(name))
+            n = 0
+            for le, c in zip(Buckets, hc):
+                n += c
+                out.append('%sphase_seconds_bucket{%s,le="%g"} %d' % (Prefix, labels, le, n))
+            n += hc[-1]
+            out.append('%sphase_seconds_bucket{%s,le="+Inf"} %d' % (Prefix, labels, n))
+            out.append('%sphase_seconds_sum{%s} %.6f' % (Prefix, labels, total))
+            out.append('%sphase_seconds_count{%s} %d' % (Prefix, labels, n))
+        bycounter = {}
+        for (counter, name), n in counts:
+            bycounter.setdefault(counter, []).append((name, n))
+        for counter, text in Counters:
+            out.append('# HELP %s%s_total %s' % (Prefix, counter, text))
+            out.append('# TYPE %s%s_total counter' % (Prefix, counter))
+            for name, n in sorted(bycounter.get(counter, [])):
+                out.append('%s%s_total{station="%s"} %d' % (Prefix, counter, _escape(name), n))
+        out.append('# TYPE %sstart_time_seconds gauge' % Prefix)
+        out.append('%sstart_time_seconds %.0f' % (Prefix, self.started))
+        return '\n'.join(out) + '\n'
+# ... End Metrics Class ...
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    metrics = None    # set by serve()
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self._send(404, 'no such page\n')
+            return
+        self._send(200, self.metrics.render())
+
+    def _send(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # requests are not worth a log line each
+    def log_message(self, format, *args):
+        pass
+# ... End Handler Class ...
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+# ===================================================================
+# Serve 'metrics' on host:port from a background thread.
+# ...Returns the server. Raises socket.error if the port is taken.
+# ===================================================================
+def serve(metrics, port=Port, host='127.0.0.1'):
+    Handler.metrics = metrics
+    httpd = Server((host, port), Handler)
+    t = threading.Thread(target=httpd.serve_forever, name='metrics')
+    t.daemon = True
+    t.start()
+    return httpd
+# ... End serve Function ...
@@ -0,0 +1,441 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Morningstar SunSaver MPPT register tables and status record handling.
+# Shared by Insert8.3.py and the concurrent poller (poller.py) so the
+# checksum and decode logic lives in one place.
+# See the header of Insert8.3.py for the full description of the
+# translator protocol and the register layout.
+#---------------------------------------------------------------
+vfactor = 100.0/32768   # Volts
+vrfactor = 99.667/32768 # Volts
+ifactor = 79.16/32768   # Amps
+ahfactor = 0.1          # Amp Hours (basically div by 10)
+pofactor = 989.5/65536  # Watts
+ohmfactor = 1.263/32768 # Ohms
+perfactor = 100/256     # percent
+
+nameOffset   = 0  # Offset in List for variable's name string
+scalerOffset = 1  # Offset in List for scaler factor value
+unitsOffset  = 2  # Offset in List for units of scale factor
+
+StnName = 0       # Offset in Station info List for name string
+StnIP = 1         # Offset in Station info List for IP address
+StnPort = 2       # Offset in Station info List for Port Number
+
+# Charge State Values... see RRD charts for example/explanations...
+PChrgState = ["START",
+              "NIGHT_CHECK",
+  	      "DISCONNECT",
+ 	      "NIGHT",
+	      "FAULT",
+	      "BULK_CHARGE",
+	      "ABSORPTION",
+	      "FLOAT",
+	      "EQUALIZE"]
+
+# Charge State with load
+PLoadState = ["START",
+              "LOAD_ON",
+ 	      "LVD_WARNING",
+	      "LVD",
+              "FAULT",
+  	      "DISCONNECT"]
+
+# LED State Values
+PLedState = ["LED_START",
+             "LED_START2",
+             "LED_BRANCH",
+             "EQUALIZE (FAST GREEN BLINK)",
+             "FLOAT (SLOW GREEN BLINK)",
+             "ABSORPTION (GREEN BLINK, 1HZ)",
+             "GREEN_LED",
+             "UNDEFINED",
+             "YELLOW_LED",
+             "UNDEFINED",
+             "BLINK_RED_LED",
+             "RED_LED",
+             "R-Y-G ERROR",
+             "R/Y-G ERROR",
+             "R/G-Y ERROR",
+             "R-Y ERROR (HTD)",
+             "R-G ERROR (HVD)",
+             "R/Y-G/Y ERROR",
+             "G/Y/R ERROR",
+             "G/Y/R x 2"]
+
+# Array Fault identified by Self-Diagnostics (bit field)
+#                      Name       bit=0      bit=1
+PArryFault = [["Overcurrent ", "No Fault", "Fault"],
+              ["FETs shorted", "No Fault", "Fault"],
+              ["Software bug", "No Fault", "Fault"],
+              ["Battery HVD ", "No Fault", "Fault"],
+              ["Array HVD   ", "No Fault", "Fault"],
+              ["EEPROM setting reset required ", "No Fault", "Fault"],
+              ["RTS shorted ", "No Fault", "Fault"],
+              ["RTS was valid now disconnected", "No Fault", "Fault"],
+              ["Local temp. sensor failed     ", "No Fault", "Fault"],
+              ["Fault 10    ", "No Fault", "Fault"],
+              ["Fault 11    ", "No Fault", "Fault"],
+              ["Fault 12    ", "No Fault", "Fault"],
+              ["Fault 13    ", "No Fault", "Fault"],
+              ["Fault 14    ", "No Fault", "Fault"],
+              ["Fault 15    ", "No Fault", "Fault"],
+              ["Fault 16    ", "No Fault", "Fault"]]
+
+# Load Fault identified by self diagnostics (bit field)
+#                      Name                 bit=0      bit=1
+PLoadFault = [["External Short Circuit   ", "No Fault", "Fault"],
+              ["Overcurrent              ", "No Fault", "Fault"],
+              ["FETs shorted             ", "No Fault", "Fault"],
+              ["Software bug             ", "No Fault", "Fault"],
+              ["HVD                      ", "No Fault", "Fault"],
+              ["Heatsink over-temperature", "No Fault", "Fault"],
+              ["EEPROM setting reset required ", "No Fault", "Fault"],
+              ["Fault 8                  ", "No Fault", "Fault"]]
+
+# Alarms (24 bit field, Alarm_HI << 16 | Alarm_LO)
+PAlarm = [["RTS open            ", "No Alarm", "Alarm"],
+          ["RTS shorted         ", "No Alarm", "Alarm"],
+          ["RTS disconnected    ", "No Alarm", "Alarm"],
+          ["Heatsink temp sensor open   ", "No Alarm", "Alarm"],
+          ["Heatsink temp sensor shorted", "No Alarm", "Alarm"],
+          ["SSMPPT hot          ", "No Alarm", "Alarm"],
+          ["Current limit       ", "No Alarm", "Alarm"],
+          ["Current offset      ", "No Alarm", "Alarm"],
+          ["Uncalibrated        ", "No Alarm", "Alarm"],
+          ["RTS miswire         ", "No Alarm", "Alarm"],
+          ["HVD                 ", "No Alarm", "Alarm"],
+          ["High d              ", "No Alarm", "Alarm"],
+          ["Miswire             ", "No Alarm", "Alarm"],
+          ["FET open            ", "No Alarm", "Alarm"],
+          ["P12                 ", "No Alarm", "Alarm"],
+          ["Load disconnect     ", "No Alarm", "Alarm"],
+          ["Alarm 17            ", "No Alarm", "Alarm"],
+          ["Alarm 18            ", "No Alarm", "Alarm"],
+          ["Alarm 19            ", "No Alarm", "Alarm"],
+          ["Alarm 20            ", "No Alarm", "Alarm"],
+          ["Alarm 21            ", "No Alarm", "Alarm"],
+          ["Alarm 22            ", "No Alarm", "Alarm"],
+          ["Alarm 23            ", "No Alarm", "Alarm"],
+          ["Alarm 24            ", "No Alarm", "Alarm"]]
+
+# Dip Switch settings (bit field)
+# ... 4 position dip switch. 
+# ... PDipSwitch[0][0] - Switch 1 Name string
+# ... PDipSwitch[0][1] - Switch 1, '0' (off) value string
+# ... PDipSwitch[0][0] - Switch 1, '1' (on) value string
+# ... PDipSwitch[1][0] - Switch 2 Name string
+# ... PDipSwitch[1][1] - Switch 2, '0' (off) value string
+# ... PDipSwitch[1][0] - Switch 2, '1' (on) value string
+dSwON = 2  # offset for switch ON state message
+dSwOFF = 1 # offset for switch OFF state message
+dSwNAM = 0 # offset for switch name
+#                dSwNAM               dSWOFF                 dSwON
+PDipSwitch = [["Battery Type", "User Select Jumper", "Custom Battery Settings"],
+              ["LVD / LVR   ", "11.5V / 12.6V", "Custom Load Settings"],
+              ["Equalize    ", "Disabled", "Enabled"],
+              ["Comm Select ", "Meterbus", "MODBUS"]]
+
+
+
+# Create name / scale factor lists / units
+# These items are order dependent. The message list index is used
+# as an index to this list. This list is ordered and needs to 
+# be contigious!
+#
+# In order to scale and/or decode items the Scale Factor field is used
+# to indicate what kind of items it is. Right now the following values
+# are used to 'steer' the decoding / scaling process.
+#
+# Key to Scaler Field -
+#  ' 1': The item is already in the proper format, no scaling necessary
+#
+#  '-1': Use the list named in the Units field to process State values
+#      and the actual value of the param as the index to that list.
+#           [Name String,  -1, "Name of List to use State Decode"]
+#
+#  '-2': Use the list named in the Units field to process bit encoded
+#      information. Pass the param value to 'bitdecode' function for
+#      processing.
+#           [Name String,  -2, "Name of List to use Bit Decode"]
+#
+#  '-3': Indicates the param is the upper word of a 32/24 value (_HI).
+#      Use this value plus the next param to form the Long integer.
+#      Scale factor is stored in _HI 'unitsOffset' (Units) position
+#      Units string is stored in _LO 'unitsOffset' (Units) position 
+#           [Name String,  -3, Scale Factor]
+#           [Name String,  -4, Units String]
+#
+#  '-4': Indicates the param is part of a Long integer (see -3 above)
+#      and ignore processing
+#
+#  All other value are considered valid scale factors
+#
+#           [Name String,  Scale Factor, Units String]
+# --------------------------------------------------------
+PStatLst = [["Adc_vb_f", vfactor, "V"],
+            ["Adc_va_f", vfactor, "V"],
+            ["Adc_vl_f", vfactor, "V"],
+	    ["Adc_ic_f", ifactor, "A"],
+	    ["Adc_il_f", ifactor, "A"],
+            ["T_hs", 1, "deg C"],
+            ["T_batt", 1, "deg C"],
+            ["T_amb", 1, "deg C"],
+            ["T_rts", 1, "deg C"],
+            ["Charge_State", -1, PChrgState],
+            ["Array_Fault", -2, PArryFault],
+            ["Vb_f", vfactor, "V"],
+            ["Vb_ref", vrfactor, "V"],
+            ["Ahc_r_HI", -3, ahfactor],
+            ["Ahc_r_LO", -4, "Ah"],
+            ["Ahc_t_HI", -3, ahfactor],
+            ["Ahc_t_LO", -4, "Ah"],
+            ["KWhc", ahfactor, "Ah"],
+            ["Load_State", -1, PLoadState],
+            ["Load_Fault", -2, PLoadFault],
+            ["V_lvd", vfactor, "V"],
+            ["Ahl_r_HI", -3, ahfactor],
+            ["Ahl_r_LO", -4, "Ah"],
+            ["Ahl_t_HI", -3, ahfactor],
+            ["Ahl_t_LO", -4, "Ah"],
+            ["Hourmeter_HI", -3, 1],
+            ["Hourmeter_LO", -4, "Hours"],
+            ["Alarm_HI", 1, "(bit field hi)"],
+            ["Alarm_LO", 1, "(bit field lo)"],
+            ["Dip_Switch", -2, PDipSwitch],
+            ["LED_State", -1, PLedState],
+            ["Power_out", pofactor, "W"],
+            ["Sweep_Vmp", vfactor, "V"],
+            ["Sweep_Pmax", pofactor, "W"],
+            ["Sweep_Voc", vfactor, "V"],
+            ["Vb_min_daily", vfactor, "V"],
+            ["Vb_max_daily", vfactor, "V"],
+            ["Ahc_daily", ahfactor, "Ah"],
+            ["Ahl_daily", ahfactor, "Ah"],
+            ["Array_Fault_daily", 1, "(bit field)"],
+            ["Load_Fault_daily", 1, "(bit field)"],
+            ["Alarm_HI_daily", 1, "(bit field hi)"],
+            ["Alarm_LO_daily", 1, "(bit field lo)"],
+            ["Vb_min", vfactor, "V"],
+            ["Vb_max", vfactor, "V"]]
+
+# Logged Data Record Message variable names and scale factors
+PLogLst = [["hourmeter", 1, "Hours"],
+           ["alarm_daily", 1, "(bit field)"],
+           ["Vb_min_daily", vfactor, "V"],
+           ["Vb_max_daily", vfactor, "V"],
+           ["Ahc_daily", ahfactor, "Ah"],
+           ["Ahl_daily", ahfactor, "Ah"],
+           ["array_Fault_daily", 1, "(bit field)"],
+           ["load_Fault_daily",1, "(bit field)"],
+           ["Va_max_daily", vfactor, "V"],
+           ["Time_ab_daily", 1, "Min"],
+           ["Time_eq_daily", 1, "Min"],
+           ["Time_fl_daily", 1, "Min"],
+           ["reserved1", 1, " "],
+           ["reserved2", 1, " "],
+           ["reserved3", 1, " "]]
+
+#these globals need to be defined.
+params = None
+data = None
+
+import time
+import socket
+
+from framer import Framer, xorsum
+from decoder import DecodePlan
+
+# Decode plans compiled once from the tables above, see decoder.py
+StatusPlan = DecodePlan(PStatLst)
+LogPlan = DecodePlan(PLogLst)
+
+#added to handle a bad checksum beteen remote string and recieved string.
+#make note and move to the next station, then try again.
+#if you get to many,comment out the station in the station file... #stationlist....
+class BadChecksum(Exception):
+  pass
+
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+# -------------------------------------------------------------------
+# -------------------------------------------------------------------
+# ------------ Start of Various Functions Definitions ---------------
+# -------------------------------------------------------------------
+# -------------------------------------------------------------------
+# +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+# ===================================================================
+# calculate and returns the XOR checksum for pass string
+# ------------------------------------------------------
+# ...Assumes string starts with a '$' and it is not included
+# ...in the checksum calculation.
+# ...The XOR itself is done by framer.xorsum, no per character loop.
+# ===================================================================
+def checksum(d):
+  dend = d.find('*')
+  return xorsum(d[1:dend])
+# ... End checksum Function
+
+# ===================================================================
+# message send function
+# ---------------------
+#  returns the number chars sent
+# ===================================================================
+def mysend(sock, msg,  StationName):
+    totalsent = 0
+    #Exception handeling for send sockets.
+    try:
+        while totalsent < len(msg):
+            sent = sock.send(msg[totalsent:])
+            totalsent = totalsent + sent
+    except (socket.timeout, socket.error) as e:
+        print 'Station %s send error: %s' % (StationName, e)
+        raise
+    return totalsent
+# ... End mysend Function ...
+
+# ===================================================================
+# data string recieve function
+# ----------------------------
+# Reads from the addressed socket into a Framer until a complete
+# '$...*XX\r\n' frame shows up or 'buflen' bytes have been read.
+# A frame split across reads or following junk is handled by the
+# Framer. Bytes after the frame stay in 'framer' for the next call
+# when the caller passes its own.
+# The frame string is returned, or whatever arrived if no frame did.
+# ===================================================================
+def myreceive(sock, buflen,  StationName, framer=None):
+    if framer is None:
+        framer = Framer(verify=False)   # doStatus reports bad checksums
+    bytes_recd = 0
+    #Exception handling for recieve sockets.
+    try:
+        while True:
+            for frame in framer.frames():
+                return frame.tobytes()
+            if bytes_recd >= buflen:
+                break
+            n = framer.recvInto(sock)
+            if n == 0:
+                break
+            bytes_recd = bytes_recd + n
+    except (socket.timeout, socket.error) as e:
+        print 'Station %s receive error: %s' % (StationName, e)
+        raise
+    return framer.view[framer.head:framer.tail].tobytes()
+
+#New CSV format for output/cronlog
+# One complete line per sample (less the Comm_Duration the caller adds),
+# the same fields the old doLoadState/doVbattery/.../doChargeState
+# functions printed one at a time:
+#   StationName,mm/dd/yyyy,hh:mm:ss, LoadState,x, VBatt,x,V, Vlvd,x,V, Vdiff,x,V, ChargeState,x,
+formatCSV = '%s,%.2f,%s,'
+
+# ===================================================================
+# Build the CSV log text for a decoded status Record.
+# ...A state value outside its list is left out of the line and
+# ...reported, like the old doLoadState / doChargeState did.
+# ===================================================================
+def formatRecord(rec):
+  lt = time.localtime(rec.stamp)
+  out = ['%s,%d/%d/%d,%02d:%02d:%02d,' % (rec.station, lt.tm_mon, lt.tm_mday, lt.tm_year, lt.tm_hour, lt.tm_min, lt.tm_sec)]
+  # Load State first so LVD_WARNING shows right after the date-time stamp.
+  ls = rec.text('Load_State')
+  if ls is None:
+    out.append('invalid index into LoadState list!!!')
+  else:
+    out.append('LoadState,%s,' % ls)
+  vb = rec.get('Adc_vb_f')
+  lvd = rec.get('V_lvd')
+  out.append(formatCSV % ('VBatt', vb, StatusPlan.units[0]))
+  out.append(formatCSV % ('Vlvd', lvd, StatusPlan.units[20]))
+  out.append(formatCSV % ('Vdiff', vb - lvd, StatusPlan.units[20]))   # Vdiff=VBatt-Vlvd
+  cs = rec.text('Charge_State')
+  if cs is None:
+    out.append('invalid index into ChargeState list!!!')
+  else:
+    out.append('ChargeState,%s,' % cs)
+  return ' '.join(out)
+# ... End formatRecord Function ...
+
+# ===================================================================
+# Function to check and decode a status frame already received from a
+# station, and print its CSV log line. Used by doShortScan below and by
+# the pollers, which do the socket work themselves.
+# ...'stamp' is the time.time() the frame was captured, defaults to now.
+# ...'duration' is the Comm_Duration to keep with the Record.
+# ...'echo' False leaves the logging to the caller (logsink.LogSink).
+# ...'metrics' (metrics.Metrics) gets the checksum and decode times.
+# ...Returns the decoded Record. Raises BadChecksum.
+# ===================================================================
+def doStatus(data, StationName, stamp=None, duration=0.0, echo=True, metrics=None):
+  # ===================================================================
+  # 1) Find end of message (start of checksum string) - 'eod'
+  # 2) Retrieve the strings checksum - 'dchksum'
+  # 3) Decode the frame in one pass with the compiled StatusPlan.
+  #    The header and firmware revision strings are kept in the Record.
+  # ===================================================================
+  t0 = time.time()
+  eod = data.find('*')
+  dchksum = data[eod+1:-2]        # get the checksum value, no *, no CRLF
+
+  # Exception for corrupted string.
+  # If the checksum's do not match, raise so the caller can move on and try again.
+  calc = checksum(data)
+  if (int(dchksum, 16)!=calc):
+    print 'CHECKSUM MISMATCH %s,%0X' %(dchksum, calc)
+    if metrics is not None:
+      metrics.count('checksum_mismatches', StationName)
+    raise BadChecksum
+
+  t1 = time.time()
+  if stamp is None:
+    stamp = t1
+  rec = StatusPlan.decodeFrame(data, StationName, stamp, duration)
+  if metrics is not None:
+    metrics.observe('checksum', StationName, t1 - t0)
+    metrics.observe('decode', StationName, time.time() - t1)
+
+  #-----------------------------------------------------------------------------------------------------------------
+  #CSV format for output to log. Created to make cronlog easy to read with many stations. 
+  #Can be imported into spread sheet for quick viewing....
+  #THE COMMA AT THE END OF THIS STATEMENT REMOVES THE NEWLINE! The caller adds Comm_Duration to finish the line.
+  #-----------------------------------------------------------------------------------------------------------------
+  if echo:
+    print formatRecord(rec),
+
+  return rec
+# ... End doStatus Function ...
+
+# ===================================================================
+# Function to do the whole tamale. Get a status record from the 
+# selected station over an already connected socket, check and log it
+# with doStatus, and return the decoded Record.
+# ===================================================================
+def doShortScan(s,  StationName):
+  global params, data
+  # ===================================================================
+  # Retrieve a status record from MPPT/Radio 
+  # ----------------------------------------
+  #  Send a request. This complete status record is place in "data" string.
+  #  ****NOTE! Cell modems do not process any request over the serial port, T, R, E.....
+  #  Freewave radio's do... All translators are defaulted to T mode
+  #  and will reset to T mode. If you connect directly with a PC,
+  #  try to remember to put the translator back into T mode please. 
+  # ===================================================================
+  start = time.time()
+  x = mysend(s, 'R\r',  StationName) # send request for status data
+  data = myreceive(s, 1024,  StationName)
+
+  rec = doStatus(data, StationName, duration=time.time() - start)
+  params = list(rec.raw)
+
+  # ------------------------------------------------------------------
+  # Return translator to Timed 
+  # Message Mode before Exiting
+  # ------------------------------------------------------------------
+  x = mysend(s, 'T\r', StationName)
+  #print "Returning back to timed mode"
+  return rec
+
+# ... End doShortScan Function ...
@@ -0,0 +1,305 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Concurrent station poller.
+#
+# The original main loop talked to one station at a time: connect,
+# 'R\r', read a frame, 'T\r', close. With a 30 second socket timeout a
+# single dead cell modem held up every station behind it.
+#
+# pollStations() keeps up to 'maxinflight' stations on the wire at once
+# using non-blocking sockets and select/poll, so a full cycle takes
+# about as long as the slowest station instead of the sum of them all.
+# The frames are handed back unparsed; the caller runs them through
+# mppt.doStatus() exactly like doShortScan does.
+#
+# Given a linkhealth.LinkHealth, each station gets its own connect and
+# receive timeouts from it and its connect times are reported back.
+# Given a metrics.Metrics, the resolve, connect, request, receive and
+# release ('T\r') times and the errors are recorded per station.
+#---------------------------------------------------------------
+import errno
+import select
+import socket
+import time
+
+from framer import Framer
+
+# Station poll phases
+CONNECTING = 0   # non-blocking connect issued, waiting for writable
+SENDING    = 1   # sending the 'R\r' request
+RECEIVING  = 2   # collecting the status frame up to CRLF
+
+StnBufLen = 1024  # same limit myreceive used
+
+# ===================================================================
+# One station in flight. Holds the socket, the current phase, the
+# bytes still to send, the receive Framer and the phase deadline.
+# ===================================================================
+class StationPoll(object):
+    __slots__ = ('name', 'host', 'port', 'sock', 'phase', 'outbuf',
+                 'framer', 'nrecd', 'deadline', 'start', 'stamp',
+                 'rto', 'cstart', 'ctime', 'rtime', 'sent')
+
+    def __init__(self, name, host, port, rto=30):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.sock = None
+        self.phase = CONNECTING
+        self.outbuf = 'R\r'
+        self.framer = Framer(verify=False)   # doStatus reports bad checksums
+        self.nrecd = 0
+        self.deadline = 0
+        self.start = 0
+        self.stamp = 0
+        self.rto = rto        # send / receive timeout
+        self.cstart = 0       # time the connect was issued
+        self.ctime = None     # seconds the connect took
+        self.rtime = None     # seconds the name lookup took
+        self.sent = 0         # time the request was all sent
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+# ... End StationPoll Class ...
+
+# ===================================================================
+# Small wrapper so the poller runs on select.poll where the platform
+# has it (no FD_SETSIZE limit) and falls back to select.select.
+# ===================================================================
+class _Waiter(object):
+    def __init__(self):
+        self.fds = {}
+        if hasattr(select, 'poll'):
+            self.p = select.poll()
+        else:
+            self.p = None
+
+    def register(self, fd, writing):
+        mask = select.POLLOUT if writing else select.POLLIN
+        if self.p is not None:
+            if fd in self.fds:
+                self.p.modify(fd, mask)
+            else:
+                self.p.register(fd, mask)
+        self.fds[fd] = writing
+
+    def unregister(self, fd):
+        if fd in self.fds:
+            del self.fds[fd]
+            if self.p is not None:
+                self.p.unregister(fd)
+
+    def wait(self, timeout):
+        if not self.fds:
+            time.sleep(timeout)
+            return []
+        if self.p is not None:
+            return [fd for fd, ev in self.p.poll(timeout * 1000)]
+        rd = [fd for fd, w in self.fds.items() if not w]
+        wr = [fd for fd, w in self.fds.items() if w]
+        r, w, x = select.select(rd, wr, [], timeout)
+        return r + w
+# ... End _Waiter Class ...
+
+# ===================================================================
+# Look up a station's address, (IP, port). connect_ex() would do the
+# same lookup (blocking) itself, done here it can be timed.
+# ...Raises socket.gaierror.
+# ===================================================================
+def resolve(host, port):
+    return socket.getaddrinfo(host, port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+# ... End resolve Function ...
+
+# ===================================================================
+# Start a non-blocking connect for the passed station.
+# ...Raises socket.error / socket.gaierror if it fails right away.
+# ===================================================================
+def _startConnect(sp, timeout):
+    t = time.time()
+    addr = resolve(sp.host, sp.port)
+    sp.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sp.sock.setblocking(0)
+    sp.cstart = time.time()
+    sp.rtime = sp.cstart - t
+    sp.deadline = sp.cstart + timeout
+    err = sp.sock.connect_ex(addr)
+    if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+        raise socket.error(err, errno.errorcode.get(err, 'connect failed'))
+# ... End _startConnect Function ...
+
+# ===================================================================
+# Advance one station after its socket became ready.
+# ...Returns the frame string once a complete one has been received.
+# ...Raises socket.error on any comm problem.
+# ===================================================================
+def _service(sp):
+    if sp.phase == CONNECTING:
+        err = sp.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            raise socket.error(err, errno.errorcode.get(err, 'connect failed'))
+        sp.phase = SENDING
+        sp.start = time.time()
+        sp.ctime = sp.start - sp.cstart
+        sp.deadline = sp.start + sp.rto
+    if sp.phase == SENDING:
+        try:
+            sent = sp.sock.send(sp.outbuf)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return None    # still SENDING, waited on for writable again
+            raise
+        sp.outbuf = sp.outbuf[sent:]
+        if not sp.outbuf:
+            sp.phase = RECEIVING
+            sp.sent = time.time()
+            sp.deadline = sp.sent + sp.rto
+        return None
+    # RECEIVING
+    try:
+        n = sp.framer.recvInto(sp.sock)
+    except socket.error as e:
+        if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+            return None
+        raise
+    if not n:
+        raise socket.error(errno.ECONNRESET, 'connection closed by station')
+    sp.nrecd += n
+    for frame in sp.framer.frames():
+        return frame.tobytes()
+    if sp.nrecd >= StnBufLen:
+        raise socket.error(errno.EMSGSIZE, 'no status frame in %d bytes' % StnBufLen)
+    return None
+# ... End _service Function ...
+
+# ===================================================================
+# Poll every station in 'stations' concurrently.
+# ---------------------------------------------------
+#  stations   - list of (StationName, IP, Port)
+#  maxinflight- most stations talked to at the same time
+#  timeout    - seconds allowed for each phase (connect, send, receive)
+#  health     - optional linkhealth.LinkHealth. Its per-station timeouts
+#               are used instead of 'timeout' and connect times go to it.
+#  more       - optional function returning more stations to add while
+#               the poll is running (newly due ones from the scheduler),
+#               so a slow station in flight doesn't hold them up
+#  metrics    - optional metrics.Metrics for the phase times and errors
+#
+#  This is a generator. As each station finishes it yields
+#     (StationName, data, Comm_Duration, stamp)
+#  where 'data' is the raw frame string (None on a comm error, the
+#  error has already been printed), Comm_Duration is the request to
+#  frame time and 'stamp' is the time.time() the frame arrived.
+#  Before closing, each station is put back in Timed mode ('T\r').
+# ===================================================================
+def pollStations(stations, maxinflight=32, timeout=30, more=None, health=None, metrics=None):
+    pending = list(stations)
+    pending.reverse()
+    inflight = {}            # fd -> StationPoll
+    waiter = _Waiter()
+
+    while pending or inflight:
+        if more is not None:
+            extra = more()
+            if extra:
+                extra = list(extra)
+                extra.reverse()
+                pending[:0] = extra    # behind the ones already waiting
+        # top up the in flight set
+        while pending and len(inflight) < maxinflight:
+            name, host, port = pending.pop()
+            cto = rto = timeout
+            if health is not None:
+                cto, rto = health.timeouts(name)
+            sp = StationPoll(name, host, port, rto)
+            try:
+                _startConnect(sp, cto)
+            except (socket.timeout, socket.error, socket.gaierror) as e:
+                print 'Station %s (%s:%s) connection error: %s' % (name, host, port, e)
+                if metrics is not None:
+                    metrics.count('connection_errors', name)
+                sp.close()
+                yield (name, None, 0, time.time())
+                continue
+            inflight[sp.sock.fileno()] = sp
+            waiter.register(sp.sock.fileno(), True)
+
+        if not inflight:
+            continue
+
+        now = time.time()
+        wait = max(0, min(sp.deadline for sp in inflight.values()) - now)
+        ready = waiter.wait(min(wait, 1.0))
+
+        done = []
+        finished = set()
+        for fd in ready:
+            sp = inflight.get(fd)
+            if sp is None:
+                continue
+            try:
+                frame = _service(sp)
+            except (socket.timeout, socket.error) as e:
+                if sp.phase == CONNECTING:
+                    print 'Station %s (%s:%s) connection error: %s' % (sp.name, sp.host, sp.port, e)
+                    counter = 'connection_errors'
+                else:
+                    print 'Station %s receive error: %s' % (sp.name, e)
+                    counter = 'receive_errors'
+                if metrics is not None:
+                    metrics.count(counter, sp.name)
+                done.append((fd, sp, None))
+                finished.add(fd)
+                continue
+            if frame is not None:
+                sp.stamp = time.time()
+                done.append((fd, sp, frame))
+                finished.add(fd)
+            elif sp.phase != CONNECTING:
+                waiter.register(fd, sp.phase == SENDING)
+
+        # anything past its deadline is timed out
+        now = time.time()
+        for fd, sp in inflight.items():
+            if sp.deadline < now and fd not in finished:
+                if sp.phase == CONNECTING:
+                    print 'Station %s (%s:%s) connection error: timed out' % (sp.name, sp.host, sp.port)
+                else:
+                    print 'Station %s receive error: timed out' % (sp.name)
+                if metrics is not None:
+                    metrics.count('timeouts', sp.name)
+                done.append((fd, sp, None))
+
+        for fd, sp, data in done:
+            waiter.unregister(fd)
+            del inflight[fd]
+            if health is not None and sp.ctime is not None:
+                health.connected(sp.name, sp.ctime)
+            if metrics is not None:
+                metrics.observe('resolve', sp.name, sp.rtime)
+                if sp.ctime is not None:
+                    metrics.observe('connect', sp.name, sp.ctime)
+                if sp.sent:
+                    metrics.observe('request', sp.name, sp.sent - sp.start)
+            if data is not None:
+                # Return translator to Timed Message Mode before closing.
+                # Best effort, 2 bytes always fit in an empty send buffer.
+                t = time.time()
+                try:
+                    sp.sock.send('T\r')
+                except socket.error:
+                    pass
+                if metrics is not None:
+                    metrics.observe('receive', sp.name, sp.stamp - sp.sent)
+                    metrics.observe('release', sp.name, time.time() - t)
+                Comm_Duration = sp.stamp - sp.start
+                sp.close()
+                yield (sp.name, data, Comm_Duration, sp.stamp)
+            else:
+                sp.close()
+                yield (sp.name, None, 0, time.time())
+# ... End pollStations Function ...
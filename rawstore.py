@@ -0,0 +1,240 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Raw sample store: every polled sample, unconsolidated, in column files.
+#
+# The RRDs average, interpolate and age out what we poll. RawStore keeps
+# the raw register values as they came in, one directory per station and
+# one fixed width binary file per column:
+#
+#   RawPath/StationName/columns        'name typecode' per line
+#   RawPath/StationName/stamp.col      capture time, 'd' (float64)
+#   RawPath/StationName/Adc_vb_f.col   register, 'i' (int32)   x45, PStatLst
+#   RawPath/StationName/Comm_Duration.col                      'f' (float32)
+#
+# Row n of every file is the same sample. Files are only ever appended
+# to (buffered, several rows per write) and stamps only increase, so a
+# reader can memory map them and binary search the stamp column. The
+# stamp column is written last, a reader counts rows from the shortest
+# file and never sees half a sample. Rows past the end of stamp.col (a
+# crash or write error part way through a flush) are cut off before the
+# next append, so the columns stay aligned.
+#
+# RawReader maps the columns with NumPy (optional, only needed to read):
+#   r = RawReader(RawPath, 'MARC_mppt')
+#   cols = r.range(t0, t1, ['Adc_vb_f', 'Adc_ic_f'])   # memmap views, no copy
+#   vbatt = cols['Adc_vb_f'] * vfactor
+#---------------------------------------------------------------
+import os
+import time
+from array import array
+
+from mppt import PStatLst
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ColumnFile = 'columns'
+
+# (column name, array / numpy typecode) in file order
+Columns = [('stamp', 'd')] + [(row[0], 'i') for row in PStatLst] + [('Comm_Duration', 'f')]
+
+class RawStore(object):
+
+    # ===================================================================
+    #  rawdir - directory for the per-station directories
+    #  batch  - samples buffered per station before they are written
+    #  maxage - seconds the oldest buffered sample may wait
+    # ===================================================================
+    def __init__(self, rawdir, batch=60, maxage=600):
+        self.rawdir = rawdir
+        self.batch = batch
+        self.maxage = maxage
+        self.nreg = len(PStatLst)
+        self.pending = {}    # StationName -> [stamps array, raw array, durations array]
+        self.first = {}      # StationName -> capture time of oldest pending
+        self.last = {}       # StationName -> last stamp stored
+        self.trimmed = set() # StationNames whose columns were cut to stamp.col this run
+        self.rows = 0        # rows written
+
+    def path(self, StationName):
+        return os.path.join(self.rawdir, StationName)
+
+    def setStations(self, names):
+        pass    # directories are made on the first write
+
+    # ===================================================================
+    # Buffer one decoded sample (Record). A stamp not after the last one
+    # stored for the station is dropped, the stamp column stays sorted.
+    # ===================================================================
+    def add(self, rec):
+        name = rec.station
+        last = self.last.get(name)
+        if last is None:
+            last = self.last[name] = self._lastStamp(name)
+        if rec.stamp <= last:
+            return
+        self.last[name] = rec.stamp
+        q = self.pending.get(name)
+        if q is None:
+            q = self.pending[name] = [array('d'), array('l'), array('f')]
+            self.first[name] = rec.stamp
+        q[0].append(rec.stamp)
+        q[1].extend(rec.raw)
+        q[2].append(rec.duration)
+        if len(q[0]) >= self.batch:
+            self.flushStation(name)
+
+    def flushDue(self, now=None):
+        if now is None:
+            now = time.time()
+        for name in self.pending.keys():
+            if now - self.first[name] >= self.maxage:
+                self.flushStation(name)
+
+    def flush(self):
+        for name in self.pending.keys():
+            self.flushStation(name)
+
+    # ===================================================================
+    # Append a station's buffered rows to its column files.
+    # ===================================================================
+    def flushStation(self, StationName):
+        q = self.pending.pop(StationName, None)
+        self.first.pop(StationName, None)
+        if not q:
+            return
+        stamps, raw, durations = q
+        d = self._open(StationName)
+        if StationName not in self.trimmed:
+            self._trim(d)
+            self.trimmed.add(StationName)
+        try:
+            for i in range(self.nreg):
+                self._append(d, PStatLst[i][0], array('i', raw[i::self.nreg]))
+            self._append(d, 'Comm_Duration', durations)
+            self._append(d, 'stamp', stamps)    # last, it makes the rows visible
+        except (IOError, OSError):
+            self.trimmed.discard(StationName)    # again next flush if this fails too
+            self._trim(d)     # take back the part written, the batch is lost
+            self.trimmed.add(StationName)
+            raise
+        self.rows += len(stamps)
+
+    def _append(self, d, name, values):
+        f = open(os.path.join(d, name + '.col'), 'ab')
+        values.tofile(f)
+        f.close()
+
+    # cut every column file back to the rows in stamp.col
+    def _trim(self, d):
+        p = os.path.join(d, 'stamp.col')
+        n = os.path.getsize(p) // 8 if os.path.exists(p) else 0
+        for name, code in Columns:
+            p = os.path.join(d, name + '.col')
+            size = n * array(code).itemsize
+            if os.path.exists(p) and os.path.getsize(p) > size:
+                f = open(p, 'r+b')
+                f.truncate(size)
+                f.close()
+
+    # station directory, made with its columns file the first time
+    def _open(self, StationName):
+        d = self.path(StationName)
+        if not os.path.isdir(d):
+            os.makedirs(d)
+            f = open(os.path.join(d, ColumnFile), 'w')
+            for name, code in Columns:
+                f.write('%s %s\n' % (name, code))
+            f.close()
+        return d
+
+    # last stamp already on disk for a station, 0 if none
+    def _lastStamp(self, StationName):
+        p = os.path.join(self.path(StationName), 'stamp.col')
+        try:
+            f = open(p, 'rb')
+        except IOError:
+            return 0
+        try:
+            n = os.fstat(f.fileno()).st_size // 8
+            if n == 0:
+                return 0
+            f.seek((n - 1) * 8)
+            a = array('d')
+            a.fromfile(f, 1)
+            return a[0]
+        finally:
+            f.close()
+# ... End RawStore Class ...
+
+# ===================================================================
+# Stations with raw data under rawdir.
+# ===================================================================
+def stations(rawdir):
+    return sorted([name for name in os.listdir(rawdir)
+                   if os.path.exists(os.path.join(rawdir, name, ColumnFile))])
+# ... End stations Function ...
+
+class RawReader(object):
+
+    # ===================================================================
+    # Read side of one station's column files. Needs NumPy.
+    # ===================================================================
+    def __init__(self, rawdir, StationName):
+        if numpy is None:
+            raise ImportError('RawReader needs numpy')
+        self.dir = os.path.join(rawdir, StationName)
+        self.types = {}
+        self.order = []
+        for line in open(os.path.join(self.dir, ColumnFile)):
+            name, code = line.split()
+            self.types[name] = numpy.dtype(code)
+            self.order.append(name)
+        self.n = self._rows()
+        self.maps = {}
+
+    # rows every column has, the stamp column is written last
+    def _rows(self):
+        n = None
+        for name in self.order:
+            try:
+                size = os.path.getsize(os.path.join(self.dir, name + '.col'))
+            except OSError:
+                return 0
+            rows = size // self.types[name].itemsize
+            if n is None or rows < n:
+                n = rows
+        return n or 0
+
+    # ===================================================================
+    # Whole column as a read only numpy.memmap (n rows).
+    # ===================================================================
+    def column(self, name):
+        m = self.maps.get(name)
+        if m is None:
+            if self.n == 0:
+                return numpy.zeros(0, self.types[name])
+            m = numpy.memmap(os.path.join(self.dir, name + '.col'), dtype=self.types[name],
+                             mode='r', shape=(self.n,))
+            self.maps[name] = m
+        return m
+
+    # ===================================================================
+    # Rows with t0 <= stamp < t1 (None for open ended).
+    # ...Returns {name: view} for 'names' (default every column) plus
+    # ...'stamp'. The views share memory with the files, nothing is read
+    # ...until it is used.
+    # ===================================================================
+    def range(self, t0=None, t1=None, names=None):
+        stamp = self.column('stamp')
+        lo = 0 if t0 is None else int(numpy.searchsorted(stamp, t0, 'left'))
+        hi = self.n if t1 is None else int(numpy.searchsorted(stamp, t1, 'left'))
+        if names is None:
+            names = self.order
+        out = {'stamp': stamp[lo:hi]}
+        for name in names:
+            out[name] = self.column(name)[lo:hi]
+        return out
+# ... End RawReader Class ...
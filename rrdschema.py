@@ -0,0 +1,271 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# RRD layout (derived from PStatLst) for the StationName_mppt.rrd files,
+# creating missing ones, the update template, and a migration tool.
+#
+# The original layout (Create_RRDTool_DB_10years.sh) was AVERAGE, MIN
+# and MAX archives of 1,051,200 one minute rows each: 46 DS * 3 RRAs *
+# 1,051,200 rows * 8 bytes = ~1.16 GB per station, and only 2 years of
+# data (525,600 minutes a year). With one sample per row the three
+# archives also held the same numbers, and every graph, however long,
+# read from them.
+#
+# The tiered layout keeps:
+#   1 minute rows for 14 days  AVERAGE (MIN/MAX of one sample are the same)
+#   5 minute rows for 90 days  AVERAGE, MIN, MAX
+#   hourly rows for 2 years    AVERAGE, MIN, MAX
+#   daily rows for 10 years    AVERAGE, MIN, MAX
+# ~59 MB per station, and a long range graph is drawn from the coarse
+# archives (rrdtool picks the finest one covering the whole range).
+#
+#   python rrdschema.py create StationName_mppt.rrd ...
+#   python rrdschema.py migrate [--no-keep] StationName_mppt.rrd ...
+#   python rrdschema.py size
+#   python rrdschema.py script StationName_mppt.rrd    (the create command)
+#
+# migrate resamples an existing file into the new layout, a day at a
+# time so memory stays flat, and swaps it in. The old file is kept as
+# StationName_mppt.rrd.old, files already tiered are skipped. Stop
+# Insert8.3.py (or let it flush, see all.sh) while migrating, updates
+# to the old file would be lost.
+#---------------------------------------------------------------
+import os
+import sys
+import time
+
+import rrdtool
+
+from mppt import PStatLst
+
+Step = 60          # seconds per primary data point, the poll interval
+Heartbeat = 600    # seconds without an update before a DS goes unknown
+
+# ===================================================================
+# Data sources, derived from the register table so the RRD layout, the
+# update template and the decoder can't drift apart:
+#   the 45 MPPT registers in PStatLst order, then the Timing fields.
+# (Name, min, max), all GAUGE. Registers not in Bounds are 0..65535.
+# ===================================================================
+Timing = [('Comm_Duration', 0, 600)]    # seconds, request to frame
+
+Bounds = {
+    'T_hs': (-128, 127), 'T_batt': (-127, 127), 'T_amb': (-127, 127), 'T_rts': (-127, 127),
+    'Charge_State': (0, 8), 'Array_Fault': (0, 15),
+    'Load_State': (0, 5), 'Load_Fault': (0, 7),
+    'Hourmeter_HI': (0, 16777215),
+    'Alarm_HI': (0, 127), 'Alarm_LO': (0, 127),
+    'Dip_Switch': (0, 8), 'LED_State': (0, 524288),
+    'Array_Fault_daily': (0, 32768), 'Load_Fault_daily': (0, 127),
+    'Alarm_HI_daily': (0, 127), 'Alarm_LO_daily': (0, 127),
+}
+
+DSList = [(row[0],) + Bounds.get(row[0], (0, 65535)) for row in PStatLst] + Timing
+
+# ===================================================================
+# Consolidation tiers: (steps per row, rows, consolidation functions)
+# ===================================================================
+Tiers = [
+    (1, 14 * 1440, ('AVERAGE',)),                  # 1 minute, 14 days
+    (5, 90 * 288, ('AVERAGE', 'MIN', 'MAX')),      # 5 minutes, 90 days
+    (60, 2 * 8760, ('AVERAGE', 'MIN', 'MAX')),     # hourly, 2 years
+    (1440, 3660, ('AVERAGE', 'MIN', 'MAX')),       # daily, 10 years
+]
+
+MigrateChunk = 1440    # one minute rows copied per fetch / update (a day)
+
+# RRA: definitions for the tiers
+def rraDefs():
+    out = []
+    for steps, rows, cfs in Tiers:
+        for cf in cfs:
+            out.append('RRA:%s:0.5:%d:%d' % (cf, steps, rows))
+    return out
+
+# DS: definitions
+def dsDefs():
+    return ['DS:%s:GAUGE:%d:%d:%d' % (name, Heartbeat, lo, hi) for name, lo, hi in DSList]
+
+# ===================================================================
+# rrdtool update values for one sample, compiled once from the schema.
+# ---------------------------------------------------------
+#  template - the DS names for 'rrdtool update --template', so values
+#             land in the right DS whatever order a file was built in
+#  values(rec, *timing) - 'v:v:...:t' for a decoded Record and the
+#             Timing values (Comm_Duration)
+# The register text of the frame is used as is (it is already the
+# decimal integers rrdtool wants) when it holds exactly the registers
+# and nothing but digits, otherwise the decoded integers are formatted.
+# ===================================================================
+class UpdateTemplate(object):
+
+    def __init__(self):
+        self.template = ':'.join([name for name, lo, hi in DSList])
+        self.nreg = len(PStatLst)
+        self.tail = ':' + ':'.join(['%f'] * len(Timing))
+        self.rawfmt = ':'.join(['%d'] * self.nreg)
+
+    def values(self, rec, *timing):
+        text = rec.regtext
+        if text is not None and text.count(',') == self.nreg - 1 and text.replace(',', '').replace('-', '').isdigit():
+            text = text.replace(',', ':')
+        else:
+            text = self.rawfmt % tuple(rec.raw)
+        return text + self.tail % timing
+# ... End UpdateTemplate Class ...
+
+# ===================================================================
+# Create any of the named stations' RRDs that don't exist yet.
+#  paths - optional {StationName: RRD file} for RRDs not in rrddir
+# ...Returns the list of files created. Errors are printed.
+# ===================================================================
+def provision(rrddir, names, paths=None):
+    created = []
+    for name in names:
+        path = (paths or {}).get(name) or os.path.join(rrddir, name + '.rrd')
+        if os.path.exists(path):
+            continue
+        try:
+            create(path)
+        except rrdtool.error as e:
+            print 'Station %s rrdtool create error: %s' % (name, e)
+            continue
+        print 'Station %s: created %s' % (name, path)
+        created.append(path)
+    return created
+# ... End provision Function ...
+
+# ===================================================================
+# The create command as a shell script (Create_RRDTool_DB_10years.sh).
+# ===================================================================
+def script(path):
+    lines = ['rrdtool create %s --step %d' % (path, Step)] + dsDefs() + rraDefs()
+    return ' \\\n'.join(lines) + '\n'
+# ... End script Function ...
+
+# ===================================================================
+# Approximate file size in bytes of the tiered layout.
+# ===================================================================
+def size():
+    rows = 0
+    for steps, nrows, cfs in Tiers:
+        rows += nrows * len(cfs)
+    return rows * len(DSList) * 8
+# ... End size Function ...
+
+# ===================================================================
+# Create an RRD in the tiered layout. 'start' is the time before the
+# first update, default now - Step.
+# ===================================================================
+def create(path, start=None):
+    if start is None:
+        start = int(time.time()) - Step
+    rrdtool.create(path, '--start', str(int(start)), '--step', str(Step), *(dsDefs() + rraDefs()))
+# ... End create Function ...
+
+# ===================================================================
+# True if the RRD at 'path' already has the tiered archives (RRA
+# consolidation functions, steps per row and rows as in Tiers).
+# ===================================================================
+def tiered(path):
+    info = rrdtool.info(path)
+    have = []
+    n = 0
+    while 'rra[%d].cf' % n in info:
+        have.append((info['rra[%d].cf' % n], int(info['rra[%d].pdp_per_row' % n]),
+                     int(info['rra[%d].rows' % n])))
+        n += 1
+    want = [(cf, steps, rows) for steps, rows, cfs in Tiers for cf in cfs]
+    return have == want
+# ... End tiered Function ...
+
+# ===================================================================
+# Resample 'src' into the tiered layout, written to 'dst'.
+# ---------------------------------------------------------
+# The one minute AVERAGE data is fetched and written MigrateChunk rows
+# at a time. All unknown rows are left out (a gap, as they were), partly
+# unknown ones are written with 'U' for the missing DS.
+# ...Returns the number of rows written.
+# ...Raises ValueError if src's data sources don't match DSList or it
+# ...is already tiered (migrating it again would only lose resolution).
+# ===================================================================
+def migrate(src, dst):
+    if tiered(src):
+        raise ValueError('%s is already in the tiered layout' % src)
+    first = rrdtool.first(src)
+    last = rrdtool.last(src)
+    names = [name for name, lo, hi in DSList]
+    create(dst, first - Step)
+    written = 0
+    done = first - Step     # newest timestamp written to dst
+    t = first - Step
+    while t < last:
+        end = min(t + MigrateChunk * Step, last)
+        (fstart, fend, fstep), fnames, rows = rrdtool.fetch(src, 'AVERAGE', '-r', str(Step),
+                                                          '-s', str(t), '-e', str(end))
+        if list(fnames) != names:
+            raise ValueError('%s data sources %s do not match the schema' % (src, ', '.join(fnames)))
+        batch = []
+        ts = fstart
+        for row in rows:
+            ts += fstep         # a row is stamped with the end of its interval
+            if ts <= done or ts > last:
+                continue
+            if all(v is None for v in row):
+                continue
+            batch.append('%d:%s' % (ts, ':'.join(['U' if v is None else repr(v) for v in row])))
+            done = ts
+        if batch:
+            rrdtool.update(dst, *batch)
+            written += len(batch)
+        t = end
+    return written
+# ... End migrate Function ...
+
+# ===================================================================
+# Migrate a station's RRD in place: write 'path.new', keep the original
+# as 'path.old' (unless keep is False) and move the new one in. A file
+# already in the tiered layout is skipped, so running migrate twice
+# can't overwrite the first run's .old with migrated data.
+# ===================================================================
+def migrateFile(path, keep=True):
+    if tiered(path):
+        print '%s: already in the tiered layout, skipped' % path
+        return
+    tmp = path + '.new'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    before = os.path.getsize(path)
+    n = migrate(path, tmp)
+    if keep:
+        os.rename(path, path + '.old')
+    os.rename(tmp, path)
+    print '%s: %d rows migrated, %d -> %d bytes' % (path, n, before, os.path.getsize(path))
+# ... End migrateFile Function ...
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    cmd = args.pop(0) if args else None
+    if cmd == 'size':
+        print 'tiered layout: %d DS, %d bytes per station' % (len(DSList), size())
+    elif cmd == 'script' and len(args) == 1:
+        sys.stdout.write(script(args[0]))
+    elif cmd == 'create' and args:
+        for path in args:
+            create(path)
+    elif cmd == 'migrate' and args:
+        keep = True
+        if args[0] == '--no-keep':
+            keep = False
+            args.pop(0)
+        failed = 0
+        for path in args:
+            try:
+                migrateFile(path, keep)
+            except (rrdtool.error, ValueError, OSError) as e:
+                print '%s: migration failed: %s' % (path, e)
+                failed += 1
+        if failed:
+            sys.exit(1)
+    else:
+        print 'usage: %s size | script file.rrd | create file.rrd ... | migrate [--no-keep] file.rrd ...' % sys.argv[0]
+        sys.exit(1)
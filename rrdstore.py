@@ -0,0 +1,154 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Buffered RRD writer.
+#
+# Every sample used to be its own rrdtool.update call, timestamped 'N'
+# (when the update ran, after the network round trip, not when the
+# frame was captured). RRDWriter keeps the samples per RRD file with
+# their capture time and writes several timestamps in one update call.
+#
+# Optionally the updates go through a local rrdcached daemon (RRDDaemon,
+# e.g. 'unix:/var/run/rrdcached.sock'), which batches the disk writes
+# further. Before graphs are drawn everything buffered here is written
+# and rrdcached is told to flush those files (flush()).
+#
+# Command line, to make rrdcached write files out before graphing:
+#   python rrdstore.py --daemon unix:/var/run/rrdcached.sock *_mppt.rrd
+#---------------------------------------------------------------
+import sys
+import time
+
+import rrdtool
+
+class RRDWriter(object):
+
+    # ===================================================================
+    #  rrddir   - directory holding the StationName.rrd files
+    #  batch    - samples buffered per RRD before it is written
+    #  maxage   - seconds the oldest buffered sample may wait. Keeps the
+    #             graphs and a crash's losses bounded.
+    #  daemon   - rrdcached address, None to write the files directly
+    #  template - DS names the values are in, 'a:b:c' (update --template).
+    #             None for the file's own DS order.
+    #  metrics  - optional metrics.Metrics, the update calls are timed
+    #             as the 'store' phase
+    # ===================================================================
+    def __init__(self, rrddir, batch=5, maxage=600, daemon=None, template=None, metrics=None):
+        self.rrddir = rrddir
+        self.metrics = metrics
+        self.template = template
+        self.batch = batch
+        self.maxage = maxage
+        self.daemon = daemon
+        self.pending = {}    # StationName -> ['stamp:v:v:...', ...]
+        self.first = {}      # StationName -> capture time of oldest pending
+        self.last = {}       # StationName -> last timestamp handed to rrdtool
+        self.updates = 0     # rrdtool.update calls made
+        self.samples = 0     # samples written
+        self.paths = {}      # StationName -> RRD file, for the ones not in rrddir
+
+    # RRD file for a station
+    def path(self, StationName):
+        return self.paths.get(StationName) or self.rrddir + StationName + '.rrd'
+
+    # ===================================================================
+    # Stations whose RRD is not rrddir/StationName.rrd.
+    #  paths - {StationName: RRD file}
+    # Buffered samples of a station that moved are written out first.
+    # ===================================================================
+    def setPaths(self, paths):
+        for name in self.pending.keys():
+            if paths.get(name) != self.paths.get(name):
+                self.flushStation(name)
+        self.paths = dict(paths)
+
+    # ===================================================================
+    # Buffer one sample.
+    #  stamp  - capture time (time.time()) of the frame
+    #  values - the text after 'timestamp:' in the update, 'v:v:v...'
+    # ...RRD needs strictly increasing whole second timestamps, a sample
+    # ...in the same second as the previous one is dropped.
+    # ===================================================================
+    def add(self, StationName, stamp, values):
+        ts = int(stamp)
+        if ts <= self.last.get(StationName, 0):
+            return
+        self.last[StationName] = ts
+        q = self.pending.get(StationName)
+        if q is None:
+            q = self.pending[StationName] = []
+            self.first[StationName] = stamp
+        q.append('%d:%s' % (ts, values))
+        if len(q) >= self.batch:
+            self.flushStation(StationName)
+
+    # ===================================================================
+    # Write any station whose oldest sample is older than maxage. Called
+    # once a cycle.
+    # ===================================================================
+    def flushDue(self, now=None):
+        if now is None:
+            now = time.time()
+        for name in self.pending.keys():
+            if now - self.first[name] >= self.maxage:
+                self.flushStation(name)
+
+    # ===================================================================
+    # Write the buffered samples of one station in a single update.
+    # ...On an rrdtool error the samples are reported and dropped so a
+    # ...bad file can't grow the buffer forever.
+    # ===================================================================
+    def flushStation(self, StationName):
+        q = self.pending.pop(StationName, None)
+        self.first.pop(StationName, None)
+        if not q:
+            return
+        args = [self.path(StationName)]
+        if self.daemon:
+            args += ['--daemon', self.daemon]
+        if self.template:
+            args += ['--template', self.template]
+        args += q
+        t = time.time()
+        try:
+            ret = rrdtool.update(*args)
+        except rrdtool.error as e:
+            print 'Station %s rrdtool update error (%d samples dropped): %s' % (StationName, len(q), e)
+            return
+        if self.metrics is not None:
+            self.metrics.observe('store', StationName, time.time() - t)
+        if ret:
+            print rrdtool.error()
+        self.updates += 1
+        self.samples += len(q)
+
+    # ===================================================================
+    # Write everything buffered, then have rrdcached write those files
+    # to disk. Call before rendering graphs.
+    # ===================================================================
+    def flush(self):
+        names = self.pending.keys()
+        for name in names:
+            self.flushStation(name)
+        if self.daemon:
+            flushCached([self.path(name) for name in self.last.keys()], self.daemon)
+# ... End RRDWriter Class ...
+
+# ===================================================================
+# Ask rrdcached to write the passed RRD files out now.
+# ===================================================================
+def flushCached(paths, daemon):
+    if not paths:
+        return
+    try:
+        rrdtool.flushcached('--daemon', daemon, *paths)
+    except rrdtool.error as e:
+        print 'rrdcached flush error: %s' % (e)
+# ... End flushCached Function ...
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) < 3 or args[0] != '--daemon':
+        print 'usage: %s --daemon address file.rrd ...' % sys.argv[0]
+        sys.exit(1)
+    flushCached(args[2:], args[1])
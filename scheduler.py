@@ -0,0 +1,155 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Per-station poll scheduler.
+#
+# The main loop used to poll everyone and then sleep max(180, ...)
+# seconds, so every station was sampled every 3+ minutes however long
+# the polling took, against RRDs built with --step 60 / heartbeat 600.
+#
+# Scheduler gives each station its own interval and next due time:
+#  - first polls are spread over one interval, and every reschedule is
+#    jittered, so hundreds of stations don't all connect in one second
+#  - next due times are anchored to the schedule, not to when a poll
+#    finished, so a slow station only delays itself
+#  - a station is never handed out again while its poll is in flight
+#  - due stations come back ordered by how close they are to missing
+#    the RRD heartbeat. Ones that already missed it go last, the gap in
+#    their RRD is there anyway.
+#---------------------------------------------------------------
+import heapq
+import random
+import time
+
+class StationSched(object):
+    __slots__ = ('station', 'interval', 'due', 'last_ok', 'busy', 'gen')
+
+    def __init__(self, station, interval):
+        self.station = station    # (StationName, IP, Port)
+        self.interval = interval
+        self.due = 0
+        self.last_ok = 0          # time of the last good sample
+        self.busy = False         # poll in flight
+        self.gen = 0              # bumped on reschedule, stale heap entries are skipped
+# ... End StationSched Class ...
+
+class Scheduler(object):
+
+    # ===================================================================
+    #  interval  - default seconds between polls of a station
+    #  jitter    - +/- fraction of the interval added to each reschedule
+    #  heartbeat - the RRD heartbeat, a station with no good sample for
+    #              this long has a gap (unknown) in its RRD
+    # ===================================================================
+    def __init__(self, interval=60, jitter=0.1, heartbeat=600):
+        self.interval = interval
+        self.jitter = jitter
+        self.heartbeat = heartbeat
+        self.stns = {}     # StationName -> StationSched
+        self.heap = []     # (due, gen, StationName)
+
+    # ===================================================================
+    # Bring the schedule in line with the station list.
+    #  stations  - list of (StationName, IP, Port)
+    #  intervals - optional {StationName: seconds} overriding 'interval'
+    # New stations get their first poll spread over one interval.
+    # ===================================================================
+    def setStations(self, stations, intervals=None, now=None):
+        if now is None:
+            now = time.time()
+        if intervals is None:
+            intervals = {}
+        wanted = {}
+        for stn in stations:
+            wanted[stn[0]] = stn
+        for name in self.stns.keys():
+            if name not in wanted:
+                del self.stns[name]
+        for name, stn in wanted.items():
+            interval = intervals.get(name) or self.interval
+            ss = self.stns.get(name)
+            if ss is None:
+                ss = self.stns[name] = StationSched(stn, interval)
+                ss.last_ok = now    # give it a full heartbeat before it counts as late
+                self._push(ss, now + random.uniform(0, interval))
+            else:
+                ss.station = stn
+                if ss.interval != interval:
+                    ss.interval = interval
+                    if not ss.busy and ss.due > now + interval:
+                        self._push(ss, now + random.uniform(0, interval))
+
+    # ===================================================================
+    # Stations due at 'now', marked in flight. Most urgent first, see
+    # the top of this file. Returns a list of (StationName, IP, Port).
+    # ===================================================================
+    def due(self, now=None):
+        if now is None:
+            now = time.time()
+        out = []
+        while self.heap and self.heap[0][0] <= now:
+            due, gen, name = heapq.heappop(self.heap)
+            ss = self.stns.get(name)
+            if ss is None or ss.gen != gen or ss.busy:
+                continue
+            ss.busy = True
+            out.append(ss)
+        out.sort(key=lambda ss: self._slack(ss, now))
+        return [ss.station for ss in out]
+
+    # ===================================================================
+    # A poll finished. 'ok' is True if it produced a good sample. The
+    # next poll is one interval after the one just done was due (plus
+    # jitter). If that is already past, missed slots are skipped rather
+    # than polled back to back.
+    # 'interval' overrides the station's interval for this one reschedule
+    # (the slow probe schedule of an open circuit breaker).
+    # ===================================================================
+    def done(self, StationName, ok, now=None, interval=None):
+        ss = self.stns.get(StationName)
+        if ss is None:
+            return
+        if now is None:
+            now = time.time()
+        ss.busy = False
+        if ok:
+            ss.last_ok = now
+        if interval is None:
+            interval = ss.interval
+        j = interval * self.jitter
+        nxt = ss.due + interval + random.uniform(-j, j)
+        if nxt <= now:
+            nxt = now + random.uniform(0, j)
+        self._push(ss, nxt)
+
+    # ===================================================================
+    # time.time() of the next due poll, None if nothing is scheduled.
+    # ===================================================================
+    def nextDue(self):
+        while self.heap:
+            due, gen, name = self.heap[0]
+            ss = self.stns.get(name)
+            if ss is not None and ss.gen == gen and not ss.busy:
+                return due
+            heapq.heappop(self.heap)
+        return None
+
+    # ===================================================================
+    # StationNames with no good sample for longer than the heartbeat.
+    # ===================================================================
+    def late(self, now=None):
+        if now is None:
+            now = time.time()
+        return [name for name, ss in self.stns.items() if now - ss.last_ok > self.heartbeat]
+
+    # seconds left before the heartbeat runs out, ones already out last
+    def _slack(self, ss, now):
+        slack = ss.last_ok + self.heartbeat - now
+        if slack < 0:
+            return self.heartbeat - slack
+        return slack
+
+    def _push(self, ss, due):
+        ss.gen += 1
+        ss.due = due
+        heapq.heappush(self.heap, (due, ss.gen, ss.station[0]))
+# ... End Scheduler Class ...
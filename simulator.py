@@ -0,0 +1,345 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Simulated translator fleet, for testing and benchmarking without
+# radios or MPPTs.
+#
+# Each simulated station listens on its own localhost port and talks
+# like the Arduino translator:
+#   - a new connection is in Timed mode, a status frame every
+#     TimedPeriod seconds
+#   - 'R\r' answers with one status frame and stops the timed frames
+#   - 'T\r' goes back to Timed mode
+#   - 'L<n>\r' answers with daily log record n (backfill.py)
+# Frames are '$hdr,fwrev,<45 PStatLst registers>*XX\r\n' with made up
+# but sane values (a battery voltage wandering around 13V, a rising
+# hourmeter), so they decode and graph like the real thing.
+#
+# Per station, to exercise the pollers:
+#   latency   - seconds before an answer
+#   jitter    - +/- seconds of random extra latency
+#   fragment  - pieces a frame is sent in, FragmentGap seconds apart
+#   corrupt   - fraction of frames sent with a bad checksum
+#   drop      - fraction of requests answered by closing the connection
+#
+# Everything runs in one process on one poll loop, so thousands of
+# stations fit (raise 'ulimit -n', a station is a listening socket
+# plus one per connection).
+#
+#   python simulator.py [-n stations] [-p first port] [--latency s]
+#       [--jitter s] [--fragment n] [--corrupt f] [--drop f]
+#       [--list StationList.txt]
+# --list writes a station list for Insert8.3.py / bench.py.
+#---------------------------------------------------------------
+import errno
+import heapq
+import random
+import select
+import socket
+import sys
+import time
+
+from framer import xorsum
+from mppt import PLogLst, PStatLst, vfactor, vrfactor, ifactor, pofactor
+
+Hdr = 'MPPT'          # frame header and firmware revision fields
+FwRev = '83'
+TimedPeriod = 5.0     # seconds between frames in Timed mode
+FragmentGap = 0.01    # seconds between the pieces of a fragmented frame
+FirstPort = 20000
+Backlog = 64
+
+# ===================================================================
+# A status or log frame for a list of register values. 'corrupt'
+# sends it with a wrong checksum.
+# ===================================================================
+def makeFrame(regs, corrupt=False):
+    body = '%s,%s,%s' % (Hdr, FwRev, ','.join([str(v) for v in regs]))
+    cs = xorsum(body)
+    if corrupt:
+        cs ^= 0x5A
+    return '$%s*%02X\r\n' % (body, cs)
+# ... End makeFrame Function ...
+
+class StationSim(object):
+    __slots__ = ('name', 'port', 'latency', 'jitter', 'fragment', 'corrupt',
+                 'drop', 'vbatt', 'hours', 'started', 'rand')
+
+    def __init__(self, name, port, latency=0.0, jitter=0.0, fragment=1, corrupt=0.0, drop=0.0):
+        self.name = name
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.fragment = max(1, fragment)
+        self.corrupt = corrupt
+        self.drop = drop
+        self.rand = random.Random(name)
+        self.vbatt = self.rand.uniform(12.4, 13.6)
+        self.hours = self.rand.randint(1000, 60000)
+        self.started = time.time()
+
+    # seconds before the next answer
+    def delay(self):
+        if self.jitter:
+            return max(0.0, self.latency + self.rand.uniform(-self.jitter, self.jitter))
+        return self.latency
+
+    # ===================================================================
+    # The 45 status registers, PStatLst order.
+    # ===================================================================
+    def status(self):
+        self.vbatt = min(14.4, max(11.5, self.vbatt + self.rand.gauss(0, 0.02)))
+        hm = self.hours + int((time.time() - self.started) // 3600)
+        vb = int(self.vbatt / vfactor)
+        va = int(self.rand.uniform(0, 20) / vfactor)
+        ic = int(self.rand.uniform(0, 4) / ifactor)
+        il = int(self.rand.uniform(0.2, 0.6) / ifactor)
+        r = {'Adc_vb_f': vb, 'Adc_va_f': va, 'Adc_vl_f': vb, 'Adc_ic_f': ic, 'Adc_il_f': il,
+             'T_hs': 25, 'T_batt': 20, 'T_amb': 20, 'T_rts': 20,
+             'Charge_State': 7 if ic else 3, 'Vb_f': vb, 'Vb_ref': int(14.1 / vrfactor),
+             'KWhc': hm // 10, 'Load_State': 1, 'V_lvd': int(11.0 / vfactor),
+             'Hourmeter_HI': hm >> 16, 'Hourmeter_LO': hm & 0xFFFF,
+             'LED_State': 4, 'Power_out': int(self.vbatt * ic * ifactor / pofactor),
+             'Sweep_Vmp': va, 'Sweep_Voc': va, 'Vb_min_daily': vb - 50, 'Vb_max_daily': vb + 50,
+             'Vb_min': vb - 200, 'Vb_max': vb + 200}
+        return [r.get(row[0], 0) for row in PStatLst]
+
+    # ===================================================================
+    # Daily log record n (0 = yesterday), PLogLst order.
+    # ===================================================================
+    def logRecord(self, n):
+        hm = self.hours + int((time.time() - self.started) // 3600) - 24 * n
+        vb = int(self.vbatt / vfactor)
+        r = {'hourmeter': hm & 0xFFFF, 'Vb_min_daily': vb - 100, 'Vb_max_daily': vb + 100,
+             'Ahc_daily': 120, 'Ahl_daily': 100, 'Va_max_daily': int(19.0 / vfactor),
+             'Time_ab_daily': 60, 'Time_fl_daily': 240}
+        return [r.get(row[0], 0) for row in PLogLst]
+# ... End StationSim Class ...
+
+class SimConn(object):
+    __slots__ = ('sock', 'station', 'inbuf', 'outbuf', 'timed', 'closed')
+
+    def __init__(self, sock, station):
+        self.sock = sock
+        self.station = station
+        self.inbuf = ''
+        self.outbuf = ''
+        self.timed = True      # translators start in Timed mode
+        self.closed = False
+# ... End SimConn Class ...
+
+class Simulator(object):
+
+    # ===================================================================
+    #  stations - list of StationSim
+    # ===================================================================
+    def __init__(self, stations, host='127.0.0.1'):
+        self.p = select.poll()
+        self.listeners = {}   # fd -> (listening socket, StationSim)
+        self.conns = {}       # fd -> SimConn
+        self.timers = []      # heap of (due, seq, action, SimConn, data)
+        self.seq = 0
+        self.frames = 0       # frames sent
+        for st in stations:
+            ls = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            ls.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            ls.bind((host, st.port))
+            ls.listen(Backlog)
+            ls.setblocking(0)
+            self.listeners[ls.fileno()] = (ls, st)
+            self.p.register(ls.fileno(), select.POLLIN)
+
+    # ===================================================================
+    # Serve until 'until' (time.time()), forever if None.
+    # ===================================================================
+    def run(self, until=None):
+        while until is None or time.time() < until:
+            now = time.time()
+            wait = 1.0
+            if self.timers:
+                wait = min(wait, max(0.0, self.timers[0][0] - now))
+            for fd, ev in self.p.poll(wait * 1000):
+                if fd in self.listeners:
+                    self._accept(fd)
+                    continue
+                c = self.conns.get(fd)
+                if c is None:
+                    continue
+                if ev & select.POLLOUT:
+                    self._write(c)
+                if ev & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                    self._read(c)
+            now = time.time()
+            while self.timers and self.timers[0][0] <= now:
+                due, seq, action, c, data = heapq.heappop(self.timers)
+                if not c.closed:
+                    action(c, data)
+
+    def _later(self, secs, action, c, data=None):
+        self.seq += 1
+        heapq.heappush(self.timers, (time.time() + secs, self.seq, action, c, data))
+
+    def _accept(self, fd):
+        ls, st = self.listeners[fd]
+        try:
+            sock, addr = ls.accept()
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        sock.setblocking(0)
+        c = SimConn(sock, st)
+        self.conns[sock.fileno()] = c
+        self.p.register(sock.fileno(), select.POLLIN)
+        self._later(TimedPeriod, self._timed, c)
+
+    def _read(self, c):
+        try:
+            data = c.sock.recv(256)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ''
+        if not data:
+            self._close(c)
+            return
+        c.inbuf += data
+        while '\r' in c.inbuf:
+            cmd, c.inbuf = c.inbuf.split('\r', 1)
+            cmd = cmd.strip()
+            st = c.station
+            if cmd == 'R':
+                c.timed = False
+                if st.drop and st.rand.random() < st.drop:
+                    self._later(st.delay(), self._drop, c)
+                else:
+                    self._later(st.delay(), self._answer, c, st.status())
+            elif cmd == 'T':
+                if not c.timed:
+                    c.timed = True
+                    self._later(TimedPeriod, self._timed, c)
+            elif cmd.startswith('L') and cmd[1:].isdigit():
+                self._later(st.delay(), self._answer, c, st.logRecord(int(cmd[1:])))
+
+    # send a frame, in st.fragment pieces
+    def _answer(self, c, regs):
+        st = c.station
+        frame = makeFrame(regs, st.corrupt and st.rand.random() < st.corrupt)
+        self.frames += 1
+        size = -(-len(frame) // st.fragment)
+        for i in range(st.fragment):
+            piece = frame[i * size:(i + 1) * size]
+            if i == 0:
+                self._send(c, piece)
+            else:
+                self._later(i * FragmentGap, self._send, c, piece)
+
+    def _timed(self, c, data):
+        if c.timed:
+            self._answer(c, c.station.status())
+            self._later(TimedPeriod, self._timed, c)
+
+    def _drop(self, c, data):
+        self._close(c)
+
+    def _send(self, c, data):
+        c.outbuf += data
+        self._write(c)
+
+    def _write(self, c):
+        if c.outbuf:
+            try:
+                sent = c.sock.send(c.outbuf)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    sent = 0
+                else:
+                    self._close(c)
+                    return
+            c.outbuf = c.outbuf[sent:]
+        self.p.modify(c.sock.fileno(), select.POLLIN | (select.POLLOUT if c.outbuf else 0))
+
+    def _close(self, c):
+        if c.closed:
+            return
+        c.closed = True
+        fd = c.sock.fileno()
+        self.p.unregister(fd)
+        del self.conns[fd]
+        c.sock.close()
+
+    def close(self):
+        for c in self.conns.values():
+            self._close(c)
+        for ls, st in self.listeners.values():
+            ls.close()
+        self.listeners = {}
+# ... End Simulator Class ...
+
+# ===================================================================
+# n simulated stations SIM0000_mppt ... on ports first, first+1, ...
+# ===================================================================
+def fleet(n, first=FirstPort, **opts):
+    return [StationSim('SIM%04d_mppt' % i, first + i, **opts) for i in range(n)]
+# ... End fleet Function ...
+
+# ===================================================================
+# Let this process have as many open files as it is allowed.
+# ===================================================================
+def raiseFileLimit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+        except (ValueError, resource.error):
+            pass
+# ... End raiseFileLimit Function ...
+
+# ===================================================================
+# Write a StationList.txt for a fleet.
+# ===================================================================
+def writeStationList(path, stations, host='127.0.0.1'):
+    f = open(path, 'w')
+    for st in stations:
+        f.write('%s,%s,%d\n' % (st.name, host, st.port))
+    f.close()
+# ... End writeStationList Function ...
+
+if __name__ == '__main__':
+    n = 10
+    first = FirstPort
+    opts = {}
+    listfile = None
+    args = sys.argv[1:]
+    try:
+        while args:
+            a = args.pop(0)
+            if a == '-n':
+                n = int(args.pop(0))
+            elif a == '-p':
+                first = int(args.pop(0))
+            elif a in ('--latency', '--jitter', '--corrupt', '--drop'):
+                opts[a[2:]] = float(args.pop(0))
+            elif a == '--fragment':
+                opts['fragment'] = int(args.pop(0))
+            elif a == '--list':
+                listfile = args.pop(0)
+            else:
+                raise ValueError(a)
+    except (ValueError, IndexError):
+        print 'usage: %s [-n stations] [-p first port] [--latency s] [--jitter s] [--fragment n] [--corrupt f] [--drop f] [--list StationList.txt]' % sys.argv[0]
+        sys.exit(1)
+    raiseFileLimit()
+    stations = fleet(n, first, **opts)
+    if listfile:
+        writeStationList(listfile, stations)
+    sim = Simulator(stations)
+    print '%d simulated stations on ports %d-%d' % (n, first, first + n - 1)
+    sys.stdout.flush()
+    try:
+        sim.run()
+    except KeyboardInterrupt:
+        sim.close()
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Station registry.
+#
+# StationList.txt is read once, every line checked, and only read again
+# when the file changes. One station per line:
+#
+#   StationName,IP,Port[,Poll Interval][,key=value ...]
+#
+#   MARC_mppt,166.248.114.3,5001
+#   LCCR_mppt,166.140.171.251,5000,300
+#   FISH_mppt,192.168.33.100,5001,link=lan,timeout=5
+#   BURN_mppt,10.1.2.3,5001,interval=120,rrd=/data/rrd/BURN_mppt.rrd
+#
+# Optional per-station fields:
+#   interval - seconds between polls (the same as the 4th field)
+#   timeout  - longest connect / receive timeout for the station
+#   link     - 'lan', 'radio' or 'cell'. With no timeout given the
+#              link's LinkTimeouts entry is the longest timeout
+#   rrd      - the station's RRD file, instead of StationName.rrd in
+#              the RRD directory
+#
+# A line starting with # is skipped. A bad line (too few fields, a port
+# or interval that isn't a number, an unknown key, a name already used)
+# is reported with its line number and skipped. The rest of the file is
+# still read: one typo no longer drops every station after it.
+#
+# StationRegistry.refresh() looks at the file's mtime, size and inode at
+# most every 'check' seconds and re-reads it only if one of them moved.
+# If the file can't be read the last good list is kept.
+#---------------------------------------------------------------
+import os
+import time
+
+StationFile = 'StationList.txt'
+CheckSecs = 5       # seconds between looks at the file's mtime
+
+# longest timeout per link type, for stations that don't give one
+LinkTimeouts = {'lan': 5.0, 'radio': 15.0, 'cell': 30.0}
+
+Keys = ('interval', 'timeout', 'link', 'rrd')
+
+class Station(object):
+    __slots__ = ('name', 'host', 'port', 'interval', 'timeout', 'link', 'rrd')
+
+    def __init__(self, name, host, port, interval=None, timeout=None, link=None, rrd=None):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.interval = interval    # None for the default PollInterval
+        self.timeout = timeout
+        self.link = link
+        self.rrd = rrd
+
+    # (StationName, IP, Port), what the poller, pool and scheduler take
+    def addr(self):
+        return (self.name, self.host, self.port)
+
+    # longest timeout for the station, None for the poller's own
+    def ceiling(self):
+        if self.timeout is not None:
+            return self.timeout
+        return LinkTimeouts.get(self.link)
+# ... End Station Class ...
+
+def _seconds(key, text):
+    try:
+        v = float(text)
+    except ValueError:
+        raise ValueError('%s %r is not a number' % (key, text))
+    if not v > 0:
+        raise ValueError('%s %r must be more than 0' % (key, text))
+    return v
+
+# ===================================================================
+# One (non comment) station line to a Station.
+# ...Raises ValueError saying what is wrong with it.
+# ===================================================================
+def parseLine(line):
+    fields = [f.strip() for f in line.split(',')]
+    while fields and not fields[-1]:    # trailing commas
+        fields.pop()
+    if len(fields) < 3:
+        raise ValueError('needs StationName,IP,Port')
+    name, host, port = fields[:3]
+    if not name or len(name.split()) != 1:
+        raise ValueError('bad StationName %r' % name)
+    if not host:
+        raise ValueError('no IP address')
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('port %r is not a number' % port)
+    if not 0 < port < 65536:
+        raise ValueError('port %d out of range' % port)
+    st = Station(name, host, port)
+    for i, f in enumerate(fields[3:]):
+        if '=' not in f:
+            if i == 0 and f:     # the old positional poll interval
+                st.interval = _seconds('interval', f)
+                continue
+            raise ValueError('field %r is not key=value' % f)
+        key, value = [v.strip() for v in f.split('=', 1)]
+        if key not in Keys:
+            raise ValueError('unknown key %r' % key)
+        if key == 'interval' or key == 'timeout':
+            setattr(st, key, _seconds(key, value))
+        elif key == 'link':
+            if value not in LinkTimeouts:
+                raise ValueError('link %r is not one of %s' % (value, ', '.join(sorted(LinkTimeouts))))
+            st.link = value
+        elif not value:
+            raise ValueError('empty rrd path')
+        else:
+            st.rrd = value
+    return st
+# ... End parseLine Function ...
+
+# ===================================================================
+# Read a station list file.
+# ...Returns (stations, errors): the good lines as Station objects in
+# ...file order, and a message for each line that was skipped.
+# ...Raises IOError if the file can't be read.
+# ===================================================================
+def readStations(path):
+    stations = []
+    errors = []
+    seen = set()
+    f = open(path)
+    try:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            try:
+                st = parseLine(line)
+            except ValueError as e:
+                errors.append('line %d: %s' % (n, e))
+                continue
+            if st.name in seen:
+                errors.append('line %d: %s is already listed' % (n, st.name))
+                continue
+            seen.add(st.name)
+            stations.append(st)
+    finally:
+        f.close()
+    return stations, errors
+# ... End readStations Function ...
+
+class StationRegistry(object):
+
+    # ===================================================================
+    #  path  - the station list file
+    #  check - seconds between looks at the file, refresh() is cheap to
+    #          call every pass of a loop
+    # ===================================================================
+    def __init__(self, path, check=CheckSecs):
+        self.path = path
+        self.check = check
+        self.stations = []   # Station, file order
+        self.byname = {}     # StationName -> Station
+        self.sig = None      # (mtime, size, inode) of the file last read
+        self.checked = 0
+        self.error = None    # last problem reading the file, printed once
+        self.loads = 0
+
+    # ===================================================================
+    # Re-read the file if it changed.
+    # ...Returns True if the station list was (re)loaded.
+    # ===================================================================
+    def refresh(self, now=None, force=False):
+        if now is None:
+            now = time.time()
+        if not force and now - self.checked < self.check:
+            return False
+        self.checked = now
+        try:
+            st = os.stat(self.path)
+            sig = (st.st_mtime, st.st_size, st.st_ino)
+            if sig == self.sig and not force:
+                return False
+            stations, errors = readStations(self.path)
+        except (IOError, OSError) as e:
+            msg = str(e)
+            if msg != self.error:
+                print 'Station list %s error: %s, keeping %d stations' % (self.path, msg, len(self.stations))
+            self.error = msg
+            return False
+        self.error = None
+        for e in errors:
+            print 'Station list %s %s, skipped' % (self.path, e)
+        self.sig = sig
+        self.stations = stations
+        self.byname = dict((s.name, s) for s in stations)
+        self.loads += 1
+        return True
+
+    def get(self, StationName):
+        return self.byname.get(StationName)
+
+    def names(self):
+        return [s.name for s in self.stations]
+
+    # list of (StationName, IP, Port)
+    def addrs(self):
+        return [s.addr() for s in self.stations]
+
+    # {StationName: poll interval} for the stations that give one
+    def intervals(self):
+        return dict((s.name, s.interval) for s in self.stations if s.interval is not None)
+
+    # {StationName: RRD file} for the stations that give one
+    def rrds(self):
+        return dict((s.name, s.rrd) for s in self.stations if s.rrd is not None)
+# ... End StationRegistry Class ...
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Storage backends for decoded samples.
+#
+# Insert8.3.py hands every good sample (a decoder.Record) to one Storage
+# object instead of calling the RRD writer directly. A backend is any
+# object with these methods:
+#
+#   setStations(names) - the station list was (re)read
+#   add(rec)           - buffer one sample. rec.station, rec.stamp and
+#                        rec.duration (Comm_Duration) are filled in.
+#   flushDue(now)      - write whatever has waited long enough
+#   flush()            - write everything (SIGUSR1, shutdown)
+#
+# RRDStorage is the RRD files (rrdstore.RRDWriter + rrdschema),
+# rawstore.RawStore keeps every raw sample in column files, Storages
+# sends each sample to several.
+#---------------------------------------------------------------
+import rrdschema
+
+class Storage(object):
+
+    def setStations(self, names):
+        pass
+
+    def add(self, rec):
+        pass    # a backend that stores nothing, subclasses override it
+
+    def flushDue(self, now=None):
+        pass
+
+    def flush(self):
+        pass
+# ... End Storage Class ...
+
+# ===================================================================
+# The StationName.rrd files. Missing ones are created when the station
+# list is read, samples go through the compiled update template.
+#  writer   - rrdstore.RRDWriter, built with template.template
+#  template - rrdschema.UpdateTemplate
+# ===================================================================
+class RRDStorage(Storage):
+
+    def __init__(self, writer, template):
+        self.writer = writer
+        self.template = template
+
+    def setStations(self, names):
+        rrdschema.provision(self.writer.rrddir, names, self.writer.paths)
+
+    def add(self, rec):
+        self.writer.add(rec.station, rec.stamp, self.template.values(rec, rec.duration))
+
+    def flushDue(self, now=None):
+        self.writer.flushDue(now)
+
+    def flush(self):
+        self.writer.flush()
+# ... End RRDStorage Class ...
+
+# ===================================================================
+# Fan out to several backends. A backend that raises is reported and
+# the others still get the sample.
+# ===================================================================
+class Storages(Storage):
+
+    def __init__(self, backends):
+        self.backends = list(backends)
+
+    def _each(self, method, *args):
+        for b in self.backends:
+            try:
+                getattr(b, method)(*args)
+            except (IOError, OSError) as e:
+                print '%s %s error: %s' % (b.__class__.__name__, method, e)
+
+    def setStations(self, names):
+        self._each('setStations', names)
+
+    def add(self, rec):
+        self._each('add', rec)
+
+    def flushDue(self, now=None):
+        self._each('flushDue', now)
+
+    def flush(self):
+        self._each('flush')
+# ... End Storages Class ...
@@ -0,0 +1,302 @@
+#!/usr/bin/python
+#---------------------------------------------------------------
+# Multi-process supervisor for large station fleets.
+#
+# One Insert8.3.py does the polling, decoding, RRD writes and logging
+# for every station on one core. The supervisor runs Workers copies of
+# it instead, each given one shard of StationList.txt:
+#
+#   python Insert8.3.py --shard i/n --metrics-port p
+#
+# A station belongs to shard crc32(StationName) % n. The hash is
+# stable, so when stations are added or removed only those stations
+# move: every worker re-reads the list (StationReload) and picks up or
+# drops its own. A station's RRD is only ever written by its one
+# worker. Each worker has its own log (Insert8.3-shard<i>.log), capture
+# and delta directories (shard<i>/), alert file (alerts-shard<i>.jsonl),
+# live socket and /metrics port (MetricsPort + 1 + i).
+#
+# A worker that dies is started again, after RestartMin seconds
+# doubling to RestartMax if it keeps dying. Every StatsInterval the
+# workers' metrics are read and a line per shard printed (stations,
+# polls and failures since last time, polls/s). MetricsPort serves all
+# the workers' metrics in one page, each sample labelled shard="i",
+# plus mcsoh_worker_up and mcsoh_worker_restarts_total.
+#
+# 'pkill -USR1 -f Insert8.3.py' (all.sh) still reaches every worker.
+#
+#   python supervisor.py [-n workers] [-p metrics port]
+#---------------------------------------------------------------
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib2
+import zlib
+
+import metrics
+
+Workers = 4
+MetricsPort = 9108    # the combined /metrics, workers use the ports after it
+Script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Insert8.3.py')
+RestartMin = 1.0      # seconds before restarting a worker that died
+RestartMax = 60.0     # cap for the doubling restart delay
+RestartReset = 300    # seconds up after which a worker's delay starts over
+StatsInterval = 60    # seconds between stats lines
+ScrapeTimeout = 5     # seconds to wait for a worker's /metrics
+
+# ===================================================================
+# The shard (0..n-1) a station belongs to. Stable across runs and
+# machines, unlike hash().
+# ===================================================================
+def shardOf(StationName, n):
+    return (zlib.crc32(StationName) & 0xffffffff) % n
+# ... End shardOf Function ...
+
+# ===================================================================
+# Combine several Prometheus text pages into one, every sample of page
+# i labelled shard="i". HELP / TYPE lines are kept once per family.
+#  pages - list of (shard, text)
+# ===================================================================
+def mergeMetrics(pages):
+    order = []
+    heads = {}       # family -> [HELP / TYPE lines]
+    samples = {}     # family -> [sample lines]
+    for shard, text in pages:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                family = line.split()[2]
+                if family not in heads:
+                    order.append(family)
+                    heads[family] = []
+                    samples[family] = []
+                if line not in heads[family]:
+                    heads[family].append(line)
+                continue
+            if not line or line.startswith('#') or family is None:
+                continue
+            if '{' in line:
+                name, rest = line.split('{', 1)
+                samples[family].append('%s{shard="%d",%s' % (name, shard, rest))
+            else:
+                name, rest = line.split(' ', 1)
+                samples[family].append('%s{shard="%d"} %s' % (name, shard, rest))
+    out = []
+    for family in order:
+        out.extend(heads[family])
+        out.extend(samples[family])
+    return '\n'.join(out) + '\n'
+# ... End mergeMetrics Function ...
+
+# ===================================================================
+# Sum of a counter over all stations in a metrics page, and the
+# stations seen in it. ({station: value}, total)
+# ===================================================================
+def counterOf(text, name):
+    per = {}
+    head = name + '{'
+    for line in text.splitlines():
+        if line.startswith(head):
+            labels, value = line[len(head):].rsplit('} ', 1)
+            for label in labels.split(','):
+                if label.startswith('station="'):
+                    per[label[9:-1]] = float(value)
+    return per, sum(per.values())
+# ... End counterOf Function ...
+
+class Worker(object):
+    __slots__ = ('shard', 'port', 'proc', 'started', 'backoff', 'restart_at',
+                 'restarts', 'polls', 'failures')
+
+    def __init__(self, shard, port):
+        self.shard = shard
+        self.port = port
+        self.proc = None
+        self.started = 0
+        self.backoff = RestartMin
+        self.restart_at = 0
+        self.restarts = 0
+        self.polls = 0         # polls / failures at the last stats line
+        self.failures = 0
+# ... End Worker Class ...
+
+class Supervisor(object):
+
+    # ===================================================================
+    #  n      - worker processes
+    #  port   - combined metrics port, worker i serves on port + 1 + i
+    #  script - the poller to run (Insert8.3.py)
+    # ===================================================================
+    def __init__(self, n=Workers, port=MetricsPort, script=Script, python=sys.executable):
+        self.n = n
+        self.port = port
+        self.script = script
+        self.python = python
+        self.workers = [Worker(i, port + 1 + i) for i in range(n)]
+        self.lock = threading.Lock()
+        self.statsAt = time.time()
+
+    def _spawn(self, w):
+        cmd = [self.python, self.script, '--shard', '%d/%d' % (w.shard, self.n),
+               '--metrics-port', str(w.port)]
+        w.proc = subprocess.Popen(cmd)
+        w.started = time.time()
+        print 'worker %d started, pid %d' % (w.shard, w.proc.pid)
+
+    # ===================================================================
+    # Start workers that aren't running and are due, note the ones that
+    # died. Called about once a second.
+    # ===================================================================
+    def check(self, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            for w in self.workers:
+                if w.proc is not None:
+                    ret = w.proc.poll()
+                    if ret is None:
+                        if now - w.started >= RestartReset:
+                            w.backoff = RestartMin
+                        continue
+                    print 'worker %d (pid %d) exited with %s, restart in %.0f s' % (w.shard, w.proc.pid, ret, w.backoff)
+                    w.proc = None
+                    w.restart_at = now + w.backoff
+                    w.backoff = min(w.backoff * 2, RestartMax)
+                    w.restarts += 1
+                elif now >= w.restart_at:
+                    try:
+                        self._spawn(w)
+                    except OSError as e:
+                        print 'worker %d start error: %s' % (w.shard, e)
+                        w.restart_at = now + w.backoff
+                        w.backoff = min(w.backoff * 2, RestartMax)
+
+    # ===================================================================
+    # Stop every worker, killing the ones still up after 'wait' seconds.
+    # ===================================================================
+    def stop(self, wait=10):
+        with self.lock:
+            procs = [w.proc for w in self.workers if w.proc is not None]
+            for w in self.workers:
+                w.proc = None
+        for p in procs:
+            try:
+                p.terminate()
+            except OSError:
+                pass
+        until = time.time() + wait
+        for p in procs:
+            while p.poll() is None and time.time() < until:
+                time.sleep(0.1)
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+
+    # a worker's metrics page, None if it can't be had
+    def scrape(self, w):
+        try:
+            return urllib2.urlopen('http://127.0.0.1:%d/metrics' % w.port, timeout=ScrapeTimeout).read()
+        except (urllib2.URLError, socket.error):
+            return None
+
+    # ===================================================================
+    # Combined metrics page (metrics.serve calls this).
+    # ===================================================================
+    def render(self):
+        pages = []
+        up = []
+        for w in self.workers:
+            text = self.scrape(w) if w.proc is not None else None
+            up.append((w.shard, text is not None, w.restarts))
+            if text is not None:
+                pages.append((w.shard, text))
+        out = [mergeMetrics(pages).rstrip('\n'),
+               '# HELP %sworker_up Worker answering its metrics' % metrics.Prefix,
+               '# TYPE %sworker_up gauge' % metrics.Prefix]
+        out += ['%sworker_up{shard="%d"} %d' % (metrics.Prefix, shard, ok) for shard, ok, r in up]
+        out += ['# HELP %sworker_restarts_total Times a worker was restarted' % metrics.Prefix,
+                '# TYPE %sworker_restarts_total counter' % metrics.Prefix]
+        out += ['%sworker_restarts_total{shard="%d"} %d' % (metrics.Prefix, shard, r) for shard, ok, r in up]
+        return '\n'.join(out) + '\n'
+
+    # ===================================================================
+    # Print a line per shard: stations, polls and failures since the
+    # last call, and the totals.
+    # ===================================================================
+    def stats(self):
+        now = time.time()
+        secs = max(now - self.statsAt, 1e-9)
+        self.statsAt = now
+        tstations = tpolls = tfails = 0
+        for w in self.workers:
+            text = self.scrape(w) if w.proc is not None else None
+            if text is None:
+                print 'shard %d: down, %d restarts' % (w.shard, w.restarts)
+                continue
+            ok, polls = counterOf(text, metrics.Prefix + 'polls_total')
+            bad, failures = counterOf(text, metrics.Prefix + 'poll_failures_total')
+            stations = len(set(ok) | set(bad))
+            # a restarted worker counts from 0 again
+            dp = polls - w.polls if polls >= w.polls else polls
+            df = failures - w.failures if failures >= w.failures else failures
+            w.polls, w.failures = polls, failures
+            print 'shard %d: %d stations, %d polls (%.2f/s), %d failures, %d restarts' % (
+                w.shard, stations, dp, dp / secs, df, w.restarts)
+            tstations += stations
+            tpolls += dp
+            tfails += df
+        print 'all: %d stations, %d polls (%.2f/s), %d failures' % (tstations, tpolls, tpolls / secs, tfails)
+        sys.stdout.flush()
+
+    # ===================================================================
+    # Run until SIGTERM / SIGINT.
+    # ===================================================================
+    def run(self):
+        try:
+            metrics.serve(self, self.port)
+        except socket.error as e:
+            print 'metrics port %d: %s, no combined /metrics' % (self.port, e)
+        statsDue = time.time() + StatsInterval
+        try:
+            while True:
+                self.check()
+                if time.time() >= statsDue:
+                    self.stats()
+                    statsDue += StatsInterval
+                sys.stdout.flush()
+                time.sleep(1)
+        finally:
+            self.stop()
+# ... End Supervisor Class ...
+
+# SIGTERM ends run() the same way as ^C
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+if __name__ == '__main__':
+    n = Workers
+    port = MetricsPort
+    args = sys.argv[1:]
+    try:
+        while args:
+            a = args.pop(0)
+            if a == '-n':
+                n = int(args.pop(0))
+            elif a == '-p':
+                port = int(args.pop(0))
+            else:
+                raise ValueError(a)
+        if n < 1:
+            raise ValueError(n)
+    except (ValueError, IndexError):
+        print 'usage: %s [-n workers] [-p metrics port]' % sys.argv[0]
+        sys.exit(1)
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        Supervisor(n, port).run()
+    except KeyboardInterrupt:
+        pass